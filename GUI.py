@@ -1,6 +1,20 @@
+import textwrap
+from collections import deque
+
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
 import pylab
+from matplotlib.colors import to_rgba_array
+from matplotlib.transforms import Bbox
+from matplotlib.widgets import LassoSelector, RectangleSelector
+
+from layout import LAYOUT_CACHE, cached_layout
+from reachability import ReachabilityIndex
+from spatial_index import GridIndex
+
+# characters per line of the info text, which is wrapped beforehand
+INFO_WIDTH = 80
 
 class AnnoteFinder:
     """
@@ -10,8 +24,32 @@ class AnnoteFinder:
     http://www.scipy.org/Cookbook/Matplotlib/Interactive_Plotting
     The click updates the graph, by making the current node yellow and showing
     the intra and inter state information.
+    The node positions are kept in a spatial index, which also serves
+    rectangle (right mouse button) and lasso (middle mouse button) selection
+    of many nodes at once.
+    Pressing 'd' highlights every node reachable from the current node, 'a'
+    every node it can be reached from, and escape clears the highlighting.
+    The graph, table and text are drawn once by draw(); a click only moves an
+    overlay of highlighted nodes and changes the text of the info panels, and
+    is blitted onto the canvas where the backend supports it. Only the parts
+    that changed are redrawn and blitted: the graph axes, the table cells
+    whose value changed, or the band of the figure the info text takes up.
     """
     def __init__(self, xdata, ydata, annotes, axis=None, xtol=None, ytol=None):
+        self.set_layout(xdata, ydata, annotes, xtol, ytol)
+        if axis is None: axis = pylab.gca()
+        self.axis= axis
+        self.drawnAnnotations = {}
+        self.links = []
+        self.current = None
+        self.selection = []
+        self.backgrounds = None
+        # the parts to redraw on the next refresh
+        self.dirty = set()
+
+    def set_layout(self, xdata, ydata, annotes, xtol=None, ytol=None):
+        ''' Set the node positions and rebuild the spatial index. Only needed
+        when the layout changes. '''
         self.xdata = xdata
         self.ydata = ydata
         self.annotes = annotes
@@ -19,32 +57,49 @@ class AnnoteFinder:
         if ytol is None: ytol = ((max(ydata) - min(ydata))/float(len(ydata)))/2
         self.xtol = xtol
         self.ytol = ytol
-        if axis is None: axis = pylab.gca()
-        self.axis= axis
-        self.drawnAnnotations = {}
-        self.links = []
+        self.index = GridIndex(xdata, ydata, annotes)
 
     def __call__(self, event):
         ''' Callback function for the on click event. '''
+        # the other buttons drag out selections
+        if event.button not in (None, 1):
+            return
         if event.inaxes:
             clickX = event.xdata
             clickY = event.ydata
             if self.axis is None or self.axis == event.inaxes:
-                annotes = []
-                data = zip(self.xdata, self.ydata, self.annotes)
-                for x, y, a in data:
-                    # Check if click is close to a node
-                    if clickX-self.xtol < x < clickX+self.xtol and \
-                            clickY-self.ytol < y < clickY+self.ytol:
-                        dx, dy = x - clickX, y - clickY
-                        annotes.append((dx*dx + dy*dy, x, y, a))
-                if annotes:
-                    # Select nearest node
-                    annotes.sort()
-                    distance, x, y, annote = annotes[0]
+                # Select nearest node that is close to the click
+                annote = self.index.nearest(clickX, clickY, self.xtol, self.ytol)
+                if annote is not None:
                     self.update_plot(annote)
 
-    def set_graph_info(self, ax1, ax2, ax3, graph, pos, parent_nodes, end_nodes, node_labels):
+    def select_rectangle(self, press, release):
+        ''' Callback for the rectangle selector. '''
+        self.update_selection(self.index.in_rectangle(
+            press.xdata, press.ydata, release.xdata, release.ydata))
+
+    def select_lasso(self, vertices):
+        ''' Callback for the lasso selector. '''
+        self.update_selection(self.index.in_polygon(vertices))
+
+    def highlight_reachable(self, event):
+        ''' Callback for key presses: highlight the descendants ('d') or
+        ancestors ('a') of the current node, or nothing (escape). '''
+        if event.key == 'escape':
+            self.selection = []
+        elif event.key in ('d', 'a') and self.current is not None:
+            if self.reachability is None:
+                self.reachability = ReachabilityIndex(self.graph)
+            if event.key == 'd':
+                self.selection = self.reachability.descendants(self.current)
+            else:
+                self.selection = self.reachability.ancestors(self.current)
+        else:
+            return
+        self.update_plot(self.current)
+
+    def set_graph_info(self, ax1, ax2, ax3, graph, pos, parent_nodes, end_nodes, node_labels,
+                       spaces=None):
         ''' The the plotting info, like axes, the graph etc. '''
         self.ax1 = ax1
         self.ax2 = ax2
@@ -54,6 +109,10 @@ class AnnoteFinder:
         self.parent_nodes = parent_nodes
         self.end_nodes = end_nodes
         self.node_labels = node_labels
+        # names the magnitudes in the table; None for the default spaces
+        self.spaces = spaces
+        # built on the first reachability query
+        self.reachability = None
 
     def generate_inter_state(self, parent, child, quantity):
         ''' Generate the inter state information. '''
@@ -103,20 +162,133 @@ class AnnoteFinder:
 
         return text
 
-    def show_graph(self, selected_node):
-        ''' Show the graph with yellow node a scurrent node. '''
+    def draw(self):
+        ''' Draw the graph, table and text once, and keep the artists that a
+        click changes. '''
         self.ax3.set_title('Select a state to see its value')
-        nx.draw_networkx_nodes(self.graph, self.pos, nodelist=self.end_nodes, node_color='blue')
-        nx.draw_networkx_nodes(self.graph, self.pos, nodelist=self.parent_nodes, node_color='red')
-        nx.draw_networkx_nodes(self.graph, self.pos, nodelist=[selected_node], node_color='yellow')
-        nx.draw_networkx_edges(self.graph, self.pos)
-        nx.draw_networkx_labels(self.graph, self.pos, self.node_labels)
+        # one collection for all nodes, blue is end node, red is parent node
+        end_nodes = set(self.end_nodes)
+        colors = ['blue' if node in end_nodes else 'red' for node in self.annotes]
+        self.nodes = nx.draw_networkx_nodes(self.graph, self.pos, ax=self.ax3,
+                                            nodelist=self.annotes, node_color=colors)
+        nx.draw_networkx_edges(self.graph, self.pos, ax=self.ax3)
+        self.labels = nx.draw_networkx_labels(self.graph, self.pos,
+                                              self.node_labels, ax=self.ax3)
+        # the current and selected nodes are drawn over the graph, so only
+        # they have to be redrawn when they change
+        self.highlight = self.ax3.scatter(np.empty(0), np.empty(0), s=300,
+                                          marker='o', zorder=2.5)
+        self.highlighted = []
+        self.colors = []
+
+        columns = ('INFLOW', 'VOLUME', 'OUTFLOW', 'HEIGHT', 'PRESSURE')
+        rows = ['Q', 'd']
+        self.table = self.ax2.table(cellText=[[''] * len(columns)] * len(rows),
+                                    rowLabels=rows, colLabels=columns,
+                                    loc='center', cellLoc='center')
+        # row 0 holds the column labels
+        self.cells = [self.table[row + 1, column]
+                      for row in range(len(rows)) for column in range(len(columns))]
+        self.info = self.ax1.text(0.3, -0.1, '')
+
+        self.canvas = self.ax3.figure.canvas
+        self.blit = self.canvas.supports_blit
+        if self.blit:
+            self.highlight.set_animated(True)
+            self.info.set_animated(True)
+            # the table is drawn with empty value cells, and the values on
+            # top of them by draw_part
+            for cell in self.cells:
+                cell.get_text().set_visible(False)
+            self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        ''' Keep the static part of a full redraw as the backgrounds to blit
+        onto: the graph axes, every value cell, and bands of the figure from
+        the bottom up to the top of each axes, for the info text, which
+        grows upwards. '''
+        figure = self.canvas.figure
+        self.regions = {'graph': self.ax3.bbox}
+        for cell in self.cells:
+            self.regions[cell] = cell.get_window_extent()
+        tops = sorted(ax.bbox.y1 for ax in (self.ax1, self.ax2, self.ax3))
+        self.bands = [Bbox.from_extents(figure.bbox.x0, figure.bbox.y0,
+                                        figure.bbox.x1, top) for top in tops[:-1]]
+        self.bands.append(figure.bbox)
+        self.backgrounds = dict((key, self.canvas.copy_from_bbox(bbox))
+                                for key, bbox in self.regions.items())
+        for band in self.bands:
+            self.backgrounds[band.y1] = self.canvas.copy_from_bbox(band)
+        for key in self.regions:
+            self.draw_part(key)
+        self.draw_part('info')
+        self.info_extent = self.info.get_window_extent(event.renderer)
+        self.dirty = set()
+
+    def draw_part(self, key):
+        ''' Draw the highlighted nodes ('graph'), the info text ('info') or
+        the value of a table cell onto the canvas. '''
+        figure = self.canvas.figure
+        if key == 'graph':
+            figure.draw_artist(self.highlight)
+            # the labels of the highlighted nodes go back on top
+            for node in self.highlighted:
+                if node in self.labels:
+                    figure.draw_artist(self.labels[node])
+        elif key == 'info':
+            figure.draw_artist(self.info)
+        else:
+            text = key.get_text()
+            text.set_visible(True)
+            figure.draw_artist(text)
+            text.set_visible(False)
+
+    def refresh(self):
+        ''' Show the changed parts, by blitting them if possible. '''
+        dirty = self.dirty
+        self.dirty = set()
+        if not self.blit or self.backgrounds is None:
+            self.canvas.draw_idle()
+            return
+        if 'info' in dirty:
+            # the lowest band holding the old and the new text, with every
+            # other part in it
+            extent = self.info.get_window_extent(self.canvas.get_renderer())
+            top = max(extent.y1, self.info_extent.y1)
+            self.info_extent = extent
+            band = next((band for band in self.bands if band.y1 >= top), self.bands[-1])
+            self.canvas.restore_region(self.backgrounds[band.y1])
+            for key, bbox in self.regions.items():
+                if bbox.y0 < band.y1:
+                    self.draw_part(key)
+                    dirty.discard(key)
+            self.draw_part('info')
+            self.canvas.blit(band)
+            dirty.discard('info')
+        for key in dirty:
+            self.canvas.restore_region(self.backgrounds[key])
+            self.draw_part(key)
+            self.canvas.blit(self.regions[key])
+
+    def show_graph(self, selected_node):
+        ''' Colour the current node yellow and the selected nodes orange. '''
+        highlighted = [node for node in self.selection if node != selected_node]
+        colors = ['orange'] * len(highlighted)
+        if selected_node is not None:
+            highlighted.append(selected_node)
+            colors.append('yellow')
+        if (highlighted, colors) == (self.highlighted, self.colors):
+            return
+        self.highlighted = highlighted
+        self.colors = colors
+        self.highlight.set_offsets(np.array([self.pos[node] for node in highlighted])
+                                   .reshape(-1, 2))
+        self.highlight.set_facecolor(to_rgba_array(colors) if colors else [])
+        self.dirty.add('graph')
 
     def show_inter_state_info(self, node):
         ''' Show the inter state information below the table.
         (only works on full screen) '''
-        x = 0.3
-        y = -0.1
         text = ""
         for s in self.graph.predecessors(node):
             text += s.get_name() + ": \n"
@@ -130,71 +302,103 @@ class AnnoteFinder:
             text += "\n"
             text += self.generate_inter_state(s, node, "pressure")
             text += "\n"
-        self.ax1.text(x, y, text)
+        self.set_info(text)
+
+    def set_info(self, text):
+        ''' Show text below the table, wrapped to INFO_WIDTH characters. '''
+        text = '\n'.join(textwrap.fill(line, INFO_WIDTH) for line in text.split('\n'))
+        if text != self.info.get_text():
+            self.info.set_text(text)
+            self.dirty.add('info')
 
     def show_table(self, description):
         ''' Show the value and derivative of the quantities in a table below
         the graph. '''
         magnitude = []
         derivative = []
-        for i, p in enumerate(description.get_all_params()):
-            if p == -1: p = '-'
-            elif p == 1: p = '+'
-            elif p == 2: p = 'MAX'
-
+        for i, p in enumerate(description.labels(self.spaces)):
             if i % 2 == 0:
                 magnitude.append(p)
             else:
                 derivative.append(p)
-        data = [magnitude, derivative]
+        self.set_cells(magnitude + derivative)
 
-        columns = ('INFLOW', 'VOLUME', 'OUTFLOW', 'HEIGHT', 'PRESSURE')
-        rows = ['Q', 'd']
+    def clear_table(self):
+        self.set_cells([''] * len(self.cells))
+
+    def set_cells(self, values):
+        ''' Set the value cells row by row, marking the changed ones. '''
+        for cell, value in zip(self.cells, values):
+            if cell.get_text().get_text() != str(value):
+                cell.get_text().set_text(str(value))
+                self.dirty.add(cell)
 
-        self.ax2.table(cellText=data, rowLabels=rows, colLabels=columns,
-                      loc='center', cellLoc='center')
+    def show_selection(self):
+        ''' List the selected states below the table. '''
+        names = sorted(s.get_name() for s in self.selection)
+        self.set_info(str(len(names)) + ' states selected: ' + ', '.join(names))
 
     def update_plot(self, node):
         ''' Update the GUI after click. '''
-        self.ax1.clear()
-        self.ax2.clear()
-        self.ax3.clear()
-        self.ax1.axis('off')
-        self.ax2.axis('off')
-        self.ax3.axis('off')
+        self.current = node
         self.show_graph(node)
-        self.show_inter_state_info(node)
-        self.show_table(node)
-        plt.gcf().canvas.draw_idle()
+        if node is not None:
+            self.show_inter_state_info(node)
+            self.show_table(node)
+        else:
+            self.clear_table()
+            self.show_selection()
+        self.refresh()
+
+    def update_selection(self, nodes):
+        ''' Update the GUI after a rectangle or lasso selection. '''
+        self.selection = nodes
+        self.update_plot(None)
 
 
 class StateVisualisation:
-    def __init__(self, data):
+    def __init__(self, data, phases=None, spaces=None):
+        ''' phases optionally maps states to the phase that expanded them,
+        which groups them in the layout; spaces are the quantity spaces that
+        name the magnitudes. '''
         self.graph = nx.DiGraph()
         self.data = data
-        self.visited = []
+        self.phases = phases
+        self.spaces = spaces
+        self.layout_cache = LAYOUT_CACHE
+        self.visited = set()
         self.state_map = {}
 
     def set_name(self, parent):
-        ''' Recursively set the name of a state to s_n. '''
-        if parent in self.state_map:
-            parent.set_name(self.state_map[parent])
-        else:
-            parent.set_name('s' + str(len(self.state_map.keys())))
-            self.state_map[parent] = parent.get_name()
-        for child in self.data[parent]:
-            self.set_name(child)
+        ''' Name the states reachable from parent s0, s1, ... in breadth-first
+        order. Every state is queued once, and every copy of it in the
+        successor lists gets its name. '''
+        if parent not in self.state_map:
+            self.state_map[parent] = 's' + str(len(self.state_map))
+        parent.set_name(self.state_map[parent])
+        queue = deque([parent])
+        while queue:
+            sd = queue.popleft()
+            for child in self.data.get(sd, []):
+                if child not in self.state_map:
+                    self.state_map[child] = 's' + str(len(self.state_map))
+                    queue.append(child)
+                child.set_name(self.state_map[child])
 
     def generate_graph(self, parent):
-        ''' Recursively generate the graph by adding the edges between the
-            parent node and its children. '''
+        ''' Generate the graph by adding the edges between every state
+            reachable from parent and its children, breadth first. '''
         if parent in self.visited: return
 
-        self.visited.append(parent)
-        if parent in self.data.keys():
-            for child in self.data[parent]:
-                self.graph.add_edge(parent, child)
-                self.generate_graph(child)
+        self.visited.add(parent)
+        queue = deque([parent])
+        while queue:
+            sd = queue.popleft()
+            for child in self.data.get(sd, []):
+                self.graph.add_edge(sd, child)
+                if child not in self.visited:
+                    self.visited.add(child)
+                    queue.append(child)
 
     def show_graph(self):
         ''' Show the graph as GUI. '''
@@ -203,13 +407,14 @@ class StateVisualisation:
         ax1 = fig.add_subplot(313)
         ax2 = fig.add_subplot(312)
         ax3 = fig.add_subplot(311)
-        ax3.set_title('Select a state to see its value')
         ax1.axis('off')
         ax2.axis('off')
         ax3.axis('off')
 
-        # Create the graph and get positions of the node used for the on click
-        pos = nx.spring_layout(self.graph)
+        # Create the graph and get positions of the node used for the on click,
+        # in layers below the first node generated (the root)
+        pos = cached_layout(self.graph, list(self.graph)[:1], self.phases,
+                            self.layout_cache)
         x, y, annotes = [],[],[]
         # Keep track of parent nodes that have children and end nodes that don't
         parent_nodes = []
@@ -224,18 +429,19 @@ class StateVisualisation:
             x.append(d[0])
             y.append(d[1])
 
-        # Draw graph, blue is end node, red is parent node
-        nx.draw_networkx_nodes(self.graph, pos, nodelist=end_nodes, node_color='blue')
-        nx.draw_networkx_nodes(self.graph, pos, nodelist=parent_nodes, node_color='red')
-        # Draw edges and labels
-        nx.draw_networkx_edges(self.graph, pos)
-        nx.draw_networkx_labels(self.graph, pos, self.state_map)
-
-        # Callback class for onclick event
-        af = AnnoteFinder(x, y, annotes)
+        # Callback class for onclick event, which also draws the graph
+        af = AnnoteFinder(x, y, annotes, axis=ax3)
         af.set_graph_info(ax1, ax2, ax3, self.graph, pos, parent_nodes,
-                         end_nodes, self.state_map)
+                         end_nodes, self.state_map, self.spaces)
+        af.draw()
+        self.annote_finder = af
         fig.canvas.mpl_connect('button_press_event', af)
+        fig.canvas.mpl_connect('key_press_event', af.highlight_reachable)
+        # keep references to the selectors, or they stop responding
+        af.rectangle_selector = RectangleSelector(ax3, af.select_rectangle,
+                                                  button=[3], useblit=True)
+        af.lasso_selector = LassoSelector(ax3, af.select_lasso, button=[2],
+                                          useblit=True)
 
         # Uses tkagg, not sure if that's standard
         mng = plt.get_current_fig_manager()
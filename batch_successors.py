@@ -0,0 +1,162 @@
+'''
+Vectorized successor generation for the tub model.
+
+batch_successors expands a whole layer of frontier states at once. States
+are rows of an (N, 10) integer array, and every rule of find_neighbors is
+applied to all candidate successors as a boolean mask.
+'''
+
+import numpy as np
+
+from state_description import *
+from state_graph import IQ_SPACE, VQ_SPACE, VD_SPACE, check_plausibility
+
+# every candidate (iq, vq, vd) combination, in the order find_neighbors
+# tries them
+_CANDIDATES = np.array([(iq, vq, vd) for iq in IQ_SPACE
+                                     for vq in VQ_SPACE
+                                     for vd in VD_SPACE])
+
+_SHIFTS = BITS * np.arange(N_PARAMS)
+
+# plausibility of the candidate codes seen so far
+_plausible = {}
+
+def encode_array(states):
+    """
+     ((N, 10) int array) -> (N,) int array
+
+     Pack every row of states into its state code.
+    """
+    return ((np.asarray(states, dtype=np.int64) - NEG) << _SHIFTS).sum(axis=-1)
+
+def decode_array(codes):
+    """
+     ((N,) int array) -> (N, 10) int array
+
+     Unpack state codes into rows of qualitative values.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    return ((codes[:, None] >> _SHIFTS) & MASK) + NEG
+
+def iq_mask(params, iq):
+    ''' The masked equivalent of determine_iq. '''
+    return np.where(params[:, ID] == ZERO, iq == params[:, IQ],
+           np.where(params[:, ID] == POS, iq == POS, iq <= params[:, IQ]))
+
+def vq_mask(params, vq):
+    ''' The masked equivalent of determine_vq. '''
+    old = params[:, VQ]
+    increasing = np.where(old == ZERO, vq == POS,
+                 np.where(old == POS, (vq == POS) | (vq == MAX), vq == MAX))
+    decreasing = np.where(old == ZERO, vq == ZERO,
+                 np.where(old == POS, (vq == ZERO) | (vq == POS), vq == POS))
+    return np.where(params[:, VD] == ZERO, vq == old,
+           np.where(params[:, VD] == POS, increasing, decreasing))
+
+def vd_mask(params, iq, vq, vd):
+    ''' The masked equivalent of determine_vd. '''
+    old = params[:, VD]
+    # influence of the new inflow and outflow quantities
+    determined = (iq == ZERO) | (vq == ZERO)
+    influence = np.where(iq == ZERO, np.where(vq > ZERO, NEG, ZERO), POS)
+    continuous = np.abs(influence - old) <= 1
+    by_influence = continuous & (vd == influence)
+
+    # second derivative effects of the previous inflow and outflow
+    negative = np.where(old == POS, (vd == ZERO) | (vd == POS), vd == NEG)
+    positive = np.where(old == ZERO, vd == POS,
+               np.where(old == POS, vd == POS, (vd == NEG) | (vd == ZERO)))
+    continuity = np.where(old == ZERO, True,
+                 np.where(old == POS, vd != NEG, vd != POS))
+
+    inflow_d = params[:, ID]
+    outflow_d = params[:, OD]
+    by_second_order = np.where(inflow_d == ZERO,
+        np.where(outflow_d == POS, negative,
+        np.where(outflow_d == ZERO, continuity, positive)),
+        np.where(inflow_d == POS,
+        np.where(outflow_d != POS, positive, continuity),
+        np.where(outflow_d != NEG, negative, continuity)))
+
+    return np.where(determined, by_influence, by_second_order)
+
+def epsilon_mask(params, iq, id_val, vq, vd):
+    ''' The masked equivalent of check_epsilon_ordering. '''
+    inflow_point = (params[:, IQ] == ZERO) & (params[:, ID] == POS)
+    leaving_zero = (params[:, VQ] == ZERO) & (params[:, VD] == POS)
+    leaving_max = ~leaving_zero & (params[:, VQ] == MAX) & (params[:, VD] == NEG)
+    volume_point = leaving_zero | leaving_max
+
+    violated = inflow_point & ((iq != POS) | (id_val != POS))
+    violated |= leaving_zero & ((vq != POS) | (vd != POS))
+    violated |= leaving_max & (vq != POS)
+    violated |= inflow_point & ~volume_point & (vq != params[:, VQ])
+    violated |= volume_point & ~inflow_point & (iq != params[:, IQ])
+    return ~violated
+
+def plausibility_mask(codes):
+    ''' The masked equivalent of check_plausibility. '''
+    unique, inverse = np.unique(codes, return_inverse=True)
+    verdicts = np.empty(len(unique), dtype=bool)
+    for i, code in enumerate(unique.tolist()):
+        if code not in _plausible:
+            _plausible[code] = check_plausibility(list(decode(code)))
+        verdicts[i] = _plausible[code]
+    return verdicts[inverse].reshape(codes.shape)
+
+def batch_successors(states, id_val):
+    """
+     ((N, 10) int array, int) -> ((M,) int array, (M, 10) int array)
+
+     Find the successors of every state in states under the exogenous
+     derivative of inflow id_val. Returns the row index of each successor's
+     parent and the successors themselves, grouped by parent in the same
+     order as compute_successors.
+    """
+    params = np.asarray(states, dtype=np.int64).reshape(-1, N_PARAMS)
+    n = len(params)
+    k = len(_CANDIDATES)
+
+    # pair every state with every candidate: one row per pair
+    expanded = np.repeat(params, k, axis=0)
+    flat_iq = np.tile(_CANDIDATES[:, 0], n)
+    flat_vq = np.tile(_CANDIDATES[:, 1], n)
+    flat_vd = np.tile(_CANDIDATES[:, 2], n)
+
+    mask = iq_mask(expanded, flat_iq)
+    mask &= vq_mask(expanded, flat_vq)
+    mask &= vd_mask(expanded, flat_iq, flat_vq, flat_vd)
+    mask &= epsilon_mask(expanded, flat_iq, id_val, flat_vq, flat_vd)
+
+    # the correspondences copy volume to outflow, height and pressure
+    candidates = np.empty((n * k, N_PARAMS), dtype=np.int64)
+    candidates[:, IQ] = flat_iq
+    candidates[:, ID] = id_val
+    candidates[:, 2::2] = flat_vq[:, None]
+    candidates[:, 3::2] = flat_vd[:, None]
+
+    codes = encode_array(candidates)
+    mask &= codes != np.repeat(encode_array(params), k)
+    mask[mask] = plausibility_mask(codes[mask])
+
+    parents = np.repeat(np.arange(n), k)
+    return parents[mask], candidates[mask]
+
+def expand_layers(seeds, id_val):
+    """
+     ((N, 10) int array, int) -> generator of (M, 10) int arrays
+
+     Breadth-first search from seeds under a fixed id_val, expanding each
+     layer with a single call to batch_successors. Yields the layers of
+     newly reached states, starting with the seeds themselves.
+    """
+    layer = np.unique(encode_array(seeds))
+    seen = set(layer.tolist())
+    while len(layer) > 0:
+        yield decode_array(layer)
+        _, successors = batch_successors(decode_array(layer), id_val)
+        codes = np.unique(encode_array(successors))
+        layer = np.array([c for c in codes.tolist() if c not in seen],
+                         dtype=np.int64)
+        seen.update(layer.tolist())
@@ -0,0 +1,229 @@
+'''
+Reduced ordered binary decision diagrams, in pure Python.
+
+A BDD manager owns a table of nodes (var, low, high) in which every node
+is unique, so two functions are equal exactly when they are the same node
+number. Node 0 is false and node 1 is true. Variables are numbered
+0..n_vars-1 and tested in that order from the root down.
+
+Operations are memoized per manager; call clear_caches() between large
+computations that do not share intermediate results.
+'''
+
+FALSE = 0
+TRUE = 1
+
+class BDD:
+    def __init__(self, n_vars):
+        self.n_vars = n_vars
+        # the terminals sit below every variable
+        self.nodes = [(n_vars, FALSE, FALSE), (n_vars, TRUE, TRUE)]
+        self.unique = {}
+        self.clear_caches()
+
+    def clear_caches(self):
+        self._ite = {}
+        self._exists = {}
+        self._and_exists = {}
+
+    def node(self, var, low, high):
+        ''' The unique node testing var, reduced if both branches agree. '''
+        if low == high:
+            return low
+        key = (var, low, high)
+        f = self.unique.get(key)
+        if f is None:
+            f = len(self.nodes)
+            self.nodes.append(key)
+            self.unique[key] = f
+        return f
+
+    def var(self, i):
+        return self.node(i, FALSE, TRUE)
+
+    def top(self, f):
+        return self.nodes[f][0]
+
+    def cofactors(self, f, var):
+        ''' The (low, high) cofactors of f for var, which must not lie below f's top. '''
+        top, low, high = self.nodes[f]
+        if top == var:
+            return low, high
+        return f, f
+
+    def ite(self, f, g, h):
+        ''' if f then g else h '''
+        if f == TRUE:
+            return g
+        if f == FALSE:
+            return h
+        if g == h:
+            return g
+        if g == TRUE and h == FALSE:
+            return f
+        key = (f, g, h)
+        result = self._ite.get(key)
+        if result is None:
+            var = min(self.nodes[f][0], self.nodes[g][0], self.nodes[h][0])
+            f0, f1 = self.cofactors(f, var)
+            g0, g1 = self.cofactors(g, var)
+            h0, h1 = self.cofactors(h, var)
+            result = self.node(var, self.ite(f0, g0, h0), self.ite(f1, g1, h1))
+            self._ite[key] = result
+        return result
+
+    def not_(self, f):
+        return self.ite(f, FALSE, TRUE)
+
+    def and_(self, f, g):
+        return self.ite(f, g, FALSE)
+
+    def or_(self, f, g):
+        return self.ite(f, TRUE, g)
+
+    def diff(self, f, g):
+        ''' f and not g '''
+        return self.ite(g, FALSE, f)
+
+    def equiv(self, f, g):
+        return self.ite(f, g, self.not_(g))
+
+    def conjoin(self, functions):
+        result = TRUE
+        for f in functions:
+            result = self.and_(result, f)
+        return result
+
+    def exists(self, f, variables):
+        ''' Quantify the variables, a frozenset, out of f existentially. '''
+        if f <= TRUE:
+            return f
+        key = (f, variables)
+        result = self._exists.get(key)
+        if result is None:
+            var, low, high = self.nodes[f]
+            low = self.exists(low, variables)
+            high = self.exists(high, variables)
+            if var in variables:
+                result = self.or_(low, high)
+            else:
+                result = self.node(var, low, high)
+            self._exists[key] = result
+        return result
+
+    def and_exists(self, f, g, variables):
+        """
+         The relational product: exists variables . f and g, without
+         building f and g first. This is the step of image computation.
+        """
+        if f == FALSE or g == FALSE:
+            return FALSE
+        if f == TRUE:
+            return self.exists(g, variables)
+        if g == TRUE:
+            return self.exists(f, variables)
+        if g < f:
+            f, g = g, f
+        key = (f, g, variables)
+        result = self._and_exists.get(key)
+        if result is None:
+            var = min(self.nodes[f][0], self.nodes[g][0])
+            f0, f1 = self.cofactors(f, var)
+            g0, g1 = self.cofactors(g, var)
+            low = self.and_exists(f0, g0, variables)
+            if var in variables and low == TRUE:
+                # the other branch cannot add anything
+                result = TRUE
+            else:
+                high = self.and_exists(f1, g1, variables)
+                if var in variables:
+                    result = self.or_(low, high)
+                else:
+                    result = self.node(var, low, high)
+            self._and_exists[key] = result
+        return result
+
+    def rename(self, f, mapping):
+        """
+         Substitute variables for variables in f. The mapping must keep the
+         variable order, so the result needs no reordering.
+        """
+        memo = {}
+        def walk(f):
+            if f <= TRUE:
+                return f
+            if f not in memo:
+                var, low, high = self.nodes[f]
+                memo[f] = self.node(mapping.get(var, var), walk(low), walk(high))
+            return memo[f]
+        return walk(f)
+
+    def cube(self, assignment):
+        ''' The conjunction of the literals in {var: bit}. '''
+        f = TRUE
+        for var in sorted(assignment, reverse=True):
+            if assignment[var]:
+                f = self.node(var, FALSE, f)
+            else:
+                f = self.node(var, f, FALSE)
+        return f
+
+    def count(self, f, variables):
+        """
+         The number of assignments to variables that satisfy f, which must
+         not depend on any other variable.
+        """
+        variables = sorted(variables)
+        position = dict((var, k) for k, var in enumerate(variables))
+        memo = {}
+
+        def level(f):
+            return len(variables) if f <= TRUE else position[self.nodes[f][0]]
+
+        def walk(f):
+            # assignments to the variables from f's level down
+            if f <= TRUE:
+                return f
+            if f not in memo:
+                var, low, high = self.nodes[f]
+                k = position[var]
+                memo[f] = (walk(low) << (level(low) - k - 1)) + \
+                          (walk(high) << (level(high) - k - 1))
+            return memo[f]
+
+        return walk(f) << level(f)
+
+    def satisfy_all(self, f, variables):
+        """
+         Yield every assignment to variables that satisfies f, as a tuple
+         of bits in variable order. f must not depend on other variables.
+        """
+        variables = sorted(variables)
+
+        def walk(f, k):
+            if f == FALSE:
+                return
+            if k == len(variables):
+                yield ()
+                return
+            var, low, high = self.nodes[f]
+            if var != variables[k]:
+                # f does not test this variable: both values satisfy it
+                low = high = f
+            for bit, child in ((0, low), (1, high)):
+                for rest in walk(child, k + 1):
+                    yield (bit,) + rest
+
+        return walk(f, 0)
+
+    def size(self, f):
+        ''' The number of nodes in f, terminals included. '''
+        seen = set()
+        stack = [f]
+        while stack:
+            f = stack.pop()
+            if f not in seen:
+                seen.add(f)
+                if f > TRUE:
+                    stack.extend(self.nodes[f][1:])
+        return len(seen)
@@ -0,0 +1,61 @@
+'''
+Scaling benchmark for the generic model engine on chains of tubs.
+
+Each chain starts with every tub empty, the tap just turned on and the
+inflow increasing, and its whole state graph is built breadth first. The
+time per expanded state and per generated edge is reported for every
+chain length. The graphs grow about five times with every tub, so the
+default stops at six. With --limit, at most LIMIT states are expanded
+per chain; rows where that left states unexpanded are marked truncated,
+and since the first states of a long chain all lie in its first tubs,
+their costs should not be compared across lengths.
+
+    python benchmarks/chain_scaling.py [--max-tubs 6] [--limit N]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qr_model import tub_chain
+from state_description import ZERO, POS
+
+def run(n, limit):
+    model = tub_chain(n)
+    start = model.state({'inflow': (ZERO, POS)})
+    begin = time.perf_counter()
+    graph = model.explore(start, {'inflow': POS}, limit=limit)
+    elapsed = time.perf_counter() - begin
+
+    edges = sum(len(successors) for successors in graph.values())
+    reached = set(graph)
+    for successors in graph.values():
+        reached.update(successors)
+    truncated = len(reached) > len(graph)
+    return len(model.quantities), len(graph), len(reached), edges, elapsed, truncated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--min-tubs', type=int, default=1)
+    parser.add_argument('--max-tubs', type=int, default=6)
+    parser.add_argument('--limit', type=int, default=None,
+                        help='number of states to expand at most per chain '
+                             '(default: the whole graph)')
+    args = parser.parse_args()
+
+    header = '{:>5} {:>10} {:>9} {:>9} {:>10} {:>8} {:>12} {:>11}  {}'
+    row = '{:>5} {:>10} {:>9} {:>9} {:>10} {:>8.2f} {:>12.1f} {:>11.2f}  {}'
+    print(header.format('tubs', 'quantities', 'expanded', 'reached', 'edges',
+                        'seconds', 'us/expanded', 'us/edge', 'graph'))
+    for n in range(args.min_tubs, args.max_tubs + 1):
+        quantities, expanded, reached, edges, elapsed, truncated = run(n, args.limit)
+        print(row.format(n, quantities, expanded, reached, edges, elapsed,
+                         1e6 * elapsed / max(expanded, 1),
+                         1e6 * elapsed / max(edges, 1),
+                         'truncated' if truncated else 'complete'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''
+Scaling benchmark for the tub with extra landmarks in its volume space.
+
+With n extra landmarks the volume space is 0, +, L1, +1, ..., Ln, +n, MAX,
+and outflow, height and pressure share it. The tub's inflow profile is run
+on it as in state_graph.py, and the size of the graph is reported for
+every n, along with the time of the first build, whose transition table
+starts empty, and of the fastest rebuild, whose table is filled in.
+
+    python benchmarks/landmark_scaling.py [--max-landmarks 8] [--repeat 3]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qr_model import landmark_space
+from state_graph import TUB_PHASES, TubSpaces, explore, transitions_key
+
+def run(n, repeat):
+    landmarks = ['0'] + ['L' + str(k) for k in range(1, n + 1)] + ['MAX']
+    spaces = TubSpaces(volume=landmark_space(landmarks))
+    times = []
+    for _ in range(1 + repeat):
+        begin = time.perf_counter()
+        graph = explore(TUB_PHASES, spaces=spaces)
+        times.append(time.perf_counter() - begin)
+
+    edges = sum(len(successors) for successors in graph.values())
+    terminal = sum(1 for successors in graph.values() if not successors)
+    return len(spaces.volume), len(graph), edges, terminal, times[0], min(times[1:])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-landmarks', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='rebuilds per space; the fastest is reported')
+    args = parser.parse_args()
+
+    header = '{:>9} {:>7} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}'
+    row = '{:>9} {:>7} {:>7} {:>7} {:>9} {:>9.2f} {:>9.1f} {:>9.2f}'
+    print(header.format('landmarks', 'values', 'states', 'edges', 'terminal',
+                        'first ms', 'us/state', 'warm ms'))
+    # fingerprint the rules once, outside the first build of every space
+    transitions_key()
+    for n in range(args.max_landmarks + 1):
+        values, states, edges, terminal, first, warm = run(n, max(args.repeat, 1))
+        print(row.format(n, values, states, edges, terminal, 1e3 * first,
+                         1e6 * first / max(states, 1), 1e3 * warm))
+
+if __name__ == '__main__':
+    main()
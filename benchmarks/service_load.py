@@ -0,0 +1,118 @@
+'''
+Load test for the query service.
+
+Starts the service in this process on a free localhost port (or connects
+to a running one with --connect), then lets a number of concurrent clients
+send a mix of requests over their own connections:
+
+    successors    the successors of a random tub state under a random id_val
+    build         the graph of the tub scenario
+    paths         behaviour counts, and paths from tap_on to a random state
+
+It reports the throughput and the latency percentiles of every kind of
+request. The first requests warm the caches, so they are not measured.
+
+    python benchmarks/service_load.py [--clients 8] [--requests 500]
+                                      [--connect HOST:PORT]
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import state_graph
+from service import QueryService, start_server
+
+def requests(rng, targets):
+    ''' An endless mix of requests. '''
+    states = [sd.get_all_params() for sd in state_graph.tub_states()]
+    while True:
+        kind = rng.choice(['successors'] * 6 + ['build'] * 2 + ['paths'] * 2)
+        if kind == 'successors':
+            request = {'op': 'successors', 'state': list(rng.choice(states)),
+                       'id_val': rng.choice(state_graph.ID_SPACE)}
+        elif kind == 'build':
+            request = {'op': 'build', 'scenario': 'tub'}
+        elif rng.random() < 0.5:
+            request = {'op': 'paths', 'scenario': 'tub'}
+        else:
+            request = {'op': 'paths', 'scenario': 'tub', 'to': rng.choice(targets),
+                       'limit': 3}
+        yield kind, request
+
+async def client(host, port, n, seed, targets, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(seed)
+    mix = requests(rng, targets)
+    for k in range(n):
+        kind, request = next(mix)
+        request['id'] = k
+        begin = time.perf_counter()
+        writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        if not response['ok'] or response['id'] != k:
+            raise RuntimeError('bad response to ' + json.dumps(request) + ': ' +
+                               json.dumps(response))
+        latencies.setdefault(kind, []).append(time.perf_counter() - begin)
+    writer.close()
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+async def run(args):
+    server = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        port = int(port)
+    else:
+        service = QueryService()
+        server = await start_server(service, '127.0.0.1', 0)
+        host, port = server.sockets[0].getsockname()[:2]
+
+    graph = state_graph.explore(state_graph.TUB_PHASES)
+    targets = [list(sd.get_all_params()) for sd in graph]
+    # warm up: build the graph and count its paths once
+    await client(host, port, 20, -1, targets, {})
+
+    latencies = {}
+    begin = time.perf_counter()
+    await asyncio.gather(*[client(host, port, args.requests, seed, targets, latencies)
+                           for seed in range(args.clients)])
+    elapsed = time.perf_counter() - begin
+
+    total = sum(len(values) for values in latencies.values())
+    print(str(total) + ' requests from ' + str(args.clients) + ' clients in ' +
+          '{:.2f}'.format(elapsed) + ' s: ' + '{:.0f}'.format(total / elapsed) +
+          ' requests/s')
+    print('{:<12} {:>8} {:>10} {:>10} {:>10}'.format('request', 'count', 'p50 ms',
+                                                      'p99 ms', 'max ms'))
+    for kind, values in sorted(latencies.items()):
+        print('{:<12} {:>8} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            kind, len(values), 1e3 * percentile(values, 50),
+            1e3 * percentile(values, 99), 1e3 * max(values)))
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        service.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test for the query service.')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per client')
+    parser.add_argument('--connect', metavar='HOST:PORT',
+                        help='test a running service instead of starting one')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+'''
+Headless benchmark suite for graph construction, plotting and the GUI.
+
+Every stage is timed over a number of repeats and its peak memory is
+measured with tracemalloc. The stages are
+
+    calibration               a fixed workload of plain Python, run once
+                              before every other stage, that measures the
+                              speed of the machine over the whole run
+    transitions.compile       compiling the tub's transition table
+    explore.<phase>           each phase of the tub's graph construction
+    explore.total             the whole construction, as in main()
+    plot.write                PlotGraph.write, streaming DOT into memory
+    plot.save                 PlotGraph.save as PNG (needs Graphviz)
+    gui.generate_graph        StateVisualisation.set_name and generate_graph
+    gui.layout                the layered layout, without its cache
+    gui.show_graph            StateVisualisation.show_graph, with the layout,
+                              on a non-interactive matplotlib backend
+    gui.update_plot           a click on every state of the shown graph
+    chain<N>.explore          a chain of N tubs (replicated tubs)
+    chain<N>.layout           the spring layout of that chain's graph
+    wide<K>.explore           a chain of tubs whose volumes and outflows have
+                              K extra landmarks (widened quantity spaces)
+
+Stages whose libraries are missing, such as the GUI stages without
+matplotlib, are skipped. Results are written as JSON. If a baseline file exists, every stage is
+compared against it. Both sides are divided by their own calibration time
+first, so that a baseline recorded on another machine still applies. With
+--check, the suite exits with status 1 when any stage got slower than the
+tolerance allows.
+
+    python benchmarks/suite.py [--repeat 5] [--output results.json]
+                               [--baseline benchmarks/baseline.json]
+                               [--tolerance 1.5] [--check] [--save-baseline]
+'''
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import state_graph
+from qr_model import landmark_space, tub_chain
+from state_description import ZERO, POS
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# slowdowns smaller than this many seconds never count as regressions
+NOISE = 0.0005
+# the stage the other stages are scaled by
+CALIBRATION = 'calibration'
+
+class Skip(Exception):
+    ''' Raised by a stage that cannot run in this environment. '''
+
+def measure(setup, repeat):
+    """
+     (function, int) -> dict
+
+     Time a stage over repeat runs, after one untimed run that warms up
+     imports and caches, then measure its peak memory in one more run
+     under tracemalloc, which would distort the timings. Before every run,
+     setup() prepares the stage and returns the callable to run; the setup
+     itself is neither timed nor traced.
+    """
+    setup()()
+    times = []
+    for _ in range(repeat):
+        stage = setup()
+        begin = time.perf_counter()
+        stage()
+        times.append(time.perf_counter() - begin)
+
+    stage = setup()
+    tracemalloc.start()
+    try:
+        stage()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'min': min(times), 'median': statistics.median(times),
+            'repeat': repeat, 'peak_bytes': peak}
+
+def calibrate():
+    ''' A fixed workload of loops, small tuples, dicts and sorting, like the
+    stages do, that allocates little memory. '''
+    counts = {}
+    for k in range(100000):
+        key = ((k * 7919) % 1009, k & 3)
+        counts[key] = counts.get(key, 0) + 1
+    for _ in range(20):
+        sorted(counts.items(), key=lambda item: item[1])
+
+def tub_stages(scratch):
+    ''' The stages of main(), in order. Files go below the directory scratch. '''
+    stages = []
+    # every stage is a (name, setup) pair; see measure
+
+    def compile_table():
+        path = os.path.join(scratch, 'transitions.cache')
+        return lambda: state_graph.compile_transitions(path, force=True)
+    stages.append(('transitions.compile', compile_table))
+
+    for k, phase in enumerate(state_graph.TUB_PHASES):
+        def run(k=k, phase=phase):
+            # the phases before k only set up the graph and are not timed
+            graph = state_graph.explore(state_graph.TUB_PHASES[:k])
+            edges = set((p, c) for p in graph for c in graph[p])
+            return lambda: state_graph.run_phase(graph, edges, phase)
+        stages.append(('explore.' + phase.name, run))
+
+    stages.append(('explore.total',
+                   lambda: lambda: state_graph.explore(state_graph.TUB_PHASES)))
+
+    def plot(step):
+        def setup():
+            try:
+                from plot_graph import PlotGraph
+            except ImportError as e:
+                raise Skip(str(e))
+            graph = state_graph.explore(state_graph.TUB_PHASES)
+            plotter = PlotGraph(graph)
+            plotter.generate_graph(state_graph.TAP_ON)
+            if step == 'write':
+                return lambda: plotter.write(io.StringIO())
+            directory = tempfile.mkdtemp(dir=scratch)
+            def save():
+                cwd = os.getcwd()
+                os.chdir(directory)
+                try:
+                    plotter.save()
+                except Exception as e:
+                    raise Skip('Graphviz is not available: ' + str(e))
+                finally:
+                    os.chdir(cwd)
+            return save
+        return setup
+    stages.append(('plot.write', plot('write')))
+    stages.append(('plot.save', plot('save')))
+
+    def gui(step):
+        def setup():
+            try:
+                import matplotlib
+                # the non-interactive backend, before pyplot picks another
+                matplotlib.use('Agg')
+                import matplotlib.pyplot as plt
+                from GUI import StateVisualisation
+            except ImportError as e:
+                raise Skip(str(e))
+            expanded_by = {}
+            graph = state_graph.explore(state_graph.TUB_PHASES,
+                                        expanded_by=expanded_by)
+            def generate():
+                visualisation = StateVisualisation(graph, expanded_by)
+                # an empty cache, so that show_graph lays the graph out
+                visualisation.layout_cache = tempfile.mkdtemp(dir=scratch)
+                visualisation.set_name(state_graph.TAP_ON)
+                visualisation.generate_graph(state_graph.TAP_ON)
+                return visualisation
+            if step == 'generate_graph':
+                return generate
+            visualisation = generate()
+            if step == 'layout':
+                from layout import layered_layout
+                return lambda: layered_layout(visualisation.graph,
+                                              [state_graph.TAP_ON], expanded_by)
+            if step == 'update_plot':
+                visualisation.show_graph()
+                finder = visualisation.annote_finder
+                # a first full draw, as on screen, provides the blitting background
+                finder.canvas.draw()
+                def click():
+                    for node in finder.annotes:
+                        finder.update_plot(node)
+                return click
+            def show():
+                visualisation.show_graph()
+                plt.close('all')
+            return show
+        return setup
+    stages.append(('gui.generate_graph', gui('generate_graph')))
+    stages.append(('gui.layout', gui('layout')))
+    stages.append(('gui.show_graph', gui('show_graph')))
+    stages.append(('gui.update_plot', gui('update_plot')))
+    return stages
+
+def widened_space(extra):
+    """
+     A volume space with extra landmarks between zero and maximum:
+     0, +, L1, +1, L2, ..., +n, MAX.
+    """
+    return landmark_space(['0'] + ['L' + str(k) for k in range(1, extra + 1)] + ['MAX'])
+
+def synthetic_stages(chains, landmarks, limit):
+    ''' Stages on larger generic models. '''
+    stages = []
+
+    def explore(model):
+        start = model.state({'inflow': (ZERO, POS)})
+        return model.explore(start, {'inflow': POS}, limit=limit)
+
+    for n in chains:
+        model = tub_chain(n)
+        stages.append(('chain' + str(n) + '.explore',
+                       lambda model=model: lambda: explore(model)))
+
+        def layout(model=model):
+            try:
+                import networkx as nx
+            except ImportError as e:
+                raise Skip(str(e))
+            graph = nx.DiGraph()
+            for state, successors in explore(model).items():
+                for successor in successors:
+                    graph.add_edge(state, successor)
+            return lambda: nx.spring_layout(graph, seed=0)
+        stages.append(('chain' + str(n) + '.layout', layout))
+
+    for extra in landmarks:
+        model = tub_chain(2, widened_space(extra))
+        stages.append(('wide' + str(extra) + '.explore',
+                       lambda model=model: lambda: explore(model)))
+    return stages
+
+def run_suite(stages, repeat):
+    results = {}
+    calibration = []
+    for name, setup in stages:
+        begin = time.perf_counter()
+        calibrate()
+        calibration.append(time.perf_counter() - begin)
+        try:
+            results[name] = measure(setup, repeat)
+        except (Skip, ImportError) as e:
+            results[name] = {'skipped': str(e)}
+        print(format_result(name, results[name]))
+
+    tracemalloc.start()
+    try:
+        calibrate()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    results[CALIBRATION] = {'min': min(calibration),
+                            'median': statistics.median(calibration),
+                            'repeat': len(calibration), 'peak_bytes': peak}
+    print(format_result(CALIBRATION, results[CALIBRATION]))
+    return results
+
+def format_result(name, result):
+    if 'skipped' in result:
+        return '{:<24} skipped: {}'.format(name, result['skipped'])
+    return '{:<24} min {:>9.2f} ms  median {:>9.2f} ms  peak {:>9.1f} KiB'.format(
+        name, 1e3 * result['min'], 1e3 * result['median'],
+        result['peak_bytes'] / 1024.0)
+
+def compare(results, baseline, tolerance):
+    """
+     Compare the minimum times of results against baseline, each divided
+     by its own median calibration time. Returns the names of the stages that got
+     more than tolerance times slower.
+    """
+    stages = baseline.get('stages', {})
+    if 'median' not in results.get(CALIBRATION, {}) or \
+            'median' not in stages.get(CALIBRATION, {}):
+        print('The baseline has no calibration; record it again with --save-baseline.')
+        return []
+    # how much faster this machine is than the baseline's
+    speed = stages[CALIBRATION]['median'] / results[CALIBRATION]['median']
+
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = stages.get(name)
+        if name == CALIBRATION or old is None or 'min' not in old or \
+                'min' not in result:
+            continue
+        scaled = result['min'] * speed
+        ratio = scaled / old['min'] if old['min'] > 0 else 1.0
+        flag = ''
+        # sub-millisecond stages jitter too much for a ratio alone
+        if ratio > tolerance and scaled - old['min'] > NOISE:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<24} {:>6.2f}x baseline{}'.format(name, ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark suite.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chains', type=int, nargs='*', default=[2, 4, 6],
+                        help='numbers of tubs of the synthetic chains')
+    parser.add_argument('--landmarks', type=int, nargs='*', default=[1, 2, 4],
+                        help='numbers of extra landmarks of the widened spaces')
+    parser.add_argument('--limit', type=int, default=300,
+                        help='states to expand per synthetic model')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='slowdown factor that counts as a regression')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 if any stage regressed')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        stages = tub_stages(scratch) + synthetic_stages(args.chains, args.landmarks,
+                                                        args.limit)
+        results = run_suite(stages, args.repeat)
+
+    report = {'python': platform.python_version(),
+              'machine': platform.machine(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'stages': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results written to ' + args.output + '.')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Baseline written to ' + args.baseline + '.')
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance) and args.check:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
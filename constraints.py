@@ -0,0 +1,184 @@
+'''
+A small constraint language for forbidden state patterns.
+
+Each rule is a line of the form
+
+    forbid TERM TERM ...
+
+and forbids every state description that satisfies all of its terms.
+A term constrains a single quantity or relates two of them:
+
+    VQ=+          a single value (0, +, -, MAX)
+    VQ=*          any value (the same as leaving VQ out)
+    VQ=0..MAX     an inclusive range of values
+    VQ=0|MAX      one of several values
+    VQ!=0         anything but a value
+    VD==OD        a relation between two quantities (==, !=, <, <=, >, >=)
+
+Anything after a '#' is a comment. Rules are compiled into bitmasks, one
+bit per rule, so checking a state costs the same however many rules there
+are.
+'''
+
+import operator
+
+from state_description import *
+
+QUANTITIES = {'IQ': IQ, 'ID': ID, 'VQ': VQ, 'VD': VD, 'OQ': OQ, 'OD': OD,
+              'HQ': HQ, 'HD': HD, 'PQ': PQ, 'PD': PD}
+VALUES = {'0': ZERO, '+': POS, '-': NEG, 'MAX': MAX}
+DOMAIN = [NEG, ZERO, POS, MAX]
+RELATIONS = {'==': operator.eq, '!=': operator.ne, '<=': operator.le,
+             '>=': operator.ge, '<': operator.lt, '>': operator.gt}
+
+class Rule:
+    """
+     A conjunction of unary constraints (quantity index -> allowed values)
+     and binary relations ((index, index) -> [relation]).
+    """
+    def __init__(self, text, line):
+        self.text = text
+        self.line = line
+        self.unary = {}
+        self.binary = {}
+
+    def matches(self, params):
+        ''' Check a state description against the rule directly. '''
+        for index, allowed in self.unary.items():
+            if params[index] not in allowed:
+                return False
+        for (a, b), relations in self.binary.items():
+            for relation in relations:
+                if not relation(params[a], params[b]):
+                    return False
+        return True
+
+    def __str__(self):
+        return self.text
+
+def parse_value(token, line):
+    if token not in VALUES:
+        raise ValueError('line ' + str(line) + ': unknown value ' + repr(token))
+    return VALUES[token]
+
+def parse_quantity(token, line):
+    if token not in QUANTITIES:
+        raise ValueError('line ' + str(line) + ': unknown quantity ' + repr(token))
+    return QUANTITIES[token]
+
+def parse_term(rule, term, line):
+    ''' Add the constraint described by term to rule. '''
+    # relations between quantities have a quantity on both sides
+    for symbol in ('==', '!=', '<=', '>=', '<', '>'):
+        left, found, right = term.partition(symbol)
+        if found and right in QUANTITIES:
+            pair = (parse_quantity(left, line), parse_quantity(right, line))
+            rule.binary.setdefault(pair, []).append(RELATIONS[symbol])
+            return
+
+    if '!=' in term:
+        name, _, value = term.partition('!=')
+        excluded = parse_value(value, line)
+        allowed = set(v for v in DOMAIN if v != excluded)
+    elif '=' in term:
+        name, _, value = term.partition('=')
+        if value == '*':
+            allowed = set(DOMAIN)
+        elif '..' in value:
+            low, _, high = value.partition('..')
+            low, high = parse_value(low, line), parse_value(high, line)
+            allowed = set(v for v in DOMAIN if low <= v <= high)
+        else:
+            allowed = set(parse_value(v, line) for v in value.split('|'))
+    else:
+        raise ValueError('line ' + str(line) + ': cannot parse ' + repr(term))
+
+    index = parse_quantity(name, line)
+    rule.unary[index] = rule.unary.get(index, set(DOMAIN)) & allowed
+
+def parse_rules(source):
+    """
+     (str) -> [Rule]
+
+     Parse the text of a rules file.
+    """
+    rules = []
+    for number, line in enumerate(source.splitlines(), 1):
+        text = line.split('#', 1)[0].strip()
+        if not text:
+            continue
+        words = text.split()
+        if words[0] != 'forbid':
+            raise ValueError('line ' + str(number) + ': rules start with forbid')
+        rule = Rule(' '.join(words[1:]), number)
+        for term in words[1:]:
+            parse_term(rule, term, number)
+        rules.append(rule)
+    return rules
+
+class RuleSet:
+    """
+     A compiled set of forbidden patterns.
+
+     Bit i of every mask stands for rule i. For each quantity and value,
+     unary holds the rules that value is compatible with, and for each
+     related pair of quantities, binary holds the rules each pair of values
+     is compatible with. A state matches exactly the rules whose bits
+     survive the AND of all its lookups.
+    """
+    def __init__(self, rules, source=''):
+        self.rules = rules
+        self.source = source
+        self.all = (1 << len(rules)) - 1
+        self.unary = []
+        for index in range(N_PARAMS):
+            masks = [0] * len(DOMAIN)
+            for bit, rule in enumerate(rules):
+                allowed = rule.unary.get(index, DOMAIN)
+                for value in allowed:
+                    masks[value - NEG] |= 1 << bit
+            self.unary.append(masks)
+
+        pairs = sorted(set(pair for rule in rules for pair in rule.binary))
+        self.binary = []
+        for a, b in pairs:
+            masks = [0] * (len(DOMAIN) * len(DOMAIN))
+            for bit, rule in enumerate(rules):
+                relations = rule.binary.get((a, b), [])
+                for x in DOMAIN:
+                    for y in DOMAIN:
+                        if all(relation(x, y) for relation in relations):
+                            masks[(x - NEG) * len(DOMAIN) + y - NEG] |= 1 << bit
+            self.binary.append((a, b, masks))
+
+    def matching(self, params):
+        """
+         ([int]) -> int
+
+         Return the bitmask of the rules params matches.
+        """
+        mask = self.all
+        for index, masks in enumerate(self.unary):
+            mask &= masks[params[index] - NEG]
+        for a, b, masks in self.binary:
+            mask &= masks[(params[a] - NEG) * len(DOMAIN) + params[b] - NEG]
+        return mask
+
+    def matching_rules(self, params):
+        ''' Return the rules params matches. '''
+        mask = self.matching(params)
+        return [rule for bit, rule in enumerate(self.rules) if mask >> bit & 1]
+
+    def allows(self, params):
+        ''' Check that params matches none of the rules. '''
+        return self.matching(params) == 0
+
+def load_rules(path):
+    """
+     (str) -> RuleSet
+
+     Read and compile the rules file at path.
+    """
+    with open(path) as f:
+        source = f.read()
+    return RuleSet(parse_rules(source), source)
@@ -0,0 +1,113 @@
+'''
+A compact, read-only form of the state graph.
+
+The dict form {State_Description: [State_Description]} costs a list slot
+and an object per edge, and answers predecessor queries only by scanning
+every list. CSRGraph numbers the states 0..n-1 and keeps the successors of
+state i in succ[succ_ptr[i]:succ_ptr[i + 1]] (compressed sparse rows), with
+a mirrored index of predecessors, in numpy arrays of 4 byte integers. The
+state codes take 8 bytes, as those of widened spaces (see TubSpaces) do
+not fit in 4.
+Degrees are O(1) and neighbours O(degree) to look up.
+
+Convert with CSRGraph.from_dict(graph) and to_dict(); the successor order
+of every state is kept, so the round trip gives the same graph.
+'''
+
+import numpy as np
+
+from state_description import State_Description
+
+class CSRGraph:
+    def __init__(self, codes, n_keys, succ_ptr, succ, pred_ptr, pred):
+        """
+         codes holds the state code of every id. The first n_keys states
+         are the keys of the dict form; the others only occur as successors.
+        """
+        self.codes = codes
+        self.n_keys = n_keys
+        self.succ_ptr = succ_ptr
+        self.succ = succ
+        self.pred_ptr = pred_ptr
+        self.pred = pred
+        self.ids = dict((int(code), i) for i, code in enumerate(codes))
+
+    @classmethod
+    def from_dict(cls, graph):
+        """
+         ({State_Description: [State_Description]}) -> CSRGraph
+
+         Number the keys of graph in order, then the successors that are
+         not keys in the order they are first met. Raises ValueError if a
+         state code does not fit in 64 bits.
+        """
+        ids = {}
+        for sd in graph:
+            ids.setdefault(sd.get_code(), len(ids))
+        n_keys = len(ids)
+        parents = []
+        children = []
+        for sd in graph:
+            parent = ids[sd.get_code()]
+            for child in graph[sd]:
+                parents.append(parent)
+                children.append(ids.setdefault(child.get_code(), len(ids)))
+
+        n = len(ids)
+        if n and max(ids) >= 1 << 64:
+            raise ValueError('state codes of more than 64 bits cannot be stored')
+        codes = np.fromiter(ids, dtype=np.uint64, count=n)
+        parents = np.array(parents, dtype=np.int32)
+        children = np.array(children, dtype=np.int32)
+        # the edges are already grouped by parent, in successor order
+        succ_ptr = offsets(parents, n)
+        # a stable sort keeps the predecessors of a state in edge order
+        order = np.argsort(children, kind='stable')
+        pred_ptr = offsets(children, n)
+        return cls(codes, n_keys, succ_ptr, children, pred_ptr, parents[order])
+
+    def to_dict(self):
+        ''' The graph as {State_Description: [State_Description]}. '''
+        states = [self.state(i) for i in range(len(self.codes))]
+        return dict((states[i], [states[j] for j in self.successors(i)])
+                    for i in range(self.n_keys))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def id(self, sd):
+        ''' The id of a state, or KeyError if it is not in the graph. '''
+        return self.ids[sd.get_code()]
+
+    def state(self, i):
+        return State_Description.from_code(int(self.codes[i]))
+
+    def successors(self, i):
+        return self.succ[self.succ_ptr[i]:self.succ_ptr[i + 1]]
+
+    def predecessors(self, i):
+        return self.pred[self.pred_ptr[i]:self.pred_ptr[i + 1]]
+
+    def out_degree(self, i):
+        return int(self.succ_ptr[i + 1] - self.succ_ptr[i])
+
+    def in_degree(self, i):
+        return int(self.pred_ptr[i + 1] - self.pred_ptr[i])
+
+    def has_edge(self, i, j):
+        ''' Whether there is an edge from id i to id j, in O(out_degree(i)). '''
+        return bool((self.successors(i) == j).any())
+
+    def edge_count(self):
+        return len(self.succ)
+
+    def nbytes(self):
+        ''' The memory taken by the arrays, excluding the id lookup. '''
+        return sum(array.nbytes for array in
+                   (self.codes, self.succ_ptr, self.succ, self.pred_ptr, self.pred))
+
+def offsets(rows, n):
+    ''' The row offsets of a CSR matrix with the given row of every entry. '''
+    ptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=n), out=ptr[1:])
+    return ptr
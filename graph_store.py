@@ -0,0 +1,208 @@
+'''
+Binary state graph files that open without rebuilding the graph.
+
+A graph file holds the CSR arrays of csr_graph.py together with the name
+and phase of every state and a JSON block of model metadata. Every section
+is aligned, so open_graph maps the file into memory and wraps the sections
+in numpy arrays without reading or copying them: opening takes the same
+time for any size of graph, and only the pages a query touches are read.
+
+Layout, all little endian:
+
+    header      magic 'QRSG', version, number of states, of keys, of edges
+    sections    (offset, length) of each section in SECTIONS
+    codes       uint64 state code per id
+    succ_ptr    int32 row offsets of the successors, n + 1
+    succ        int32 successor ids, in the order of the dict form
+    pred_ptr    int32 row offsets of the predecessors, n + 1
+    pred        int32 predecessor ids
+    by_code     int32 ids sorted by state code, for lookups
+    phases      uint8 index into the phase names in meta, 255 for none
+    name_ptr    int32 offsets of the names, n + 1
+    names       utf-8 names, back to back
+    meta        utf-8 JSON: phase names, root code and model metadata
+'''
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from csr_graph import CSRGraph
+from layout import bfs_names
+from state_description import BITS, N_PARAMS, State_Description
+
+MAGIC = b'QRSG'
+VERSION = 2
+# magic, version, number of states, number of keys, number of edges
+HEADER = struct.Struct('<4sHIII')
+SECTION = struct.Struct('<QQ')
+SECTIONS = ['codes', 'succ_ptr', 'succ', 'pred_ptr', 'pred', 'by_code',
+            'phases', 'name_ptr', 'names', 'meta']
+DTYPES = {'codes': '<u8', 'succ_ptr': '<i4', 'succ': '<i4', 'pred_ptr': '<i4',
+          'pred': '<i4', 'by_code': '<i4', 'phases': 'u1', 'name_ptr': '<i4'}
+NO_PHASE = 255
+ALIGN = 8
+
+def save_graph(path, graph, root, phases=None, metadata=None):
+    """
+     ({State_Description: [State_Description]}, State_Description, str,
+      {State_Description: str}, dict) -> None
+
+     Write graph to path. The states are named s0, s1, ... in breadth-first
+     order from root, as the viewer names them. phases optionally maps
+     states to the phase that expanded them; metadata is stored as given.
+    """
+    if phases is None:
+        phases = {}
+    csr = CSRGraph.from_dict(graph)
+    states = [csr.state(i) for i in range(len(csr))]
+
+    names = [''] * len(states)
+    for sd, name in bfs_names(graph, [root]).items():
+        if sd.get_code() in csr.ids:
+            names[csr.id(sd)] = name
+    encoded = [name.encode('utf-8') for name in names]
+    name_ptr = np.zeros(len(states) + 1, dtype=np.int32)
+    np.cumsum([len(name) for name in encoded], out=name_ptr[1:])
+
+    phase_names = []
+    tags = np.full(len(states), NO_PHASE, dtype=np.uint8)
+    for i, sd in enumerate(states):
+        phase = phases.get(sd)
+        if phase is not None:
+            if phase not in phase_names:
+                if len(phase_names) == NO_PHASE:
+                    raise ValueError('at most ' + str(NO_PHASE) + ' phases can be stored')
+                phase_names.append(phase)
+            tags[i] = phase_names.index(phase)
+
+    meta = {'phases': phase_names, 'root': root.get_code(),
+            'n_params': N_PARAMS, 'bits': BITS, 'model': metadata or {}}
+    sections = {
+        'codes': csr.codes, 'succ_ptr': csr.succ_ptr, 'succ': csr.succ,
+        'pred_ptr': csr.pred_ptr, 'pred': csr.pred,
+        'by_code': np.argsort(csr.codes, kind='stable').astype(np.int32),
+        'phases': tags, 'name_ptr': name_ptr, 'names': b''.join(encoded),
+        'meta': json.dumps(meta, sort_keys=True).encode('utf-8'),
+    }
+
+    chunks = []
+    table = []
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    for name in SECTIONS:
+        data = sections[name]
+        if not isinstance(data, bytes):
+            data = np.ascontiguousarray(data, dtype=DTYPES[name]).tobytes()
+        padding = -offset % ALIGN
+        chunks.append(b'\0' * padding)
+        offset += padding
+        table.append(SECTION.pack(offset, len(data)))
+        chunks.append(data)
+        offset += len(data)
+
+    header = HEADER.pack(MAGIC, VERSION, len(states), csr.n_keys, csr.edge_count())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header + b''.join(table) + b''.join(chunks))
+    os.replace(tmp_path, path)
+
+class StoredGraph(CSRGraph):
+    """
+     A graph file mapped into memory, with the queries of CSRGraph. State
+     ids are looked up by binary search on the sorted codes rather than
+     in a dict, so nothing is built when the file is opened.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(path + ' is not a graph file')
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(path + ' is not a graph file')
+        try:
+            magic, version, n, n_keys, n_edges = HEADER.unpack_from(self.buffer, 0)
+            if version != VERSION:
+                raise ValueError(path + ' has graph file version ' + str(version) +
+                                 ', expected ' + str(VERSION))
+            sections = {}
+            for k, name in enumerate(SECTIONS):
+                offset, length = SECTION.unpack_from(
+                    self.buffer, HEADER.size + k * SECTION.size)
+                if offset + length > len(self.buffer):
+                    raise ValueError(path + ' is truncated')
+                sections[name] = (offset, length)
+        except struct.error:
+            raise ValueError(path + ' is truncated')
+
+        def array(name):
+            offset, length = sections[name]
+            dtype = np.dtype(DTYPES[name])
+            return np.frombuffer(self.buffer, dtype, length // dtype.itemsize, offset)
+
+        self.codes = array('codes')
+        self.n_keys = n_keys
+        self.succ_ptr = array('succ_ptr')
+        self.succ = array('succ')
+        self.pred_ptr = array('pred_ptr')
+        self.pred = array('pred')
+        self.by_code = array('by_code')
+        self.phase_tags = array('phases')
+        self.name_ptr = array('name_ptr')
+        self.names_offset = sections['names'][0]
+        offset, length = sections['meta']
+        self.meta = json.loads(self.buffer[offset:offset + length].decode('utf-8'))
+        if len(self.codes) != n or len(self.succ) != n_edges:
+            raise ValueError(path + ' is corrupt')
+
+    def id(self, sd):
+        code = sd.get_code()
+        k = int(np.searchsorted(self.codes, code, sorter=self.by_code))
+        if k == len(self.by_code) or self.codes[self.by_code[k]] != code:
+            raise KeyError(sd)
+        return int(self.by_code[k])
+
+    def state(self, i):
+        sd = State_Description.from_code(int(self.codes[i]))
+        sd.set_name(self.name(i))
+        return sd
+
+    def name(self, i):
+        begin = self.names_offset + int(self.name_ptr[i])
+        end = self.names_offset + int(self.name_ptr[i + 1])
+        return self.buffer[begin:end].decode('utf-8')
+
+    def phase(self, i):
+        ''' The name of the phase that expanded state i, or None. '''
+        tag = int(self.phase_tags[i])
+        return None if tag == NO_PHASE else self.meta['phases'][tag]
+
+    def root(self):
+        return State_Description.from_code(self.meta['root'])
+
+    def metadata(self):
+        return self.meta['model']
+
+    def phase_map(self):
+        ''' {State_Description: str}, as explore's expanded_by. '''
+        return dict((State_Description.from_code(int(self.codes[i])), self.phase(i))
+                    for i in range(len(self.codes)) if self.phase(i) is not None)
+
+    def close(self):
+        ''' Unmap the file. Arrays returned by queries must be gone by then. '''
+        # the arrays are views of the map, so they go first
+        self.codes = self.succ_ptr = self.succ = self.pred_ptr = self.pred = None
+        self.by_code = self.phase_tags = self.name_ptr = None
+        self.buffer.close()
+
+def open_graph(path):
+    """
+     (str) -> StoredGraph
+
+     Map the graph file at path into memory. Raises OSError if it cannot
+     be opened and ValueError if it is not a graph file of this version.
+    """
+    return StoredGraph(path)
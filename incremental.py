@@ -0,0 +1,268 @@
+'''
+Incremental rebuilds of the state graph after rule or phase edits.
+
+IncrementalBuilder keeps the graph it built together with its provenance:
+the candidate successors of every expanded (state, id_val) pair, the
+plausibility rules that pruned each candidate, and a log of every phase's
+depth-first search, one step per expanded state with the neighbors it
+added. When the rules change, only the pairs whose candidates are hit by
+an added or removed rule have their successors recomputed.
+
+The phases are depth-first searches whose blacklist and oscillation
+checks depend on everything found before, so an expansion can depend on
+states outside its own subtree, and invalidating only the descendants of
+a changed state would not give the graph a fresh build gives. Instead the
+search is rewound to the first step that expanded a pair whose successors
+changed: the logged steps after it are undone, which pops their edges off
+the adjacency lists, and the steps before it are replayed from the log
+without any lookups. The search then goes on from there. A later phase is
+reused as it was logged, or resumed at its own first changed step, as long
+as the graph it starts from came out the same; otherwise it is searched
+again. The logs take memory in proportion to the graph, not to the number
+of phases times its size.
+'''
+
+from constraints import load_rules
+from state_description import *
+from state_graph import (PLAUSIBILITY, TUB_PHASES, EPSILON, classify_candidates,
+                         find_neighbors)
+from transition_table import TransitionTable
+
+def rule_keys(rules):
+    """
+     (RuleSet) -> {Rule: (str, int)}
+
+     Key every rule by its text and the number of rules before it with the
+     same text, so that repeated rules can be told apart.
+    """
+    keys = {}
+    seen = {}
+    for rule in rules.rules:
+        keys[rule] = (rule.text, seen.get(rule.text, 0))
+        seen[rule.text] = seen.get(rule.text, 0) + 1
+    return keys
+
+class IncrementalBuilder:
+    def __init__(self, phases=TUB_PHASES, rules=PLAUSIBILITY):
+        self.phases = list(phases)
+        self.rules = rules
+        self.keys = rule_keys(rules)
+        self.graph = {}
+        self.edges = set()
+        self.table = TransitionTable(b'', self._generate)
+
+        # candidate successors that pass epsilon ordering, per (code, id_val)
+        self.candidates = {}
+        # (code, id_val) pairs that generated each candidate code
+        self.generated_by = {}
+        # candidate code -> keys of the rules that pruned it, per pair
+        self.pruned = {}
+        # (code, id_val) pairs with a candidate pruned by each rule key
+        self.pruned_by = {}
+        # the steps (sd, whether sd was new, neighbors added) of each
+        # phase, and the codes each phase expanded
+        self.logs = []
+        self.expanded = []
+
+        self.resume(0)
+
+    def _generate(self, params, id_val):
+        ''' Compute and record the successors of a state for the table. '''
+        pair = (encode(params), id_val)
+        candidates = [code for code, pruned in classify_candidates(params, id_val)
+                      if pruned != EPSILON]
+        self.candidates[pair] = candidates
+        for code in candidates:
+            self.generated_by.setdefault(code, set()).add(pair)
+        return self._accepted(pair)
+
+    def _accepted(self, pair):
+        ''' Filter the candidates of pair by the current rules. '''
+        for keys in self.pruned.get(pair, {}).values():
+            for key in keys:
+                self.pruned_by.get(key, set()).discard(pair)
+
+        pruned = {}
+        accepted = []
+        for code in self.candidates[pair]:
+            matching = self.rules.matching_rules(decode(code))
+            if matching:
+                pruned[code] = [self.keys[rule] for rule in matching]
+                for rule in matching:
+                    self.pruned_by.setdefault(self.keys[rule], set()).add(pair)
+            elif code != pair[0]:
+                accepted.append(code)
+        self.pruned[pair] = pruned
+        return accepted
+
+    def expanded_in(self, sd):
+        ''' The indices of the phases that expanded sd. '''
+        code = sd.get_code()
+        return [k for k, codes in enumerate(self.expanded) if code in codes]
+
+    def pruning_rules(self, sd, id_val):
+        """
+         (State_Description, int) -> {State_Description: [str]}
+
+         The candidate successors of sd under id_val that were pruned for
+         plausibility, with the text of the rules that pruned them.
+        """
+        pruned = self.pruned.get((sd.get_code(), id_val), {})
+        return dict((State_Description.from_code(code), [text for text, _ in keys])
+                    for code, keys in pruned.items())
+
+    def apply(self, step):
+        ''' Redo a logged step on the graph. '''
+        sd, new, added = step
+        if new:
+            self.graph[sd] = []
+        self.graph[sd].extend(added)
+        self.edges.update((sd, child) for child in added)
+
+    def undo(self, log):
+        ''' Take the steps of a log back, last first. '''
+        for sd, new, added in reversed(log):
+            if added:
+                del self.graph[sd][-len(added):]
+                self.edges.difference_update((sd, child) for child in added)
+            if new:
+                del self.graph[sd]
+
+    def run(self, phase, prefix=()):
+        """
+         (Phase, [step]) -> [step]
+
+         Search depth-first from the frontier of phase like run_phase, but
+         take the first steps from prefix, a log of the same search, without
+         looking up any successors. Returns the log of the search.
+        """
+        to_search = list(phase.frontier(self.graph))
+        blacklist = phase.blacklist(self.graph, set(to_search))
+        searched = set()
+        log = []
+
+        for step in prefix:
+            # pop the states searched before, then the one the step expanded
+            while to_search.pop() in searched:
+                pass
+            searched.add(step[0])
+            self.apply(step)
+            to_search.extend(step[2])
+            log.append(step)
+
+        while len(to_search) > 0:
+            sd = to_search.pop()
+            if sd in searched:
+                continue
+            searched.add(sd)
+            new = sd not in self.graph
+            if new:
+                self.graph[sd] = []
+            before = len(self.graph[sd])
+            find_neighbors(self.graph, to_search, blacklist, sd, phase.id_val,
+                           self.edges, self.table)
+            log.append((sd, new, tuple(self.graph[sd][before:])))
+        return log
+
+    def resume(self, start, changed=frozenset(), fresh=frozenset()):
+        """
+         Rewind the graph to before phase start and search again from
+         there, patching self.graph in place. changed holds the (code,
+         id_val) pairs whose successors changed, and fresh the indices of
+         the phases that changed themselves. While the graph a phase starts
+         from is the one it was logged on, the phase replays its log up to
+         its first expansion of a changed pair.
+        """
+        old_logs = self.logs[start:]
+        for log in reversed(old_logs):
+            self.undo(log)
+        del self.logs[start:]
+        del self.expanded[start:]
+
+        # whether the graph still is the one the old logs start from
+        same = True
+        for k in range(start, len(self.phases)):
+            phase = self.phases[k]
+            old = old_logs[k - start] if k - start < len(old_logs) else None
+            prefix = []
+            if same and old is not None and k not in fresh:
+                for step in old:
+                    if (step[0].get_code(), phase.id_val) in changed:
+                        break
+                    prefix.append(step)
+            log = self.run(phase, prefix)
+            same = same and log == old
+            self.logs.append(log)
+            self.expanded.append(set(sd.get_code() for sd, _, _ in log))
+
+    def first_phase(self, pairs):
+        ''' The first phase that expanded any of the (code, id_val) pairs. '''
+        for k, phase in enumerate(self.phases):
+            if any(id_val == phase.id_val and code in self.expanded[k]
+                   for code, id_val in pairs):
+                return k
+        return None
+
+    def update_rules(self, rules):
+        """
+         (RuleSet) -> int or None
+
+         Switch to a new set of plausibility rules and patch the graph.
+         Returns the first phase that had to be searched again, or None if
+         the edit did not change the graph.
+        """
+        old = set(self.keys.values())
+        keys = rule_keys(rules)
+        self.rules = rules
+        self.keys = keys
+
+        # removed rules may let candidates they pruned through
+        affected = set()
+        for key in old - set(keys.values()):
+            affected.update(self.pruned_by.pop(key, ()))
+        # added rules may prune candidates that used to be accepted
+        added = [rule for rule in rules.rules if keys[rule] not in old]
+        if added:
+            for code, pairs in self.generated_by.items():
+                params = decode(code)
+                if any(rule.matches(params) for rule in added):
+                    affected.update(pairs)
+
+        changed = set()
+        for pair in affected:
+            accepted = self._accepted(pair)
+            if tuple(accepted) != self.table.entries[pair]:
+                self.table.add(pair, accepted)
+                changed.add(pair)
+
+        start = self.first_phase(changed)
+        if start is not None:
+            self.resume(start, changed)
+        return start
+
+    def reload_rules(self, path):
+        ''' Re-read a rules file and patch the graph. '''
+        return self.update_rules(load_rules(path))
+
+    def update_phases(self, phases):
+        """
+         ([Phase]) -> int or None
+
+         Switch to a new list of phases and patch the graph, searching again
+         from the first phase that differs. Returns that phase, or None if
+         the phases are unchanged.
+        """
+        phases = list(phases)
+        fresh = set(k for k in range(len(phases))
+                    if k >= len(self.phases) or not same_phase(phases[k], self.phases[k]))
+        start = min(fresh) if fresh else None
+        if start is None and len(phases) < len(self.phases):
+            start = len(phases)
+        self.phases = phases
+        if start is not None:
+            self.resume(start, fresh=fresh)
+        return start
+
+def same_phase(a, b):
+    return (a.name, a.id_val, a.frontier, a.blacklist) == \
+           (b.name, b.id_val, b.frontier, b.blacklist)
@@ -0,0 +1,146 @@
+'''
+Counters and timings for graph exploration.
+
+Pass an ExplorationStats to state_graph.explore to find out where
+candidates are pruned and where the time goes. Without one, the search
+does no bookkeeping at all.
+'''
+
+import json
+import time
+
+from state_graph import (EPSILON, IMPLAUSIBLE, SELF_LOOP, TUB_SPACES, classify_candidates,
+                         transitions_key)
+
+# counters of every phase, in the order they are reported
+COUNTERS = [
+    'expanded',      # states expanded
+    'duplicates',    # pushes of states that were already on the stack
+    'generated',     # candidate successors generated by the rules
+    'epsilon',       # candidates pruned by epsilon ordering
+    'plausibility',  # candidates pruned by plausibility.rules
+    'self loop',     # candidates equal to the state itself
+    'known',         # successors that were already connected
+    'blacklisted',   # successors in the phase's blacklist
+    'oscillation',   # successors that would close a two-state cycle
+    'edges',         # edges added to the graph
+]
+
+# candidate counts of every (transitions key, code, id_val) seen so far;
+# these only depend on the rules and spaces the key fingerprints, so they
+# are shared between runs
+_candidate_counts = {}
+
+def candidate_counts(sd, id_val, spaces=TUB_SPACES, key=None):
+    """
+     (State_Description, int, TubSpaces, bytes) -> {str: int}
+
+     Count the candidates the rules generate for sd under id_val, and
+     how many of them each rule prunes. key is transitions_key(spaces),
+     for callers that already have it.
+    """
+    if key is None:
+        key = transitions_key(spaces)
+    pair = (key, sd.get_code(), id_val)
+    if pair not in _candidate_counts:
+        candidates = classify_candidates(sd.get_all_params(), id_val, spaces)
+        counts = {'generated': len(candidates)}
+        for reason in (EPSILON, IMPLAUSIBLE, SELF_LOOP):
+            counts[reason] = sum(1 for _, pruned in candidates if pruned == reason)
+        _candidate_counts[pair] = counts
+    return _candidate_counts[pair]
+
+class PhaseStats:
+    ''' The counters and wall time of a single phase. '''
+    def __init__(self, name, id_val, spaces=TUB_SPACES):
+        self.name = name
+        self.id_val = id_val
+        self.spaces = spaces
+        # the rules cannot change while the phase runs
+        self.key = transitions_key(spaces)
+        self.counts = dict((counter, 0) for counter in COUNTERS)
+        self.seconds = 0.0
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def stop(self):
+        self.seconds += time.perf_counter() - self._started
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def expand(self, sd, id_val):
+        ''' Record the expansion of sd and the candidates it generated. The
+        phase's timer is paused while the candidates are counted. '''
+        paused = time.perf_counter()
+        self.counts['expanded'] += 1
+        for counter, n in candidate_counts(sd, id_val, self.spaces, self.key).items():
+            self.counts[counter] += n
+        self._started += time.perf_counter() - paused
+
+    def as_dict(self):
+        result = {'phase': self.name, 'id_val': self.id_val,
+                  'seconds': self.seconds}
+        result.update(self.counts)
+        return result
+
+class ExplorationStats:
+    ''' The statistics of every phase of an exploration. '''
+    def __init__(self):
+        self.phases = []
+
+    def start_phase(self, name, id_val, spaces=TUB_SPACES):
+        phase = PhaseStats(name, id_val, spaces)
+        self.phases.append(phase)
+        phase.start()
+        return phase
+
+    def totals(self):
+        totals = dict((counter, 0) for counter in COUNTERS)
+        for phase in self.phases:
+            for counter, n in phase.counts.items():
+                totals[counter] += n
+        totals['seconds'] = sum(phase.seconds for phase in self.phases)
+        return totals
+
+    def by_id_val(self):
+        ''' Sum the counters of the phases that share an exogenous id_val. '''
+        groups = {}
+        for phase in self.phases:
+            group = groups.setdefault(phase.id_val, dict((c, 0) for c in COUNTERS))
+            for counter, n in phase.counts.items():
+                group[counter] += n
+            group['seconds'] = group.get('seconds', 0.0) + phase.seconds
+        return groups
+
+    def as_dict(self):
+        return {'phases': [phase.as_dict() for phase in self.phases],
+                'id_vals': dict((str(id_val), counts)
+                                for id_val, counts in sorted(self.by_id_val().items())),
+                'total': self.totals()}
+
+    def to_json(self, path=None):
+        ''' Return the statistics as JSON, and write them to path if given. '''
+        text = json.dumps(self.as_dict(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+        return text
+
+    def summary(self):
+        ''' A table of the counters, one column per phase. '''
+        names = [phase.name + ' (' + '{:+d}'.format(phase.id_val) + ')'
+                 for phase in self.phases] + ['total']
+        columns = [phase.counts for phase in self.phases] + [self.totals()]
+        width = max(12, max(len(name) for name in names) + 1)
+
+        lines = [' ' * 13 + ''.join(name.rjust(width) for name in names)]
+        for counter in COUNTERS:
+            lines.append(counter.ljust(13) +
+                         ''.join(str(column[counter]).rjust(width) for column in columns))
+        seconds = [phase.seconds for phase in self.phases] + [self.totals()['seconds']]
+        lines.append('ms'.ljust(13) +
+                     ''.join('{:.3f}'.format(1e3 * s).rjust(width) for s in seconds))
+        return '\n'.join(lines)
@@ -0,0 +1,141 @@
+'''
+A layered layout of the state graph for the viewer.
+
+Every state is placed on the layer of its breadth-first distance from the
+root (tap_on), and within a layer the states are grouped by the phase that
+expanded them, in the order the phases first appear, then kept in the
+order they were reached. The layout takes one pass over the graph and
+comes out the same every time.
+
+Layouts are cached on disk under a fingerprint of the graph, its phases
+and the layout version, so an unchanged graph is laid out only once.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import deque
+
+# next to this module, like the transition table, wherever the viewer runs
+LAYOUT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'layouts.cache')
+# bump when the placement changes, so old cached layouts are ignored
+LAYOUT_VERSION = 1
+
+# horizontal space between neighbouring states, and between phase groups
+SPACING = 1.0
+PHASE_GAP = 0.5
+
+def layers(graph, roots):
+    """
+     ({state: [state]}, [state]) -> [[state]]
+
+     The states of graph grouped by their breadth-first distance from the
+     roots, in the order they were reached. States the roots cannot reach
+     form one more layer at the end.
+    """
+    depth = {}
+    result = []
+    queue = deque()
+    for root in roots:
+        if root not in depth:
+            depth[root] = 0
+            queue.append(root)
+    while queue:
+        node = queue.popleft()
+        if depth[node] == len(result):
+            result.append([])
+        result[depth[node]].append(node)
+        # successors need not have successor lists of their own
+        for child in (graph[node] if node in graph else ()):
+            if child not in depth:
+                depth[child] = depth[node] + 1
+                queue.append(child)
+
+    unreached = [node for node in graph if node not in depth]
+    if unreached:
+        result.append(unreached)
+    return result
+
+def bfs_names(graph, roots):
+    ''' Name the states s0, s1, ... in breadth-first order, as the viewer does. '''
+    order = (node for layer in layers(graph, roots) for node in layer)
+    return dict((node, 's' + str(k)) for k, node in enumerate(order))
+
+def layered_layout(graph, roots, phases=None):
+    """
+     ({state: [state]}, [state], {state: str}) -> {state: (float, float)}
+
+     Place the states of graph in layers below the roots. graph may be a
+     dict of successor lists or a networkx DiGraph; phases optionally maps
+     states to the phase that expanded them.
+    """
+    if phases is None:
+        phases = {}
+    grouped = layers(graph, roots)
+
+    # rank the phases by their first appearance, left to right
+    rank = {}
+    for layer in grouped:
+        for node in layer:
+            rank.setdefault(phases.get(node), len(rank))
+
+    pos = {}
+    for y, layer in enumerate(grouped):
+        # sorted is stable, so each group keeps the order it was reached in
+        layer = sorted(layer, key=lambda node: rank[phases.get(node)])
+        xs = []
+        x = 0.0
+        for k, node in enumerate(layer):
+            if k > 0:
+                x += SPACING
+                if phases.get(node) != phases.get(layer[k - 1]):
+                    x += PHASE_GAP
+            xs.append(x)
+        # center every layer below the root
+        offset = x / 2.0
+        for node, x in zip(layer, xs):
+            pos[node] = (x - offset, float(-y))
+    return pos
+
+def fingerprint(graph, roots, phases=None):
+    ''' A key that changes whenever the layout of graph would. '''
+    if phases is None:
+        phases = {}
+    digest = hashlib.sha1(('layout ' + str(LAYOUT_VERSION) + '\n').encode('utf-8'))
+    for root in roots:
+        digest.update(('root ' + str(root.get_code()) + '\n').encode('utf-8'))
+    for node in graph:
+        line = [str(node.get_code()), str(phases.get(node))]
+        line += [str(child.get_code()) for child in graph[node]]
+        digest.update((' '.join(line) + '\n').encode('utf-8'))
+    return digest.hexdigest()
+
+def cached_layout(graph, roots, phases=None, directory=LAYOUT_CACHE):
+    """
+     Return the layered layout of graph, from the cache in directory if it
+     was computed before. The states must be State_Descriptions, which are
+     stored by their codes.
+    """
+    path = os.path.join(directory, fingerprint(graph, roots, phases) + '.json')
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        pos = dict((node, tuple(stored[str(node.get_code())])) for node in graph)
+        return pos
+    except (OSError, ValueError, KeyError):
+        pass
+
+    pos = layered_layout(graph, roots, phases)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # write atomically, so a crash never leaves half a layout behind
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict((str(node.get_code()), pos[node]) for node in graph), f)
+        os.replace(tmp, path)
+    except OSError:
+        # the cache is only an optimization
+        pass
+    return pos
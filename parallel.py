@@ -0,0 +1,145 @@
+'''
+Parallel frontier expansion with a process pool.
+
+Successor generation only depends on a state and its exogenous influences,
+so every breadth-first layer of the frontier can be split into chunks and
+expanded by worker processes. The parent merges the results layer by layer
+in frontier order, so the graph is identical to the one built by a single
+process, down to the order of its nodes and edges.
+
+To compare the parallel and sequential paths on a chain of tubs, execute
+
+    python parallel.py [--tubs 6] [--limit 2000] [--workers 4]
+'''
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from state_description import *
+
+# per-process model for the workers, set by the pool initializer
+_model = None
+_exogenous = None
+
+def _init_worker(model, exogenous):
+    global _model, _exogenous
+    _model = model
+    _exogenous = exogenous
+
+def _expand_chunk(states):
+    return [_model.successors(state, _exogenous) for state in states]
+
+def _transition_chunk(codes, id_val, spaces):
+    # imported here so that workers only load the rules when they need them
+    from state_graph import TUB_SPACES, compute_successors
+    if spaces is None:
+        spaces = TUB_SPACES
+    return [compute_successors(decode(code), id_val, spaces) for code in codes]
+
+def chunks(items, workers):
+    """
+     ([object], int) -> [[object]]
+
+     Split items into consecutive chunks, a few per worker so that uneven
+     chunks still keep every worker busy.
+    """
+    size = max(1, -(-len(items) // (4 * workers)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def expand_layer(pool, layer, workers):
+    ''' Expand every state in layer on the pool, keeping layer order. '''
+    results = []
+    for successors in pool.map(_expand_chunk, chunks(layer, workers)):
+        results.extend(successors)
+    return results
+
+def parallel_explore(model, start, exogenous=None, limit=None, workers=None):
+    """
+     The process pool counterpart of Model.explore: builds the same graph,
+     expanding each breadth-first layer across workers processes.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    graph = {}
+    frontier = [start]
+    seen = set(frontier)
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(model, exogenous)) as pool:
+        while frontier:
+            truncated = limit is not None and len(graph) + len(frontier) > limit
+            if truncated:
+                frontier = frontier[:limit - len(graph)]
+            next_frontier = []
+            for state, successors in zip(frontier, expand_layer(pool, frontier, workers)):
+                graph[state] = successors
+                for successor in successors:
+                    if successor not in seen:
+                        seen.add(successor)
+                        next_frontier.append(successor)
+            if truncated:
+                break
+            frontier = next_frontier
+    return graph
+
+def prefetch_transitions(pool, table, frontier, id_val, workers, spaces=None):
+    """
+     Fill table with the successors of every state reachable from frontier
+     under id_val, computing the missing entries layer by layer on pool.
+     The depth-first search of a phase then only does table lookups.
+     spaces are the TubSpaces the table is for, by default the tub's.
+    """
+    layer = [sd.get_code() for sd in frontier]
+    seen = set(layer)
+    while layer:
+        missing = [code for code in layer if (code, id_val) not in table.entries]
+        parts = chunks(missing, workers)
+        results = pool.map(_transition_chunk, parts, [id_val] * len(parts),
+                           [spaces] * len(parts))
+        for part, successors in zip(parts, results):
+            for code, codes in zip(part, successors):
+                table.add((code, id_val), codes)
+
+        next_layer = []
+        for code in layer:
+            for successor in table.entries[(code, id_val)]:
+                if successor not in seen:
+                    seen.add(successor)
+                    next_layer.append(successor)
+        layer = next_layer
+
+def main():
+    from qr_model import tub_chain
+
+    parser = argparse.ArgumentParser(
+        description='Compare parallel and sequential exploration of a chain of tubs.')
+    parser.add_argument('--tubs', type=int, default=6)
+    parser.add_argument('--limit', type=int, default=2000,
+                        help='number of states to expand')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    model = tub_chain(args.tubs)
+    start = model.state({'inflow': (ZERO, POS)})
+    exogenous = {'inflow': POS}
+
+    begin = time.perf_counter()
+    sequential = model.explore(start, exogenous, limit=args.limit)
+    sequential_time = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    parallel = parallel_explore(model, start, exogenous, limit=args.limit,
+                                workers=args.workers)
+    parallel_time = time.perf_counter() - begin
+
+    identical = list(sequential.items()) == list(parallel.items())
+    print('Expanded ' + str(len(sequential)) + ' states of a chain of ' +
+          str(args.tubs) + ' tubs.')
+    print('sequential: {:.2f}s, parallel ({} workers): {:.2f}s, speedup {:.2f}x'.format(
+          sequential_time, args.workers, parallel_time,
+          sequential_time / parallel_time))
+    print('The graphs are ' + ('identical.' if identical else 'DIFFERENT.'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+'''
+Behaviours of the tub: paths through the state graph.
+
+Every path from tap_on to a state without successors is one qualitative
+behaviour of the tub. This module counts them without enumerating them,
+finds the shortest and longest ones, and enumerates them lazily, so that
+millions of behaviours can be inspected one at a time.
+
+Counting works on the condensation of the graph: its strongly connected
+components, found with an iterative version of Tarjan's algorithm, form a
+DAG. The number of paths to a state is the sum over its predecessors,
+taken in topological order; a state that can be reached through a cycle
+is reached by infinitely many paths.
+
+To print the behaviours of the tub, or of a stored graph, execute
+
+    python paths.py [-i graph.qrg] [--show 10]
+'''
+
+import argparse
+from collections import deque
+
+INFINITE = float('inf')
+
+def successors(graph, node):
+    ''' graph may be a dict of successor lists or a networkx DiGraph. '''
+    return graph[node] if node in graph else ()
+
+def strongly_connected_components(graph, roots=None):
+    """
+     ({state: [state]}, [state]) -> [[state]]
+
+     The strongly connected components of the states reachable from roots
+     (by default, of all states), in reverse topological order: no
+     component has an edge to a component after it.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in (graph if roots is None else roots):
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # each entry is a state and an iterator over its remaining successors
+        work = [(root, iter(successors(graph, root)))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors(graph, child))))
+                    break
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+def is_cyclic(graph, component):
+    ''' Whether a component contains a cycle, possibly a self loop. '''
+    return len(component) > 1 or component[0] in successors(graph, component[0])
+
+def terminal_states(graph, source):
+    ''' The states reachable from source that have no successors. '''
+    return [component[0] for component in
+            reversed(strongly_connected_components(graph, [source]))
+            if len(successors(graph, component[0])) == 0]
+
+def count_paths(graph, source):
+    """
+     ({state: [state]}, state) -> {state: int or float}
+
+     The number of paths from source to every state reachable from it,
+     INFINITE for states that can be reached through a cycle. Linear in
+     the size of the reachable graph.
+    """
+    components = strongly_connected_components(graph, [source])
+    component_of = {}
+    for k, component in enumerate(components):
+        for node in component:
+            component_of[node] = k
+
+    counts = dict((node, 0) for node in component_of)
+    counts[source] = 1
+    # topological order, so every count is complete before it is passed on
+    for k in range(len(components) - 1, -1, -1):
+        component = components[k]
+        if is_cyclic(graph, component):
+            for node in component:
+                counts[node] = INFINITE
+        for node in component:
+            for child in successors(graph, node):
+                if component_of[child] != k:
+                    counts[child] += counts[node]
+    return counts
+
+def count_behaviours(graph, source):
+    ''' The number of paths from source to each terminal state. '''
+    counts = count_paths(graph, source)
+    return dict((node, counts[node]) for node in terminal_states(graph, source))
+
+def shortest_path(graph, source, target):
+    """
+     ({state: [state]}, state, state) -> [state] or None
+
+     A path from source to target with the fewest transitions, or None if
+     target cannot be reached.
+    """
+    parent = {source: None}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        if node == target:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = parent[node]
+            return path[::-1]
+        for child in successors(graph, node):
+            if child not in parent:
+                parent[child] = node
+                queue.append(child)
+    return None
+
+def longest_path(graph, source, target=None):
+    """
+     ({state: [state]}, state, state) -> [state] or None
+
+     A path from source to target with the most transitions, or if target
+     is None, the longest path from source to any terminal state. Returns
+     None if target cannot be reached. Raises ValueError if a cycle can be
+     reached, because then there is no longest path.
+    """
+    components = strongly_connected_components(graph, [source])
+    if any(is_cyclic(graph, component) for component in components):
+        raise ValueError('paths can be arbitrarily long: the graph has a cycle')
+
+    # every component is a single state, and they come in reverse topological order
+    length = {source: 0}
+    parent = {source: None}
+    for component in reversed(components):
+        node = component[0]
+        for child in successors(graph, node):
+            if length.get(child, -1) < length[node] + 1:
+                length[child] = length[node] + 1
+                parent[child] = node
+
+    if target is None:
+        terminals = [node for node in length if len(successors(graph, node)) == 0]
+        if not terminals:
+            return None
+        target = max(terminals, key=lambda node: length[node])
+    if target not in length:
+        return None
+    path = []
+    node = target
+    while node is not None:
+        path.append(node)
+        node = parent[node]
+    return path[::-1]
+
+def iter_paths(graph, source, targets=None):
+    """
+     Yield the paths from source to every state in targets (by default, to
+     every terminal state) one at a time, depth first and in successor
+     order. Paths never visit a state twice, so cycles are not followed.
+     Only the current path is kept in memory.
+    """
+    if targets is None:
+        is_target = lambda node: len(successors(graph, node)) == 0
+    else:
+        targets = set(targets)
+        is_target = lambda node: node in targets
+
+    path = [source]
+    on_path = set(path)
+    work = [iter(successors(graph, source))]
+    if is_target(source):
+        yield list(path)
+    while work:
+        for child in work[-1]:
+            if child in on_path:
+                continue
+            path.append(child)
+            on_path.add(child)
+            if is_target(child):
+                yield list(path)
+            work.append(iter(successors(graph, child)))
+            break
+        else:
+            work.pop()
+            on_path.discard(path.pop())
+
+def main():
+    parser = argparse.ArgumentParser(description='Count and list the behaviours of the tub.')
+    parser.add_argument('-i', '--input', metavar='PATH',
+                        help='read the graph from a graph file instead of building it')
+    parser.add_argument('--show', type=int, default=10, metavar='N',
+                        help='list the first N behaviours (default: 10)')
+    args = parser.parse_args()
+
+    from layout import bfs_names
+    if args.input is not None:
+        from graph_store import open_graph
+        stored = open_graph(args.input)
+        graph = stored.to_dict()
+        source = stored.root()
+        stored.close()
+    else:
+        import state_graph
+        graph = state_graph.explore(state_graph.TUB_PHASES)
+        source = state_graph.TAP_ON
+    names = bfs_names(graph, [source])
+
+    def show(path):
+        return ' -> '.join(names[node] for node in path)
+
+    for terminal, count in count_behaviours(graph, source).items():
+        print(str(count) + ' behaviours end in ' + names[terminal] + ' ' +
+              str(terminal.get_all_params()) + '; the shortest is ' +
+              str(len(shortest_path(graph, source, terminal)) - 1) + ' transitions long.')
+    try:
+        longest = longest_path(graph, source)
+        print('The longest behaviour takes ' + str(len(longest) - 1) +
+              ' transitions: ' + show(longest))
+    except ValueError as e:
+        print('There is no longest behaviour: ' + str(e) + '.')
+
+    for k, path in enumerate(iter_paths(graph, source)):
+        if k == args.show:
+            break
+        print(show(path))
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,122 @@
 '''
 Caitlin Lagrand
 Create a state graph.
+
+The graph is streamed as DOT text while it is traversed, so nothing but
+the set of visited states is held in memory. DOT output needs nothing
+else; SVG and PNG output pipe the stream through Graphviz's dot.
 '''
 
-import pydot
+import os
+import shutil
+import subprocess
+import sys
+
+# fill colours for the phases states were expanded in, in order of appearance
+PHASE_COLORS = ['lightblue', 'palegreen', 'khaki', 'lightsalmon', 'plum',
+                'lightgray']
+
+def quote(text):
+    ''' Quote text as a DOT string. '''
+    text = str(text).replace('\\', '\\\\').replace('"', '\\"')
+    return '"' + text.replace('\n', '\\n').replace('\t', ' ') + '"'
+
+class DotWriter:
+    ''' Write a directed graph to a text stream in DOT syntax. '''
+    def __init__(self, out):
+        self.out = out
+        self.out.write('digraph G {\n')
+
+    def node(self, name, attributes):
+        attributes = ', '.join(key + '=' + quote(value)
+                               for key, value in attributes.items())
+        self.out.write('  ' + name + ' [' + attributes + '];\n')
+
+    def edge(self, parent_name, child_name):
+        self.out.write('  ' + parent_name + ' -> ' + child_name + ';\n')
+
+    def close(self):
+        self.out.write('}\n')
 
 class PlotGraph:
-    def __init__(self, qr_graph):
-        self.dot_graph = pydot.Dot(graph_type="digraph")
+    def __init__(self, qr_graph, phases=None, spaces=None):
+        ''' phases optionally maps states to the phase that expanded them;
+        spaces are the quantity spaces that name the magnitudes in labels. '''
         self.qr_graph = qr_graph
-        self.visited = []
+        self.phases = phases if phases is not None else {}
+        self.spaces = spaces
+        self.roots = []
+        self.colors = {}
+
+    def node_name(self, state):
+        return 'n' + str(state.get_code())
 
-    def draw(self, parent_name, child_name):
-        ''' Draw an edge betweeen the parent and child nodes. '''
-        edge = pydot.Edge(str(parent_name), str(child_name))
-        self.dot_graph.add_edge(edge)
+    def node_attributes(self, state):
+        ''' Label every state, and mark its phase and whether it is terminal. '''
+        attributes = {'label': state.to_string(self.spaces)}
+        phase = self.phases.get(state)
+        if phase is not None:
+            if phase not in self.colors:
+                self.colors[phase] = PHASE_COLORS[len(self.colors) % len(PHASE_COLORS)]
+            attributes['style'] = 'filled'
+            attributes['fillcolor'] = self.colors[phase]
+            attributes['tooltip'] = 'phase: ' + phase
+        if len(self.qr_graph.get(state, [])) == 0:
+            attributes['peripheries'] = '2'
+        return attributes
 
     def generate_graph(self, parent):
-        ''' Given the parent node, generate the children recursively. '''
-        if parent in self.visited: return
+        ''' Mark parent as a node to generate the graph from. '''
+        self.roots.append(parent)
+
+    def write(self, out):
+        ''' Given the root nodes, stream the nodes and edges to out, depth first. '''
+        writer = DotWriter(out)
+        visited = set()
+        for root in self.roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            writer.node(self.node_name(root), self.node_attributes(root))
+            stack = [(root, iter(self.qr_graph.get(root, [])))]
+            while stack:
+                parent, children = stack[-1]
+                for child in children:
+                    writer.edge(self.node_name(parent), self.node_name(child))
+                    if child not in visited:
+                        visited.add(child)
+                        writer.node(self.node_name(child), self.node_attributes(child))
+                        stack.append((child, iter(self.qr_graph.get(child, []))))
+                        break
+                else:
+                    stack.pop()
+        writer.close()
+
+    def save(self, path='state_graph.png'):
+        ''' Save the graph as a .dot, .svg or .png file, or as DOT on stdout
+        if path is '-'. '''
+        if path == '-':
+            self.write(sys.stdout)
+            return
 
-        self.visited.append(parent)
-        for child in self.qr_graph[parent]:
-            self.draw(parent, child)
-            self.generate_graph(child)
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in ('.dot', '.gv', '.svg', '.png'):
+            raise ValueError('cannot save a graph as ' + repr(extension))
+        if extension in ('.dot', '.gv'):
+            with open(path, 'w') as out:
+                self.write(out)
+            return
 
-    def save(self):
-        ''' Save the graph as png file. '''
-        self.dot_graph.write_png('state_graph.png')
+        dot = shutil.which('dot')
+        if dot is None:
+            raise OSError('Graphviz dot is needed for ' + extension +
+                          ' output; save as .dot instead')
+        process = subprocess.Popen([dot, '-T' + extension[1:], '-o', path],
+                                   stdin=subprocess.PIPE,
+                                   universal_newlines=True)
+        try:
+            self.write(process.stdin)
+        finally:
+            process.stdin.close()
+        if process.wait() != 0:
+            raise OSError('Graphviz dot failed to write ' + path)
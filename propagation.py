@@ -0,0 +1,608 @@
+'''
+Successor generation by constraint propagation.
+
+Every new magnitude and derivative is a variable with a domain, and
+continuity, influences, proportionalities, epsilon ordering and the
+forbidden patterns are constraints between them, each over only the
+variables it reads. Generalized arc consistency removes every value that
+no combination of the other values in a constraint supports. The search
+then assigns the variables in order and propagates after every
+assignment, so a partial assignment that cannot be completed is cut before
+any candidate is built from it.
+
+There are two generators:
+
+    TubPropagator     the tub of state_graph.py; state_graph.explore and
+                      get_transitions use it with propagate=True
+    ModelPropagator   any qr_model.Model; Model.explore uses it with
+                      propagate=True
+
+For a model, the variables are the magnitudes of the correspondence
+classes. Epsilon ordering and the influences are propagated before any
+magnitude combination is built, so no combination that Model.successors
+would skip or find without derivatives is built. The derivatives then fall
+into groups linked by proportionalities, which are assigned on their own,
+and the successors are the product of the groups' assignments. On chains
+of four or more tubs this is faster than generate-and-test.
+
+The tub has so few candidates (255 for its 162 states and inflows) that
+there is little to cut, and TubPropagator takes several times as long as
+state_graph.compute_successors; it builds fewer candidates, 164.
+
+Variables are assigned in the order generate-and-test loops over them and
+domains are kept sorted, so successors come out in the same order as from
+state_graph.compute_successors and qr_model.Model.successors.
+
+To check the generators against each other and count the candidates and
+partial assignments of each, execute
+
+    python propagation.py [--tubs 4] [--limit 300]
+'''
+
+import argparse
+import time
+from itertools import chain, product
+
+from qr_model import DERIVATIVES
+from state_description import *
+
+# constraints whose scope has more combinations than this are only checked
+# once assignments have narrowed their domains
+SUPPORT_LIMIT = 256
+# the support of a constraint that was too large to revise
+SKIP = ()
+
+class SearchStats:
+    """
+     Counters of successor searches: nodes is the number of partial
+     assignments tried, and built the number of complete assignments
+     reached, which are the candidate states a generator builds: every
+     successor, and the current state where it satisfies the rules.
+     qr_model.Model.successors keeps the same counters for generate-and-test.
+    """
+    def __init__(self):
+        self.searches = 0
+        self.nodes = 0
+        self.built = 0
+
+    def as_dict(self):
+        return {'searches': self.searches, 'nodes': self.nodes, 'built': self.built}
+
+class Problem:
+    """
+     A finite constraint satisfaction problem. Variables are numbered in
+     the order they are added and assigned in that order. A constraint is
+     a scope of distinct variables and a predicate over their values.
+
+     supports caches the values each constraint supports, by constraint
+     and domains of its scope; the search revises the same domains again
+     after every backtrack. Constraints added with a key share their
+     entries with every problem given the same supports dict, so a key must
+     determine the predicate.
+    """
+    def __init__(self, supports=None):
+        self.domains = []
+        self.constraints = []
+        # variable -> the constraints it takes part in
+        self.watch = []
+        self.supports = {} if supports is None else supports
+        # the entries of the constraints without a key
+        self.private = {}
+        # complete assignments that are not solutions
+        self.excluded = set()
+
+    def add_variable(self, domain):
+        self.domains.append(tuple(sorted(domain)))
+        self.watch.append([])
+        return len(self.domains) - 1
+
+    def add_constraint(self, scope, predicate, key=None):
+        k = len(self.constraints)
+        self.constraints.append((tuple(scope), predicate, key))
+        for var in scope:
+            self.watch[var].append(k)
+
+    def exclude(self, values):
+        """
+         Rule out a single complete assignment. It is only checked once
+         all variables are assigned, as a constraint over all of them would
+         be revised after every assignment for nothing.
+        """
+        self.excluded.add(tuple(values))
+
+    def support(self, k, domains):
+        """
+         The values of each variable in the scope of constraint k that some
+         combination of domains, the domains of the scope, satisfies.
+        """
+        scope, predicate, _ = self.constraints[k]
+        size = 1
+        for domain in domains:
+            size *= len(domain)
+        if size > SUPPORT_LIMIT:
+            return SKIP
+        supported = [set() for _ in scope]
+        for values in product(*domains):
+            if predicate(*values):
+                for j, value in enumerate(values):
+                    supported[j].add(value)
+        return [tuple(sorted(values)) for values in supported]
+
+    def revise(self, domains, k):
+        """
+         Remove the values of the scope of constraint k that no
+         combination of the others supports. Returns the variables whose
+         domains shrank, or None if one of them ran empty.
+        """
+        scope, _, key = self.constraints[k]
+        if key is None:
+            cache, key = self.private, k
+        else:
+            cache = self.supports
+        key = (key,) + tuple([domains[var] for var in scope])
+        supported = cache.get(key)
+        if supported is None:
+            supported = cache[key] = self.support(k, key[1:])
+
+        changed = []
+        for var, values in zip(scope, supported):
+            if len(values) < len(domains[var]):
+                if not values:
+                    return None
+                domains[var] = values
+                changed.append(var)
+        return changed
+
+    def propagate(self, domains, queue):
+        ''' Make the constraints in queue arc consistent, and any they affect. '''
+        queued = set(queue)
+        while queue:
+            k = queue.pop()
+            queued.discard(k)
+            changed = self.revise(domains, k)
+            if changed is None:
+                return False
+            for var in changed:
+                for other in self.watch[var]:
+                    if other != k and other not in queued:
+                        queued.add(other)
+                        queue.append(other)
+        return True
+
+    def solve(self, stats=None):
+        """
+         Yield every assignment that satisfies all constraints, as a tuple
+         of values in variable order.
+        """
+        if stats is not None:
+            stats.searches += 1
+
+        domains = list(self.domains)
+        if not self.propagate(domains, list(range(len(self.constraints)))):
+            return
+        if not domains:
+            yield ()
+            return
+        # each entry is a variable and an iterator over the values left to
+        # try, along with the domains before it was assigned
+        work = [(0, iter(domains[0]), domains)]
+        while work:
+            var, values, before = work[-1]
+            for value in values:
+                if stats is not None:
+                    stats.nodes += 1
+                # domains are tuples and revise replaces them, so a shallow
+                # copy keeps the domains before the assignment
+                trial = list(before)
+                trial[var] = (value,)
+                if self.propagate(trial, list(self.watch[var])):
+                    if var + 1 == len(trial):
+                        solution = tuple(domain[0] for domain in trial)
+                        if stats is not None:
+                            stats.built += 1
+                        if solution not in self.excluded:
+                            yield solution
+                    else:
+                        work.append((var + 1, iter(trial[var + 1]), trial))
+                        break
+            else:
+                work.pop()
+
+def tub_problem(params, id_val, spaces=None, supports=None):
+    """
+     ([int], int, TubSpaces, dict) -> Problem
+
+     The successors of the tub state params under the exogenous derivative
+     of inflow id_val, as a problem over the new inflow quantity, volume
+     quantity and volume derivative. Outflow, height and pressure follow
+     volume, as in state_graph.classify_candidates. Every rule is a
+     constraint over only the variables it reads: epsilon ordering pins
+     single variables, and each rule of plausibility.rules constrains the
+     variables its terms mention, once its term on the derivative of
+     inflow, which id_val fixes, is checked. supports is the cache of the
+     problem, and may be shared between the states of one TubSpaces.
+    """
+    from state_graph import (PLAUSIBILITY, TUB_SPACES, VD_SPACE, determine_iq,
+                             determine_vd, determine_vq)
+    if spaces is None:
+        spaces = TUB_SPACES
+
+    problem = Problem(supports)
+    iq = problem.add_variable(determine_iq(params, spaces))
+    vq = problem.add_variable(determine_vq(params, spaces))
+    vd = problem.add_variable(VD_SPACE)
+    # the variable of every parameter; the derivative of inflow has none
+    variable = [iq, None] + 4 * [vq, vd]
+
+    def new_params(scope, values):
+        new = [ZERO, id_val] + 4 * [ZERO, ZERO]
+        for var, value in zip(scope, values):
+            for i in range(N_PARAMS):
+                if variable[i] == var:
+                    new[i] = value
+        return new
+
+    # the influences of inflow and outflow on volume
+    problem.add_constraint((iq, vq, vd), lambda *values: values[2] in
+                           determine_vd(params, new_params((iq, vq), values[:2])),
+                           ('vd', params[ID], params[OD], params[VD]))
+
+    # epsilon ordering, as in state_graph.check_epsilon_ordering: a quantity
+    # on a point with a nonzero derivative leaves it for the neighbouring
+    # interval, rising with the same derivative, and in that instant a
+    # quantity in an interval keeps its value
+    inflow_point = spaces.inflow.leaves(params[IQ], params[ID])
+    volume_point = spaces.volume.leaves(params[VQ], params[VD])
+    if inflow_point:
+        # rising, inflow keeps its derivative
+        keeps = params[ID] != POS or id_val == POS
+        problem.add_constraint((iq,), lambda v: keeps and v == params[IQ] + params[ID],
+                               ('inflow leaves', keeps, params[IQ] + params[ID]))
+    if volume_point:
+        problem.add_constraint((vq,), lambda v: v == params[VQ] + params[VD],
+                               ('volume leaves', params[VQ] + params[VD]))
+        if params[VD] == POS:
+            problem.add_constraint((vd,), lambda v: v == POS, ('rising',))
+    if inflow_point and not volume_point:
+        problem.add_constraint((vq,), lambda v: v == params[VQ], ('volume kept', params[VQ]))
+    if volume_point and not inflow_point:
+        problem.add_constraint((iq,), lambda v: v == params[IQ], ('inflow kept', params[IQ]))
+
+    # plausibility.rules, as check_plausibility reads them
+    for k, rule in enumerate(PLAUSIBILITY.rules):
+        if ID in rule.unary and id_val not in rule.unary[ID]:
+            # the rule cannot match under id_val
+            continue
+        read = set(rule.unary)
+        for pair in rule.binary:
+            read.update(pair)
+        # a rule that only reads the derivative of inflow still needs a scope
+        scope = tuple(sorted(set(variable[i] for i in read
+                                 if variable[i] is not None))) or (iq,)
+        problem.add_constraint(scope, lambda *values, scope=scope, rule=rule:
+                               not rule.matches(spaces.coarse(new_params(scope, values))),
+                               ('rule', k, id_val))
+
+    # the successor differs from the state
+    current = (params[IQ], params[VQ], params[VD])
+    if encode(new_params((iq, vq, vd), current)) == encode(params):
+        problem.exclude(current)
+    return problem
+
+def tub_successors(params, id_val, spaces=None, stats=None, supports=None):
+    """
+     ([int], int, TubSpaces, SearchStats, dict) -> [int]
+
+     The codes state_graph.compute_successors computes, found by
+     propagation. supports is as in tub_problem.
+    """
+    return [encode([iq, id_val] + 4 * [vq, vd])
+            for iq, vq, vd in tub_problem(params, id_val, spaces, supports).solve(stats)]
+
+class TubPropagator:
+    """
+     The successor generator of the tub over one TubSpaces by propagation,
+     with the supports of its constraints cached across states; see
+     state_graph.get_transitions. stats, a SearchStats, counts every search.
+    """
+    def __init__(self, spaces=None):
+        self.spaces = spaces
+        self.supports = {}
+        self.stats = SearchStats()
+
+    def successors(self, params, id_val):
+        ''' ([int], int) -> [int], as compute_successors. '''
+        return tub_successors(params, id_val, self.spaces, self.stats, self.supports)
+
+def model_problem(model, state, exogenous=None, supports=None):
+    """
+     (Model, (int, ...), {str: int}, dict) -> Problem
+
+     The new magnitudes of the successors of state in a qr_model.Model, as
+     a problem with one variable per correspondence class, for the
+     magnitude its quantities share, in class order. Besides continuity,
+     which gives the domains, its constraints are epsilon ordering and,
+     for every quantity whose derivative follows from magnitudes alone
+     (exogenous, influenced or steady ones), that some derivative
+     derivative_options allows does not push the quantity out of its
+     space. supports is the cache of the problem, and may be shared
+     between the states of one model.
+    """
+    if exogenous is None:
+        exogenous = {}
+    classes, influenced, proportional, order = model.compile()
+    n = len(model.quantities)
+    spaces = model.spaces
+
+    problem = Problem(supports)
+    magnitude = [None] * n
+    for members, options in zip(classes, model.magnitude_options(state, classes)):
+        var = problem.add_variable(options)
+        for i in members:
+            magnitude[i] = var
+
+    # if any quantity leaves a point, the transition is instantaneous and
+    # no quantity can leave an interval at the same time
+    if any(spaces[i].leaves(state[2 * i], state[2 * i + 1]) for i in range(n)):
+        for members in classes:
+            kept = tuple(state[2 * i] for i in members
+                         if not spaces[i].is_point(state[2 * i]))
+            if kept:
+                problem.add_constraint((magnitude[members[0]],),
+                                       lambda m, kept=kept: all(m == k for k in kept),
+                                       ('kept', kept))
+
+    for i in range(n):
+        if i in proportional and model.quantities[i] not in exogenous:
+            # follows other derivatives, which the magnitudes do not fix
+            continue
+        if i in influenced and model.quantities[i] not in exogenous:
+            sources = [s for s, _ in influenced[i]]
+        else:
+            sources = []
+        scope = sorted(set(magnitude[s] for s in sources + [i]))
+        old = state[2 * i + 1]
+        problem.add_constraint(scope,
+                               lambda *values, i=i, scope=scope, old=old:
+                               derivative_allows(model, i, scope, values, magnitude,
+                                                 old, influenced, proportional,
+                                                 exogenous),
+                               ('derivative', i, old, exogenous.get(model.quantities[i])))
+    return problem
+
+def derivative_allows(model, i, scope, values, magnitude, old, influenced,
+                      proportional, exogenous):
+    """
+     Check that, with the variables of scope set to values, quantity i can
+     take a derivative that derivative_options allows and that does not
+     push it out of its space.
+    """
+    n = len(model.quantities)
+    new = [ZERO] * (2 * n)
+    state = [ZERO] * (2 * n)
+    state[2 * i + 1] = old
+    for s in range(n):
+        if magnitude[s] in scope:
+            new[2 * s] = values[scope.index(magnitude[s])]
+    space = model.spaces[i]
+    return any(not space.blocks(new[2 * i], d)
+               for d in model.derivative_options(i, state, new, influenced,
+                                                 proportional, exogenous))
+
+class ModelPropagator:
+    """
+     The successor generator of a qr_model.Model by propagation, with the
+     supports of its constraints cached across states. The magnitudes of
+     the correspondence classes are found by model_problem, so a
+     combination that breaks epsilon ordering or leaves an influenced
+     quantity without a derivative is never built.
+
+     Given the magnitudes, derivatives only depend on each other through
+     proportionalities, so the quantities fall into groups linked by them.
+     The derivatives of each group are assigned on their own, in dependency
+     order, and the successors are the product of the groups' assignments;
+     the options of a quantity are memoized by what they depend on.
+     stats, a SearchStats, counts every search.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.supports = {}
+        # the derivatives each quantity may take, by what they depend on
+        self.options = {}
+        # the groups of quantities, by exogenous inputs
+        self.groups = {}
+        self.stats = SearchStats()
+
+    def derivative_groups(self, exogenous):
+        """
+         ({str: int}) -> ([[int]], function, bool)
+
+         The groups of quantities whose derivatives depend on each other, each
+         in dependency order, a function that reorders the concatenated
+         derivatives of the groups by quantity, and whether the product of
+         the groups' assignments needs no sorting.
+        """
+        key = tuple(sorted(exogenous))
+        if key not in self.groups:
+            model = self.model
+            classes, influenced, proportional, order = model.compile()
+            n = len(model.quantities)
+            group = list(range(n))
+            def find(i):
+                while group[i] != i:
+                    i = group[i]
+                return i
+            for i in order:
+                if i in proportional and model.quantities[i] not in exogenous:
+                    for s, _ in proportional[i]:
+                        group[find(s)] = find(i)
+            members = {}
+            for i in order:
+                members.setdefault(find(i), []).append(i)
+            groups = sorted(members.values(), key=lambda members: order.index(members[0]))
+            flat = [i for members in groups for i in members]
+            where = [flat.index(i) for i in range(n)]
+            # with one root per group, and a single source for every other
+            # member, the roots determine the rest of their group, and the
+            # product of the groups comes out in the order of Model.successors
+            followers = [i for i in order
+                         if i in proportional and model.quantities[i] not in exogenous]
+            ordered = len(groups) == n - len(followers) and \
+                all(len(proportional[i]) == 1 for i in followers)
+            self.groups[key] = (groups, lambda values: [values[k] for k in where], ordered)
+        return self.groups[key]
+
+    def successors(self, state, exogenous=None, stats=None):
+        """
+         ((int, ...), {str: int}, SearchStats) -> [(int, ...)]
+
+         The states Model.successors finds, in the same order. stats counts
+         into self.stats by default: every magnitude combination and every
+         partial assignment of a group's derivatives is a node, and every
+         complete state a candidate built.
+        """
+        if exogenous is None:
+            exogenous = {}
+        if stats is None:
+            stats = self.stats
+        stats.searches += 1
+        model = self.model
+        classes, influenced, proportional, order = model.compile()
+        n = len(model.quantities)
+        groups, by_quantity, ordered = self.derivative_groups(exogenous)
+
+        successors = []
+        problem = model_problem(model, state, exogenous, self.supports)
+        for magnitudes in problem.solve():
+            stats.nodes += 1
+            new = [ZERO] * (2 * n)
+            for members, value in zip(classes, magnitudes):
+                for i in members:
+                    new[2 * i] = value
+
+            assignments = []
+            for members in groups:
+                layer = [()]
+                for i in members:
+                    if len(members) == 1:
+                        layer = [(d,) for d in self.derivatives(i, state, new, exogenous)]
+                    else:
+                        extended = []
+                        for derivatives in layer:
+                            for j, d in zip(members, derivatives):
+                                new[2 * j + 1] = d
+                            extended.extend(derivatives + (d,) for d in
+                                            self.derivatives(i, state, new, exogenous))
+                        layer = extended
+                    stats.nodes += len(layer)
+                    if not layer:
+                        break
+                if not layer:
+                    break
+                assignments.append(layer)
+            else:
+                found = []
+                for combination in product(*assignments):
+                    derivatives = by_quantity(tuple(chain.from_iterable(combination)))
+                    found.append(tuple(chain.from_iterable(zip(new[0::2], derivatives))))
+                stats.built += len(found)
+                if not ordered:
+                    # Model.successors assigns derivatives in order
+                    found.sort(key=lambda candidate:
+                               [candidate[2 * i + 1] for i in order])
+                successors.extend(candidate for candidate in found if candidate != state)
+        return successors
+
+    def derivatives(self, i, state, new, exogenous):
+        """
+         The derivatives quantity i may take in new that do not push it out
+         of its space, memoized by the values derivative_options reads.
+        """
+        model = self.model
+        classes, influenced, proportional, order = model.compile()
+        name = model.quantities[i]
+        if name in exogenous:
+            inputs = ()
+        elif i in influenced:
+            inputs = tuple(new[2 * s] for s, _ in influenced[i])
+        elif i in proportional:
+            inputs = tuple(new[2 * s + 1] for s, _ in proportional[i])
+        else:
+            inputs = ()
+        key = (i, state[2 * i + 1], new[2 * i], inputs, exogenous.get(name))
+        options = self.options.get(key)
+        if options is None:
+            space = model.spaces[i]
+            options = self.options[key] = [
+                d for d in model.derivative_options(i, state, new, influenced,
+                                                    proportional, exogenous)
+                if not space.blocks(new[2 * i], d)]
+        return options
+
+def main():
+    from qr_model import tub_chain
+    import state_graph
+
+    parser = argparse.ArgumentParser(
+        description='Compare propagation with generate-and-test successor generation.')
+    parser.add_argument('--tubs', type=int, default=4,
+                        help='the longest chain of tubs to compare on')
+    parser.add_argument('--limit', type=int, default=300,
+                        help='number of states to expand per chain')
+    args = parser.parse_args()
+
+    pairs = [(list(sd.get_all_params()), id_val) for sd in state_graph.tub_states()
+             for id_val in state_graph.ID_SPACE]
+    generated = 0
+    begin = time.perf_counter()
+    for params, id_val in pairs:
+        generated += len(state_graph.classify_candidates(params, id_val))
+    tested_time = time.perf_counter() - begin
+    propagator = TubPropagator()
+    begin = time.perf_counter()
+    found = [propagator.successors(params, id_val) for params, id_val in pairs]
+    propagated_time = time.perf_counter() - begin
+    for (params, id_val), successors in zip(pairs, found):
+        if successors != state_graph.compute_successors(params, id_val):
+            raise AssertionError('the generators disagree on ' + repr(params))
+    stats = propagator.stats
+    print('tub: ' + str(stats.searches) + ' states and inflows; generate-and-test built ' +
+          str(generated) + ' candidates in ' + '{:.1f}'.format(1e3 * tested_time) +
+          ' ms, propagation ' + str(stats.built) + ' after ' + str(stats.nodes) +
+          ' partial assignments in ' + '{:.1f}'.format(1e3 * propagated_time) + ' ms.')
+
+    # nodes and built as counted by both generators; see SearchStats
+    header = '{:>5} {:>9} {:>10} {:>10} {:>10} {:>10} {:>9} {:>9} {:>9}'
+    row = '{:>5} {:>9} {:>10} {:>10} {:>10} {:>10} {:>9} {:>9.1f} {:>9.1f}'
+    print(header.format('tubs', 'expanded', 'g&t nodes', 'g&t built', 'nodes', 'built',
+                        'avoided', 'g&t ms', 'prop ms'))
+    for n in range(1, args.tubs + 1):
+        model = tub_chain(n)
+        start = model.state({'inflow': (ZERO, POS)})
+        exogenous = {'inflow': POS}
+        graph = model.explore(start, exogenous, limit=args.limit)
+
+        tested = SearchStats()
+        for state in graph:
+            model.successors(state, exogenous, tested)
+        begin = time.perf_counter()
+        for state in graph:
+            model.successors(state, exogenous)
+        tested_time = time.perf_counter() - begin
+
+        propagator = ModelPropagator(model)
+        begin = time.perf_counter()
+        found = [propagator.successors(state, exogenous) for state in graph]
+        propagated_time = time.perf_counter() - begin
+        for state, successors in zip(graph, found):
+            if successors != graph[state]:
+                raise AssertionError('the generators disagree on ' + model.describe(state))
+        stats = propagator.stats
+
+        print(row.format(n, len(graph), tested.nodes, tested.built, stats.nodes,
+                         stats.built, tested.nodes - stats.nodes,
+                         1e3 * tested_time, 1e3 * propagated_time))
+    print('Both generators found the same successors, in the same order.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+'''
+Generic qualitative models built from quantities, influences,
+proportionalities and correspondences.
+
+A state of a model is a flat tuple (q0, d0, q1, d1, ...) holding the
+magnitude and derivative of every quantity, in the order the quantities
+were added. Magnitudes are indices into the quantity's space, derivatives
+are NEG, ZERO or POS. For the quantity spaces below this coincides with
+the encoding of State_Description, so the single tub built by tub_model
+uses the same parameter layout as state_graph.py.
+'''
+
+from itertools import product
+
+from state_description import ZERO, POS, NEG
+
+DERIVATIVES = [NEG, ZERO, POS]
+
+class QuantitySpace:
+    """
+     An ordered sequence of values, each of which is either a landmark
+     point or an open interval between two landmarks.
+    """
+    def __init__(self, values, points, zero='0'):
+        self.values = list(values)
+        self.points = set(self.values.index(p) for p in points)
+        # index of the value that counts as zero when reading off signs
+        self.zero = self.values.index(zero) if zero in self.values else 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return 'QuantitySpace(' + repr(self.values) + ', ' + \
+               repr(sorted(self.values[p] for p in self.points)) + ')'
+
+    def is_point(self, index):
+        return index in self.points
+
+    def sign(self, index):
+        ''' The sign of a magnitude, relative to zero. '''
+        return (index > self.zero) - (index < self.zero)
+
+    def leaves(self, index, derivative):
+        ''' Check whether a magnitude must change instantly: a point that
+        is moved by a nonzero derivative. '''
+        return self.is_point(index) and self.next_values(index, derivative) != [index]
+
+    def next_values(self, index, derivative):
+        """
+         (int, int) -> [int]
+
+         The magnitudes that are continuous with index under derivative.
+         A point is left immediately; an interval may be kept or left.
+        """
+        step = index + derivative
+        if derivative == ZERO or step < 0 or step >= len(self.values):
+            return [index]
+        if self.is_point(index):
+            return [step]
+        return sorted([index, step])
+
+    def blocks(self, index, derivative):
+        ''' Check whether derivative would move index out of the space. '''
+        step = index + derivative
+        return self.is_point(index) and (step < 0 or step >= len(self.values))
+
+def landmark_space(landmarks):
+    """
+     ([str]) -> QuantitySpace
+
+     The space of the given landmark points, in increasing order, with an
+     open interval between every two of them: ['0', 'half', 'MAX'] gives
+     0, +, half, +1, MAX.
+    """
+    values = []
+    for k, landmark in enumerate(landmarks):
+        if k == 1:
+            values.append('+')
+        elif k > 1:
+            values.append('+' + str(k - 1))
+        values.append(landmark)
+    return QuantitySpace(values, landmarks)
+
+# the usual spaces: zero and positive, and zero, positive and maximum
+ZP = QuantitySpace(['0', '+'], ['0'])
+ZPM = landmark_space(['0', 'MAX'])
+
+class Model:
+    """
+     A qualitative model: quantities with their spaces, and the causal
+     dependencies between them.
+
+     influences      I+ / I-: the sign of the source's magnitude drives the
+                     target's derivative.
+     proportionalities  P+ / P-: the target's derivative follows the
+                     source's derivative.
+     correspondences the two quantities always take corresponding values.
+    """
+    def __init__(self):
+        self.quantities = []
+        self.spaces = []
+        self.influences = []
+        self.proportionalities = []
+        self.correspondences = []
+        self._compiled = None
+
+    def add_quantity(self, name, space):
+        self.quantities.append(name)
+        self.spaces.append(space)
+        self._compiled = None
+        return len(self.quantities) - 1
+
+    def index(self, name):
+        return self.quantities.index(name)
+
+    def add_influence(self, source, target, sign):
+        self.influences.append((self.index(source), self.index(target), sign))
+        self._compiled = None
+
+    def add_proportionality(self, source, target, sign):
+        self.proportionalities.append((self.index(source), self.index(target), sign))
+        self._compiled = None
+
+    def add_correspondence(self, a, b):
+        a, b = self.index(a), self.index(b)
+        if len(self.spaces[a]) != len(self.spaces[b]):
+            raise ValueError('corresponding quantities need spaces of equal size')
+        self.correspondences.append((a, b))
+        self._compiled = None
+
+    def state(self, values):
+        """
+         ({str: (int, int)}) -> (int, ...)
+
+         Build a state from a mapping of quantity names to (magnitude,
+         derivative); unmentioned quantities are zero and steady.
+        """
+        state = [ZERO] * (2 * len(self.quantities))
+        for name, (magnitude, derivative) in values.items():
+            i = self.index(name)
+            state[2 * i] = magnitude
+            state[2 * i + 1] = derivative
+        return tuple(state)
+
+    def describe(self, state):
+        ''' A readable rendering of a state. '''
+        parts = []
+        for i, name in enumerate(self.quantities):
+            magnitude = self.spaces[i].values[state[2 * i]]
+            derivative = {NEG: '-', ZERO: '0', POS: '+'}[state[2 * i + 1]]
+            parts.append(name + '=(' + magnitude + ',' + derivative + ')')
+        return ' '.join(parts)
+
+    def compile(self):
+        """
+         Derive the structures the successor engine works from: the
+         representative quantity of each correspondence class, and the
+         order in which derivatives can be determined.
+        """
+        if self._compiled is not None:
+            return self._compiled
+        n = len(self.quantities)
+
+        # union the correspondence classes
+        parent = list(range(n))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for a, b in self.correspondences:
+            parent[find(b)] = find(a)
+        members = {}
+        for i in range(n):
+            members.setdefault(find(i), []).append(i)
+        classes = [members[r] for r in sorted(members)]
+
+        influenced = {}
+        for source, target, sign in self.influences:
+            influenced.setdefault(target, []).append((source, sign))
+        proportional = {}
+        for source, target, sign in self.proportionalities:
+            if target not in influenced:
+                proportional.setdefault(target, []).append((source, sign))
+
+        # proportionalities chain derivatives, so order them topologically
+        order = []
+        placed = set(i for i in range(n) if i not in proportional)
+        order.extend(sorted(placed))
+        pending = sorted(proportional)
+        while pending:
+            ready = [i for i in pending
+                     if all(s in placed for s, _ in proportional[i])]
+            if not ready:
+                raise ValueError('proportionalities form a cycle')
+            for i in ready:
+                order.append(i)
+                placed.add(i)
+            pending = [i for i in pending if i not in placed]
+
+        self._compiled = (classes, influenced, proportional, order)
+        return self._compiled
+
+    def magnitude_options(self, state, classes):
+        ''' Continuous magnitudes of each correspondence class. '''
+        options = []
+        for members in classes:
+            allowed = None
+            for i in members:
+                values = set(self.spaces[i].next_values(state[2 * i], state[2 * i + 1]))
+                allowed = values if allowed is None else allowed & values
+            options.append(sorted(allowed))
+        return options
+
+    def derivative_options(self, i, state, new, influenced, proportional, exogenous):
+        """
+         The derivatives quantity i may take in the successor new, whose
+         magnitudes and earlier derivatives are already set.
+        """
+        name = self.quantities[i]
+        old = state[2 * i + 1]
+        if name in exogenous:
+            return [exogenous[name]]
+        if i in influenced:
+            total = set(sign * self.spaces[s].sign(new[2 * s])
+                        for s, sign in influenced[i])
+            total.discard(ZERO)
+            if len(total) > 1:
+                # opposing influences: the derivative is undetermined, so
+                # only continuity restricts it
+                return [d for d in DERIVATIVES if abs(d - old) <= 1]
+            derivative = total.pop() if total else ZERO
+            return [derivative] if abs(derivative - old) <= 1 else []
+        if i in proportional:
+            total = set(sign * new[2 * s + 1] for s, sign in proportional[i])
+            total.discard(ZERO)
+            if len(total) > 1:
+                return [d for d in DERIVATIVES if abs(d - old) <= 1]
+            return [total.pop() if total else ZERO]
+        return [old]
+
+    def successors(self, state, exogenous=None, stats=None):
+        """
+         ((int, ...), {str: int}, SearchStats) -> [(int, ...)]
+
+         Find all states that can be transitioned to from state. exogenous
+         maps quantity names to the derivative imposed on them. If stats
+         (see propagation.SearchStats) is given, it counts the magnitude
+         combinations and derivatives tried as nodes, and the candidate
+         states built, the current state included, as built.
+        """
+        if exogenous is None:
+            exogenous = {}
+        if stats is not None:
+            stats.searches += 1
+        classes, influenced, proportional, order = self.compile()
+        n = len(self.quantities)
+
+        # if any quantity leaves a point, the transition is instantaneous
+        # and no quantity can leave an interval at the same time
+        epsilon = any(self.spaces[i].leaves(state[2 * i], state[2 * i + 1])
+                      for i in range(n))
+
+        successors = []
+        options = self.magnitude_options(state, classes)
+        for magnitudes in product(*options):
+            if stats is not None:
+                stats.nodes += 1
+            new = [ZERO] * (2 * n)
+            for members, magnitude in zip(classes, magnitudes):
+                for i in members:
+                    new[2 * i] = magnitude
+
+            if epsilon and any(new[2 * i] != state[2 * i]
+                               for i in range(n)
+                               if not self.spaces[i].is_point(state[2 * i])):
+                continue
+
+            self._assign_derivatives(state, new, order, 0, influenced,
+                                     proportional, exogenous, successors, stats)
+        return successors
+
+    def _assign_derivatives(self, state, new, order, k, influenced,
+                            proportional, exogenous, successors, stats=None):
+        ''' Branch over the derivatives in dependency order. '''
+        if k == len(order):
+            candidate = tuple(new)
+            if stats is not None:
+                stats.built += 1
+            if candidate != state:
+                successors.append(candidate)
+            return
+        i = order[k]
+        space = self.spaces[i]
+        for derivative in self.derivative_options(i, state, new, influenced,
+                                                  proportional, exogenous):
+            # a derivative may not push a quantity out of its space
+            if space.blocks(new[2 * i], derivative):
+                continue
+            if stats is not None:
+                stats.nodes += 1
+            new[2 * i + 1] = derivative
+            self._assign_derivatives(state, new, order, k + 1, influenced,
+                                     proportional, exogenous, successors, stats)
+
+    def explore(self, start, exogenous=None, limit=None, successors=None,
+                propagate=False):
+        """
+         ((int, ...), {str: int}, int, function, bool) -> {(int, ...): [(int, ...)]}
+
+         Build the state graph reachable from start, breadth first.
+         Stops expanding once limit states have been expanded. successors
+         generates the successors of a state under exogenous, by default
+         self.successors, or if propagate is set, the successors method of a
+         propagation.ModelPropagator, which finds the same ones without
+         building the magnitude combinations the rules rule out.
+        """
+        if successors is None and propagate:
+            from propagation import ModelPropagator
+            successors = ModelPropagator(self).successors
+        if successors is None:
+            successors = self.successors
+        graph = {}
+        frontier = [start]
+        seen = set(frontier)
+        while frontier:
+            next_frontier = []
+            for state in frontier:
+                if limit is not None and len(graph) >= limit:
+                    return graph
+                graph[state] = successors(state, exogenous)
+                for successor in graph[state]:
+                    if successor not in seen:
+                        seen.add(successor)
+                        next_frontier.append(successor)
+            frontier = next_frontier
+        return graph
+
+def tub_model():
+    """
+     The single tub of state_graph.py: inflow and outflow influence the
+     volume, and volume, height, pressure and outflow are proportional and
+     correspond to each other.
+    """
+    model = Model()
+    model.add_quantity('inflow', ZP)
+    for name in ('volume', 'outflow', 'height', 'pressure'):
+        model.add_quantity(name, ZPM)
+    model.add_influence('inflow', 'volume', POS)
+    model.add_influence('outflow', 'volume', NEG)
+    model.add_proportionality('volume', 'height', POS)
+    model.add_proportionality('height', 'pressure', POS)
+    model.add_proportionality('pressure', 'outflow', POS)
+    model.add_correspondence('volume', 'height')
+    model.add_correspondence('height', 'pressure')
+    model.add_correspondence('pressure', 'outflow')
+    return model
+
+def tub_chain(n, space=ZPM):
+    """
+     A chain of n tubs in which each tub's outflow is the next tub's
+     inflow. Only the first tub has an exogenous inflow. space is the
+     quantity space of every volume and outflow.
+    """
+    model = Model()
+    model.add_quantity('inflow', ZP)
+    previous = 'inflow'
+    for k in range(1, n + 1):
+        volume = 'volume' + str(k)
+        outflow = 'outflow' + str(k)
+        model.add_quantity(volume, space)
+        model.add_quantity(outflow, space)
+        model.add_influence(previous, volume, POS)
+        model.add_influence(outflow, volume, NEG)
+        model.add_proportionality(volume, outflow, POS)
+        model.add_correspondence(volume, outflow)
+        previous = outflow
+    return model
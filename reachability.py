@@ -0,0 +1,132 @@
+'''
+Reachability queries on the state graph.
+
+ReachabilityIndex condenses the graph into its strongly connected
+components (see paths.py) and gives every component a bitset, a Python
+int, of the components it can reach and of the components that can reach
+it. Asking whether one state can reach another is then a single bit test,
+and listing the descendants or ancestors of a state costs O(n/64) plus
+the size of the answer. Building the index takes one pass over the
+condensation in each direction.
+
+To see which states of the tub can never fill it up, execute
+
+    python reachability.py [-i graph.qrg]
+'''
+
+import argparse
+
+from paths import is_cyclic, strongly_connected_components, successors
+from state_description import *
+
+class ReachabilityIndex:
+    def __init__(self, graph):
+        ''' graph may be a dict of successor lists or a networkx DiGraph. '''
+        # reverse topological order: edges only go to earlier components
+        self.components = strongly_connected_components(graph)
+        self.cyclic = [is_cyclic(graph, component) for component in self.components]
+        self.component_of = {}
+        for k, component in enumerate(self.components):
+            for node in component:
+                self.component_of[node] = k
+
+        children = [set() for _ in self.components]
+        for k, component in enumerate(self.components):
+            for node in component:
+                for child in successors(graph, node):
+                    if self.component_of[child] != k:
+                        children[k].add(self.component_of[child])
+
+        # every component reaches itself; descendants are complete before
+        # their ancestors are visited, and the other way round
+        self.descendant_bits = [0] * len(self.components)
+        for k in range(len(self.components)):
+            bits = 1 << k
+            for child in children[k]:
+                bits |= self.descendant_bits[child]
+            self.descendant_bits[k] = bits
+        self.ancestor_bits = [1 << k for k in range(len(self.components))]
+        for k in range(len(self.components) - 1, -1, -1):
+            for child in children[k]:
+                self.ancestor_bits[child] |= self.ancestor_bits[k]
+
+    def __contains__(self, sd):
+        return sd in self.component_of
+
+    def reaches(self, source, target):
+        ''' Whether there is a path from source to target; a state reaches itself. '''
+        bits = self.descendant_bits[self.component_of[source]]
+        return bool(bits >> self.component_of[target] & 1)
+
+    def states(self, bits):
+        ''' The states in the components of a bitset. '''
+        result = []
+        while bits:
+            low = bits & -bits
+            result.extend(self.components[low.bit_length() - 1])
+            bits ^= low
+        return result
+
+    def descendants(self, sd):
+        ''' The states sd can reach, other than itself unless it is on a cycle. '''
+        k = self.component_of[sd]
+        return [node for node in self.states(self.descendant_bits[k])
+                if node != sd or self.cyclic[k]]
+
+    def ancestors(self, sd):
+        ''' The states that can reach sd, other than itself unless it is on a cycle. '''
+        k = self.component_of[sd]
+        return [node for node in self.states(self.ancestor_bits[k])
+                if node != sd or self.cyclic[k]]
+
+    def mask(self, states):
+        ''' The bitset of the components of states. '''
+        bits = 0
+        for sd in states:
+            bits |= 1 << self.component_of[sd]
+        return bits
+
+    def dead_ends(self, targets):
+        ''' The states that cannot reach any of targets. '''
+        bits = self.mask(targets)
+        return [node for node, k in self.component_of.items()
+                if not self.descendant_bits[k] & bits]
+
+def full_tub(sd):
+    return sd.get_volume_q() == MAX
+
+def fill_dead_ends(graph):
+    ''' The set of states of graph from which the tub can never fill up. '''
+    index = ReachabilityIndex(graph)
+    return set(index.dead_ends([sd for sd in index.component_of if full_tub(sd)]))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List the states of the tub that can never fill it up.')
+    parser.add_argument('-i', '--input', metavar='PATH',
+                        help='read the graph from a graph file instead of building it')
+    args = parser.parse_args()
+
+    from layout import bfs_names
+    if args.input is not None:
+        from graph_store import open_graph
+        stored = open_graph(args.input)
+        graph = stored.to_dict()
+        source = stored.root()
+        stored.close()
+    else:
+        import state_graph
+        graph = state_graph.explore(state_graph.TUB_PHASES)
+        source = state_graph.TAP_ON
+    names = bfs_names(graph, [source])
+
+    index = ReachabilityIndex(graph)
+    full = [sd for sd in index.component_of if full_tub(sd)]
+    dead_ends = index.dead_ends(full)
+    print(str(len(full)) + ' of ' + str(len(index.component_of)) +
+          ' states have a full tub; ' + str(len(dead_ends)) + ' states can never reach one:')
+    for sd in sorted(dead_ends, key=lambda sd: int(names[sd][1:])):
+        print(names[sd] + ' ' + str(sd.get_all_params()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+'''
+Batch runs of many tub scenarios.
+
+A scenario is a start state and a profile of phases, and is described in a
+JSON file:
+
+    {"scenarios": [
+        {"name": "half-full",
+         "start": {"VQ": "+", "OQ": "+", "HQ": "+", "PQ": "+"},
+         "phases": [{"name": "increasing", "id_val": "+", "frontier": "start"},
+                    {"name": "zero", "id_val": "0", "frontier": "leaves"}]}
+    ]}
+
+The start state is the empty tub with the tap turned on (tap_on), with
+the given quantities replaced (values 0, +, -, MAX). Outflow, height and
+pressure follow volume unless they are given, and must correspond to it. Without phases, the
+scenario runs the parabolic inflow profile of main(). The frontier of a
+phase is one of the selectors in FRONTIERS.
+
+All scenarios run in one process by default and share its transition
+table, so the successors of a state are computed at most once for the
+whole batch. With --workers, the scenarios are spread over a process
+pool; every worker loads the table once. Every scenario's graph is
+written as a graph file (see graph_store.py) and its exploration
+statistics as JSON, next to a summary of the batch.
+
+    python scenarios.py scenarios.json [--output-dir scenarios.out]
+                                       [--workers N]
+'''
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from constraints import QUANTITIES, VALUES
+from graph_store import save_graph
+from instrumentation import ExplorationStats
+from reachability import fill_dead_ends
+from state_description import *
+from state_graph import (TAP_ON, Phase, check_state, draining_frontier, explore,
+                         filling_frontier, get_transitions, topped_out_frontier)
+
+def leaves_frontier(graph):
+    ''' states without successors '''
+    return [key for key in graph if len(graph[key]) == 0]
+
+def all_frontier(graph):
+    return list(graph)
+
+def can_fill_frontier(graph):
+    ''' states from which the tub can still fill up '''
+    dead_ends = fill_dead_ends(graph)
+    return [key for key in graph if key not in dead_ends]
+
+def cannot_fill_frontier(graph):
+    ''' states from which the tub can never fill up '''
+    dead_ends = fill_dead_ends(graph)
+    return [key for key in graph if key in dead_ends]
+
+# named frontier selectors; 'start' selects the scenario's start state
+FRONTIERS = {
+    'filling': filling_frontier,
+    'topped_out': topped_out_frontier,
+    'draining': draining_frontier,
+    'leaves': leaves_frontier,
+    'all': all_frontier,
+    'can_fill': can_fill_frontier,
+    'cannot_fill': cannot_fill_frontier,
+}
+
+# the inflow profile of main()
+DEFAULT_PHASES = [
+    {'name': 'increasing', 'id_val': '+', 'frontier': 'start'},
+    {'name': 'steady', 'id_val': '0', 'frontier': 'filling'},
+    {'name': 'decreasing', 'id_val': '-', 'frontier': 'topped_out'},
+    {'name': 'zero', 'id_val': '0', 'frontier': 'draining'},
+]
+
+class Scenario:
+    def __init__(self, name, start, phases):
+        self.name = name
+        self.start = start
+        # (name, id_val, frontier name), kept plain so scenarios can be pickled
+        self.phases = phases
+
+    @classmethod
+    def from_dict(cls, description):
+        ''' Check and convert one entry of a scenario file. '''
+        name = description.get('name')
+        if not isinstance(name, str) or not name or os.sep in name:
+            raise ValueError('every scenario needs a name that can be a file name')
+
+        params = list(TAP_ON.get_all_params())
+        start = description.get('start', {})
+        if not isinstance(start, dict):
+            raise ValueError(name + ': the start state maps quantities to values')
+        for quantity, value in start.items():
+            if quantity not in QUANTITIES:
+                raise ValueError(name + ': unknown quantity ' + repr(quantity))
+            if not isinstance(value, str) or value not in VALUES:
+                raise ValueError(name + ': unknown value ' + repr(value))
+            params[QUANTITIES[quantity]] = VALUES[value]
+        # outflow, height and pressure follow volume unless they are given
+        given = set(QUANTITIES[quantity] for quantity in start)
+        for q, d in ((OQ, OD), (HQ, HD), (PQ, PD)):
+            for i, source in ((q, VQ), (d, VD)):
+                if i not in given:
+                    params[i] = params[source]
+        try:
+            check_state(params)
+        except ValueError as e:
+            raise ValueError(name + ': ' + str(e))
+
+        phases = []
+        for phase in description.get('phases', DEFAULT_PHASES):
+            if phase.get('id_val') not in VALUES or VALUES[phase['id_val']] == MAX:
+                raise ValueError(name + ': id_val must be -, 0 or +')
+            frontier = phase.get('frontier')
+            if frontier != 'start' and frontier not in FRONTIERS:
+                raise ValueError(name + ': unknown frontier ' + repr(frontier))
+            phases.append((phase.get('name', frontier), VALUES[phase['id_val']],
+                           frontier))
+        return cls(name, State_Description(params), phases)
+
+    def tub_phases(self):
+        ''' The scenario's phases as Phases for explore. '''
+        start = self.start
+        def start_frontier(graph):
+            return [start]
+        return [Phase(name, id_val,
+                      start_frontier if frontier == 'start' else FRONTIERS[frontier])
+                for name, id_val, frontier in self.phases]
+
+def load_scenarios(path):
+    ''' (str) -> [Scenario] '''
+    with open(path) as f:
+        descriptions = json.load(f)['scenarios']
+    scenarios = [Scenario.from_dict(description) for description in descriptions]
+    names = [scenario.name for scenario in scenarios]
+    for name in names:
+        if names.count(name) > 1:
+            raise ValueError('more than one scenario is named ' + repr(name))
+    return scenarios
+
+def run_scenario(scenario, output_dir):
+    """
+     (Scenario, str) -> dict
+
+     Explore a scenario, write its graph and statistics to output_dir and
+     return a summary.
+    """
+    stats = ExplorationStats()
+    expanded_by = {}
+    begin = time.perf_counter()
+    graph = explore(scenario.tub_phases(), stats=stats, expanded_by=expanded_by)
+    seconds = time.perf_counter() - begin
+
+    base = os.path.join(output_dir, scenario.name)
+    save_graph(base + '.qrg', graph, scenario.start, expanded_by,
+               {'model': 'tub', 'scenario': scenario.name,
+                'phases': [name for name, _, _ in scenario.phases],
+                'rules': get_transitions().key.hex()})
+    stats.to_json(base + '.stats.json')
+    return {'name': scenario.name,
+            'states': len(graph),
+            'edges': sum(len(children) for children in graph.values()),
+            'seconds': seconds}
+
+def _init_worker():
+    # load the transition table once per worker, not once per scenario
+    get_transitions()
+
+def run_batch(scenarios, output_dir, workers=None):
+    """
+     ([Scenario], str, int) -> [dict]
+
+     Run every scenario and write a summary.json to output_dir. Returns
+     the summaries in scenario order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if workers is None:
+        summaries = [run_scenario(scenario, output_dir) for scenario in scenarios]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            summaries = list(pool.map(run_scenario, scenarios,
+                                      [output_dir] * len(scenarios)))
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summaries, f, indent=2)
+        f.write('\n')
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a batch of tub scenarios.')
+    parser.add_argument('scenarios', help='a JSON file of scenarios')
+    parser.add_argument('--output-dir', default='scenarios.out',
+                        help='where to write the graphs and statistics')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='run the scenarios on a pool of N processes')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    summaries = run_batch(load_scenarios(args.scenarios), args.output_dir,
+                          args.workers)
+    print('{:<24} {:>7} {:>7} {:>10}'.format('scenario', 'states', 'edges', 'ms'))
+    for summary in summaries:
+        print('{:<24} {:>7} {:>7} {:>10.2f}'.format(
+            summary['name'], summary['states'], summary['edges'],
+            1e3 * summary['seconds']))
+    print('Ran ' + str(len(summaries)) + ' scenarios in ' +
+          '{:.2f}'.format(time.perf_counter() - begin) + ' s; see ' +
+          args.output_dir + '.')
+
+if __name__ == '__main__':
+    main()
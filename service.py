@@ -0,0 +1,260 @@
+'''
+A long-running local query service with warm caches.
+
+The service keeps the transition table, the built graphs of scenarios and
+their path counts in memory, and answers requests over a Unix socket or a
+localhost TCP port. Every request is one line of JSON and gets one line of
+JSON back; a client may send many requests over one connection, and many
+clients are served concurrently.
+
+    {"op": "ping"}
+    {"op": "successors", "state": [0, 1, 0, 0, 0, 0, 0, 0, 0, 0], "id_val": 1}
+    {"op": "build", "scenario": "tub"}
+    {"op": "paths", "scenario": "tub", "from": "tap_on", "to": [...], "limit": 5}
+
+States are lists of the ten parameter values, or one of the names in
+NAMED_STATES. A scenario is the name of a loaded scenario ("tub" is always
+there, and runs the profile of main()) or a scenario description as in
+scenarios.py. Without "to", paths counts the behaviours ending in every
+terminal state. Replies are {"id": ..., "ok": true, "result": ...} or
+{"id": ..., "ok": false, "error": "..."}, echoing the id of the request.
+
+Graphs are built once, on a single background thread so the event loop
+keeps answering; concurrent requests for the same scenario share one build,
+and a build that fails is tried again by the next request. Path counts and
+listings run on a pool of query threads for the same reason, and the
+counts are kept per scenario and source.
+
+    python service.py [--host 127.0.0.1] [--port 8765] [--unix PATH]
+                      [--scenarios scenarios.json]
+'''
+
+import argparse
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from paths import count_paths, iter_paths, shortest_path, terminal_states
+from scenarios import Scenario, load_scenarios
+from state_description import *
+from state_graph import (FILLING, ID_SPACE, TAP_ON, check_state, explore,
+                         get_transitions)
+
+NAMED_STATES = {'tap_on': TAP_ON, 'filling': FILLING}
+# the most paths a single request may list
+MAX_LIMIT = 10000
+# threads that count and list paths
+QUERY_THREADS = 4
+
+class RequestError(Exception):
+    ''' A request that cannot be answered; the message goes back to the client. '''
+
+def parse_state(value):
+    if isinstance(value, str):
+        if value not in NAMED_STATES:
+            raise RequestError('unknown state ' + repr(value))
+        return NAMED_STATES[value]
+    if not isinstance(value, list):
+        raise RequestError('a state is a list of ' + str(N_PARAMS) + ' values or a name')
+    try:
+        check_state(value)
+    except ValueError as e:
+        raise RequestError('not a tub state: ' + str(e))
+    return State_Description(value)
+
+def format_state(sd):
+    return list(sd.get_all_params())
+
+def format_count(count):
+    # JSON has no infinity
+    return 'infinite' if math.isinf(count) else count
+
+def forget_failure(cache, key):
+    ''' Drop the future cache[key] once it fails, so that the next request
+    computes it again instead of getting the same error. '''
+    future = cache[key]
+    def forget(done):
+        if (done.cancelled() or done.exception() is not None) and \
+                cache.get(key) is done:
+            del cache[key]
+    future.add_done_callback(forget)
+
+def list_paths(graph, source, target, limit):
+    ''' The shortest path from source to target, and up to limit paths. '''
+    shortest = shortest_path(graph, source, target)
+    paths = []
+    if shortest is not None and limit:
+        for path in iter_paths(graph, source, [target]):
+            paths.append([format_state(sd) for sd in path])
+            if len(paths) == limit:
+                break
+    return shortest, paths
+
+class QueryService:
+    def __init__(self, scenarios=()):
+        self.scenarios = {'tub': Scenario.from_dict({'name': 'tub'})}
+        for scenario in scenarios:
+            self.scenarios[scenario.name] = scenario
+        # scenario name -> future of its (graph, futures of counts by source)
+        self.graphs = {}
+        self.builder = ThreadPoolExecutor(1)
+        self.queries = ThreadPoolExecutor(QUERY_THREADS)
+        self.transitions = get_transitions()
+        self.requests = 0
+
+    def close(self):
+        self.builder.shutdown()
+        self.queries.shutdown()
+
+    def scenario(self, value):
+        if isinstance(value, dict):
+            try:
+                scenario = Scenario.from_dict(value)
+            except ValueError as e:
+                raise RequestError(str(e))
+            known = self.scenarios.get(scenario.name)
+            if known is not None and (known.start, known.phases) != \
+                    (scenario.start, scenario.phases):
+                raise RequestError('another scenario is named ' + repr(scenario.name))
+            self.scenarios[scenario.name] = scenario
+            return scenario
+        if not isinstance(value, str) or value not in self.scenarios:
+            raise RequestError('unknown scenario ' + repr(value))
+        return self.scenarios[value]
+
+    async def graph(self, scenario):
+        ''' The graph of a scenario, built on first use. '''
+        if scenario.name not in self.graphs:
+            loop = asyncio.get_running_loop()
+            self.graphs[scenario.name] = loop.run_in_executor(
+                self.builder, lambda: (explore(scenario.tub_phases()), {}))
+            forget_failure(self.graphs, scenario.name)
+        return await self.graphs[scenario.name]
+
+    async def counts(self, graph, counts, source):
+        ''' The path counts from source, computed on first use. '''
+        if source not in counts:
+            loop = asyncio.get_running_loop()
+            counts[source] = loop.run_in_executor(self.queries, count_paths,
+                                                  graph, source)
+            forget_failure(counts, source)
+        return await counts[source]
+
+    async def query(self, function, *args):
+        ''' Run a path query on the query threads. '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.queries, function, *args)
+
+    async def handle(self, request):
+        ''' Answer one request, or raise RequestError. '''
+        op = request.get('op')
+        if op == 'ping':
+            return 'pong'
+
+        if op == 'successors':
+            sd = parse_state(request.get('state'))
+            id_val = request.get('id_val')
+            if isinstance(id_val, bool) or id_val not in ID_SPACE:
+                raise RequestError('id_val must be -1, 0 or 1')
+            return [format_state(s) for s in self.transitions.successors(sd, id_val)]
+
+        if op == 'build':
+            scenario = self.scenario(request.get('scenario', 'tub'))
+            graph, _ = await self.graph(scenario)
+            return {'scenario': scenario.name, 'states': len(graph),
+                    'edges': sum(len(children) for children in graph.values())}
+
+        if op == 'paths':
+            scenario = self.scenario(request.get('scenario', 'tub'))
+            graph, counts = await self.graph(scenario)
+            source = parse_state(request['from']) if 'from' in request else scenario.start
+            if source not in graph:
+                raise RequestError('the state is not in the graph of ' + scenario.name)
+            limit = request.get('limit', 0)
+            if isinstance(limit, bool) or not isinstance(limit, int) or \
+                    not 0 <= limit <= MAX_LIMIT:
+                raise RequestError('limit must be in 0..' + str(MAX_LIMIT))
+            source_counts = await self.counts(graph, counts, source)
+
+            if 'to' not in request:
+                terminal = await self.query(terminal_states, graph, source)
+                return {'behaviours': [{'to': format_state(sd),
+                                        'count': format_count(source_counts[sd])}
+                                       for sd in terminal]}
+            target = parse_state(request['to'])
+            shortest, paths = await self.query(list_paths, graph, source, target, limit)
+            return {'count': format_count(source_counts.get(target, 0)),
+                    'shortest': None if shortest is None else
+                                [format_state(sd) for sd in shortest],
+                    'paths': paths}
+
+        raise RequestError('unknown op ' + repr(op))
+
+    async def reply(self, line):
+        self.requests += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError('a request is a JSON object')
+            request_id = request.get('id')
+            response = {'ok': True, 'result': await self.handle(request)}
+        except (ValueError, RequestError) as e:
+            response = {'ok': False, 'error': str(e)}
+        except KeyError as e:
+            response = {'ok': False, 'error': 'missing ' + str(e)}
+        except Exception as e:
+            # keep serving the other requests
+            response = {'ok': False, 'error': 'internal error: ' + repr(e)}
+        response['id'] = request_id
+        return json.dumps(response) + '\n'
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    writer.write((await self.reply(line)).encode('utf-8'))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def start_server(service, host='127.0.0.1', port=8765, unix=None):
+    ''' Start serving, on the Unix socket unix if given, or else on host:port. '''
+    if unix is not None:
+        return await asyncio.start_unix_server(service.serve_client, unix)
+    return await asyncio.start_server(service.serve_client, host, port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve state graph queries.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead')
+    parser.add_argument('--scenarios', metavar='PATH',
+                        help='a JSON file of scenarios to serve, as in scenarios.py')
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenarios) if args.scenarios else ()
+    service = QueryService(scenarios)
+
+    async def serve():
+        server = await start_server(service, args.host, args.port, args.unix)
+        where = args.unix if args.unix else args.host + ':' + str(args.port)
+        print('Serving on ' + where + '.')
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+A uniform grid over 2D points, for finding the states under the mouse.
+
+Points are bucketed into square cells of roughly one point each, so a
+nearest-point query only looks at the few cells around the query, and
+rectangle and lasso selections only look at the cells they overlap.
+'''
+
+import math
+
+class GridIndex:
+    def __init__(self, xdata, ydata, items, cell=None):
+        self.points = list(zip(xdata, ydata, items))
+        if not self.points:
+            self.x0 = self.y0 = 0.0
+            self.cell = 1.0
+            self.cells = {}
+            return
+
+        xs = [x for x, _, _ in self.points]
+        ys = [y for _, y, _ in self.points]
+        self.x0, self.y0 = min(xs), min(ys)
+        if cell is None:
+            # aim for about one point per cell
+            area = max(max(xs) - self.x0, 1e-12) * max(max(ys) - self.y0, 1e-12)
+            cell = math.sqrt(area / len(self.points))
+        self.cell = cell if cell > 0 else 1.0
+
+        self.cells = {}
+        for point in self.points:
+            self.cells.setdefault(self.key(point[0], point[1]), []).append(point)
+
+    def key(self, x, y):
+        return (int(math.floor((x - self.x0) / self.cell)),
+                int(math.floor((y - self.y0) / self.cell)))
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        ''' The points in the cells that overlap a rectangle. '''
+        (i0, j0), (i1, j1) = self.key(xmin, ymin), self.key(xmax, ymax)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            # a huge rectangle: visiting the occupied cells is cheaper
+            for (i, j), points in self.cells.items():
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    for point in points:
+                        yield point
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for point in self.cells.get((i, j), ()):
+                    yield point
+
+    def nearest(self, x, y, xtol, ytol):
+        """
+         (float, float, float, float) -> object or None
+
+         The item nearest to (x, y) among those strictly within xtol and
+         ytol of it, or None if there is none.
+        """
+        best = None
+        for px, py, item in self._candidates(x - xtol, y - ytol, x + xtol, y + ytol):
+            if x - xtol < px < x + xtol and y - ytol < py < y + ytol:
+                distance = (px - x) ** 2 + (py - y) ** 2
+                if best is None or distance < best[0]:
+                    best = (distance, item)
+        return None if best is None else best[1]
+
+    def in_rectangle(self, x0, y0, x1, y1):
+        ''' The items inside the rectangle with corners (x0, y0), (x1, y1). '''
+        xmin, xmax = min(x0, x1), max(x0, x1)
+        ymin, ymax = min(y0, y1), max(y0, y1)
+        return [item for px, py, item in self._candidates(xmin, ymin, xmax, ymax)
+                if xmin <= px <= xmax and ymin <= py <= ymax]
+
+    def in_polygon(self, vertices):
+        ''' The items inside the polygon through vertices, as drawn by a lasso. '''
+        if len(vertices) < 3:
+            return []
+        xs = [x for x, _ in vertices]
+        ys = [y for _, y in vertices]
+        return [item for px, py, item in
+                self._candidates(min(xs), min(ys), max(xs), max(ys))
+                if inside(px, py, vertices)]
+
+def inside(x, y, vertices):
+    ''' Check whether (x, y) lies inside a polygon, by ray casting. '''
+    result = False
+    j = len(vertices) - 1
+    for i in range(len(vertices)):
+        xi, yi = vertices[i]
+        xj, yj = vertices[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            result = not result
+        j = i
+    return result
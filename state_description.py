@@ -17,6 +17,55 @@ HD = 7
 PQ = 8
 PD = 9
 
+# the values of the default quantity spaces lie in [NEG, MAX], so two bits
+# per parameter are enough to pack a whole state description into a single
+# int. Spaces with more landmarks have larger magnitudes; their higher bits
+# go into further planes of BITS * N_PARAMS bits above the first, so that
+# states of the default spaces keep the same code.
+BITS = 2
+MASK = (1 << BITS) - 1
+N_PARAMS = 10
+PLANE = BITS * N_PARAMS
+# codes below WIDE have a single plane
+WIDE = 1 << PLANE
+
+def encode(values):
+    """
+     ([int]) -> int
+
+     Pack ten qualitative values into a single integer code. Raises
+     ValueError for a value below NEG, which has no code of its own.
+    """
+    code = 0
+    for i, value in enumerate(values):
+        digit = value - NEG
+        if digit < 0:
+            raise ValueError('qualitative value ' + str(value) + ' is below NEG')
+        shift = BITS * i
+        code |= (digit & MASK) << shift
+        while digit > MASK:
+            digit >>= BITS
+            shift += PLANE
+            code |= (digit & MASK) << shift
+    return code
+
+def decode(code):
+    """
+     (int) -> (int, ...)
+
+     Unpack an integer code into its ten qualitative values.
+    """
+    if code < WIDE:
+        return tuple(((code >> (BITS * i)) & MASK) + NEG for i in range(N_PARAMS))
+    digits = [0] * N_PARAMS
+    shift = 0
+    while code:
+        for i in range(N_PARAMS):
+            digits[i] |= ((code >> (BITS * i)) & MASK) << shift
+        code >>= PLANE
+        shift += BITS
+    return tuple(digit + NEG for digit in digits)
+
 class State_Description:
     """
      A qualitative state description for a tub consisting of an inflow, volume,
@@ -25,12 +74,19 @@ class State_Description:
 
      The parameters of a state description are always given in the following
      order:
-     inflow_q, inflow_d, volume_q, volume_d, outflow_q, outflow_d
+     inflow_q, inflow_d, volume_q, volume_d, outflow_q, outflow_d,
+     height_q, height_d, pressure_q, pressure_d
 
      The parameters passed to State_Description should be (a list of) ints.
      Use the global constants defined above for best results.
+
+     State descriptions are immutable: the ten parameters are packed into a
+     single integer code, which is all that hashing and equality look at.
+     Only the display name may be changed after construction.
     """
 
+    __slots__ = ('_code', 'name')
+
     # mapping of integer values of global constants to strings for printing
     str_trans = {0 : '0\t', 1 : '+\t', -1 : '-\t', 2 : 'MAX'}
 
@@ -41,7 +97,27 @@ class State_Description:
             values = 10 * [ZERO]
             print('Invalid state description: should be ten ints')
 
-        self.params = values
+        self._code = encode(values)
+
+    @classmethod
+    def from_code(cls, code):
+        """ Build a state description directly from its packed code. """
+        sd = cls.__new__(cls)
+        sd.name = "UNSET"
+        sd._code = code
+        return sd
+
+    def _get(self, index):
+        if self._code >= WIDE:
+            return decode(self._code)[index]
+        return ((self._code >> (BITS * index)) & MASK) + NEG
+
+    @property
+    def params(self):
+        return decode(self._code)
+
+    def get_code(self):
+        return self._code
 
     def get_name(self):
         return self.name
@@ -50,89 +126,80 @@ class State_Description:
         self.name = name
 
     def get_inflow_q(self):
-        return self.params[IQ]
+        return self._get(IQ)
 
     def get_inflow_d(self):
-        return self.params[ID]
+        return self._get(ID)
 
     def get_volume_q(self):
-        return self.params[VQ]
+        return self._get(VQ)
 
     def get_volume_d(self):
-        return self.params[VD]
+        return self._get(VD)
 
     def get_outflow_q(self):
-        return self.params[OQ]
+        return self._get(OQ)
 
     def get_outflow_d(self):
-        return self.params[OD]
+        return self._get(OD)
 
     def get_height_q(self):
-        return self.params[HQ]
+        return self._get(HQ)
 
     def get_height_d(self):
-        return self.params[HD]
+        return self._get(HD)
 
     def get_pressure_q(self):
-        return self.params[PQ]
+        return self._get(PQ)
 
     def get_pressure_d(self):
-        return self.params[PD]
+        return self._get(PD)
 
     def get_all_params(self):
-        return self.params
-
-    def set_inflow_q(self, value):
-        self.params[IQ] = value
-
-    def set_inflow_d(self, value):
-        self.params[ID] = value
-
-    def set_volume_q(self, value):
-        self.params[VQ] = value
-
-    def set_volume_d(self, value):
-        self.params[VD] = value
-
-    def set_outflow_q(self, value):
-        self.params[OQ] = value
-
-    def set_outflow_d(self, value):
-        self.params[OD] = value
-
-    def set_height_q(self, value):
-        self.params[HQ] = value
-
-    def set_height_d(self, value):
-        self.params[HD] = value
+        return decode(self._code)
+
+    def labels(self, spaces=None):
+        """
+         (TubSpaces) -> [str]
+
+         The ten parameters as text. Magnitudes are named by their value in
+         the quantity spaces spaces (see state_graph.TubSpaces); without
+         spaces, they are named as in the default spaces.
+        """
+        params = decode(self._code)
+        labels = [State_Description.str_trans.get(p, str(p)).rstrip('\t') for p in params]
+        if spaces is not None:
+            labels[IQ] = spaces.inflow.values[params[IQ]]
+            for i in (VQ, OQ, HQ, PQ):
+                labels[i] = spaces.volume.values[params[i]]
+        return labels
+
+    def to_string(self, spaces=None):
+        """
+         (TubSpaces) -> str
+
+         Tabulate the parameters, with magnitudes named as in labels.
+        """
+        labels = [label + '\t' if len(label) < 3 else label
+                  for label in self.labels(spaces)]
+        string = 'Inflow\tVolume\tOutflow\tHeigth\tPressure\n'
 
-    def set_pressure_q(self, value):
-        self.params[PQ] = value
+        string += 'Q: ' + labels[IQ] + '\t'
+        string += 'Q: ' + labels[VQ] + '\t'
+        string += 'Q: ' + labels[OQ] + '\t'
+        string += 'Q: ' + labels[HQ] + '\t'
+        string += 'Q: ' + labels[PQ] + '\n'
 
-    def set_pressure_d(self, value):
-        self.params[PD] = value
+        string += 'd: ' + labels[ID] + '\t'
+        string += 'd: ' + labels[VD] + '\t'
+        string += 'd: ' + labels[OD] + '\t'
+        string += 'd: ' + labels[HD] + '\t'
+        string += 'd: ' + labels[PD] + '\n'
 
-    def set_all_params(self, values):
-        # sanitize input
-        if len(values) != 10:
-            print('Invalid state description: should be ten ints')
-        else:
-            self.params = values
+        return string
 
     def __str__(self):
-        string = 'Inflow\tVolume\tOutflow\tHeigth\tPressure\n'
-
-        string += 'Q: ' + State_Description.str_trans[self.params[IQ]] + '\t'
-        string += 'Q: ' + State_Description.str_trans[self.params[VQ]] + '\t'
-        string += 'Q: ' + State_Description.str_trans[self.params[OQ]] + '\t'
-        string += 'Q: ' + State_Description.str_trans[self.params[HQ]] + '\t'
-        string += 'Q: ' + State_Description.str_trans[self.params[PQ]] + '\n'
-
-        string += 'd: ' + State_Description.str_trans[self.params[ID]] + '\t'
-        string += 'd: ' + State_Description.str_trans[self.params[VD]] + '\t'
-        string += 'd: ' + State_Description.str_trans[self.params[OD]] + '\t'
-        string += 'd: ' + State_Description.str_trans[self.params[HD]] + '\t'
-        string += 'd: ' + State_Description.str_trans[self.params[PD]] + '\n'
+        string = self.to_string()
 
         # This pretty-print looks the nicest in stdout, but it doesn't align right
         # at all in graphviz prints. The string above format looks okay in
@@ -141,35 +208,38 @@ class State_Description:
         # header = '{: >2}{: ^8}{: ^8}{: ^9}{: ^8}{: ^10}'.format(' ', 'INFLOW', 'VOLUME', 'OUTFLOW', 'HEIGHT', 'PRESSURE')
         # # string = 'INFLOW\t\tVOLUME\tOUTFLOW\tHEIGHT\t\tPRESSURE\n'
         #
-        # quant_string = '{: >2}{: ^8}{: ^8}{: ^9}{: ^8}{: ^10}'.format('Q:', State_Description.str_trans[self.params[IQ]],
-        #                                                               State_Description.str_trans[self.params[VQ]],
-        #                                                               State_Description.str_trans[self.params[OQ]],
-        #                                                               State_Description.str_trans[self.params[HQ]],
-        #                                                               State_Description.str_trans[self.params[PQ]])
-        # # string += 'Q: ' + State_Description.str_trans[self.params[IQ]] + '\t\t\t'
-        # # string += 'Q: ' + State_Description.str_trans[self.params[VQ]] + '\t\t\t'
-        # # string += 'Q: ' + State_Description.str_trans[self.params[OQ]] + '\t\t\t'
-        # # string += 'Q: ' + State_Description.str_trans[self.params[HQ]] + '\t\t\t'
-        # # string += 'Q: ' + State_Description.str_trans[self.params[PQ]] + '\n'
+        # quant_string = '{: >2}{: ^8}{: ^8}{: ^9}{: ^8}{: ^10}'.format('Q:', State_Description.str_trans[params[IQ]],
+        #                                                               State_Description.str_trans[params[VQ]],
+        #                                                               State_Description.str_trans[params[OQ]],
+        #                                                               State_Description.str_trans[params[HQ]],
+        #                                                               State_Description.str_trans[params[PQ]])
+        # # string += 'Q: ' + State_Description.str_trans[params[IQ]] + '\t\t\t'
+        # # string += 'Q: ' + State_Description.str_trans[params[VQ]] + '\t\t\t'
+        # # string += 'Q: ' + State_Description.str_trans[params[OQ]] + '\t\t\t'
+        # # string += 'Q: ' + State_Description.str_trans[params[HQ]] + '\t\t\t'
+        # # string += 'Q: ' + State_Description.str_trans[params[PQ]] + '\n'
         #
-        # deriv_string = '{: >2}{: ^8}{: ^8}{: ^9}{: ^8}{: ^10}'.format('d:', State_Description.str_trans[self.params[ID]],
-        #                                                               State_Description.str_trans[self.params[VD]],
-        #                                                               State_Description.str_trans[self.params[OD]],
-        #                                                               State_Description.str_trans[self.params[HD]],
-        #                                                               State_Description.str_trans[self.params[PD]])
-        # # string += 'd: ' + State_Description.str_trans[self.params[ID]] + '\t\t\t'
-        # # string += 'd: ' + State_Description.str_trans[self.params[VD]] + '\t\t\t'
-        # # string += 'd: ' + State_Description.str_trans[self.params[OD]] + '\t\t\t'
-        # # string += 'd: ' + State_Description.str_trans[self.params[HD]] + '\t\t\t'
-        # # string += 'd: ' + State_Description.str_trans[self.params[PD]] + '\n'
+        # deriv_string = '{: >2}{: ^8}{: ^8}{: ^9}{: ^8}{: ^10}'.format('d:', State_Description.str_trans[params[ID]],
+        #                                                               State_Description.str_trans[params[VD]],
+        #                                                               State_Description.str_trans[params[OD]],
+        #                                                               State_Description.str_trans[params[HD]],
+        #                                                               State_Description.str_trans[params[PD]])
+        # # string += 'd: ' + State_Description.str_trans[params[ID]] + '\t\t\t'
+        # # string += 'd: ' + State_Description.str_trans[params[VD]] + '\t\t\t'
+        # # string += 'd: ' + State_Description.str_trans[params[OD]] + '\t\t\t'
+        # # string += 'd: ' + State_Description.str_trans[params[HD]] + '\t\t\t'
+        # # string += 'd: ' + State_Description.str_trans[params[PD]] + '\n'
         #
         # string = header + '\n' + quant_string + '\n' + deriv_string
 
         return string
 
+    def __repr__(self):
+        return 'State_Description(' + repr(list(decode(self._code))) + ')'
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return (tuple(self.params) == tuple(other.params))
+            return self._code == other._code
         else:
             return False
 
@@ -177,4 +247,4 @@ class State_Description:
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash(tuple(self.params))
+        return self._code
@@ -1,65 +1,91 @@
+import os
+import sys
+import warnings
+
 from state_description import *
-from plot_graph import PlotGraph
-from GUI import StateVisualisation
+from constraints import QUANTITIES, load_rules
+from qr_model import ZP, ZPM, QuantitySpace
+from transition_table import TransitionTable, rules_key, load_or_compile
+
+class TubSpaces:
+    """
+     The quantity spaces of the tub: one for inflow, and one for volume,
+     which outflow, height and pressure correspond to and share. Both are
+     ordered sequences of landmark points and the intervals between them
+     (see qr_model.QuantitySpace), and must start at the point zero.
+     Magnitudes are indices into the spaces, so the default spaces ZP and
+     ZPM give the values ZERO, POS and MAX.
+
+     The plausibility rules are written for the default spaces. They see
+     every magnitude above zero as POS, except the last landmark of the
+     volume space, which they see as MAX.
+    """
+    def __init__(self, inflow=ZP, volume=ZPM):
+        for space in (inflow, volume):
+            if space.zero != 0 or not space.is_point(0):
+                raise ValueError('tub quantity spaces start at the point zero: ' +
+                                 repr(space))
+        self.inflow = inflow
+        self.volume = volume
+        self.iq_space = list(range(len(inflow)))
+        self.vq_space = list(range(len(volume)))
+        # magnitude -> the value the plausibility rules see
+        self.iq_coarse = [ZERO] + (len(inflow) - 1) * [POS]
+        self.vq_coarse = [ZERO] + (len(volume) - 1) * [POS]
+        if volume.is_point(len(volume) - 1):
+            self.vq_coarse[-1] = MAX
+        self.exact = self.iq_coarse == self.iq_space and self.vq_coarse == self.vq_space
+
+    def __repr__(self):
+        return 'TubSpaces(' + repr(self.inflow) + ', ' + repr(self.volume) + ')'
+
+    def coarse(self, params):
+        """
+         ([int]) -> [int]
+
+         The parameters as the plausibility rules see them.
+        """
+        if self.exact:
+            return params
+        coarse = list(params)
+        coarse[IQ] = self.iq_coarse[params[IQ]]
+        for i in range(2, 10, 2):
+            coarse[i] = self.vq_coarse[params[i]]
+        return coarse
+
+# the spaces of the tub in state_graph.png
+TUB_SPACES = TubSpaces()
 
 # discretized quantity and derivative spaces
-IQ_SPACE = [ZERO, POS]
-VQ_SPACE = [ZERO, POS, MAX]
+IQ_SPACE = TUB_SPACES.iq_space
+VQ_SPACE = TUB_SPACES.vq_space
 VD_SPACE = [NEG, ZERO, POS]
 
-def determine_iq(params):
+def determine_iq(params, spaces=TUB_SPACES):
     """
-     ([int]) -> [int]
+     ([int], TubSpaces) -> [int]
 
      Choose plausible transitions for inflow based on the previous
      derivative of inflow.
     """
-    # note that we can ignore continuity for inflow quantity since
-    # it has only two possible values
-
-    # if previous derivative was zero, new quantity stays constant
-    if params[ID] == ZERO:
-        iq_vals = [params[IQ]]
-    # if previous derivative was positive, new quantity cannot decrease
-    # note that ZERO is a point, so (ZERO, POS) must transition to (POS, POS)
-    elif params[ID] == POS:
-        iq_vals = [POS]
-    # if previous derivative was negative, new quantity cannot increase
-    else:
-        iq_vals = IQ_SPACE[:IQ_SPACE.index(params[IQ]) + 1]
+    # if previous derivative was zero, new quantity stays constant; if it
+    # was positive, new quantity cannot decrease, and if it was negative,
+    # it cannot increase. A point such as ZERO is left at once, so
+    # (ZERO, POS) must transition to (POS, POS)
+    return spaces.inflow.next_values(params[IQ], params[ID])
 
-    return iq_vals
-
-def determine_vq(params):
+def determine_vq(params, spaces=TUB_SPACES):
     """
-     ([int]) -> [int]
+     ([int], TubSpaces) -> [int]
 
      Choose plausible transitions for volume based on the previous
      derivative of volume.
     """
-    # if previous derivative was zero, new quatity stays constant
-    if params[VD] == ZERO:
-        vq_vals = [params[VQ]]
-    # if previous derivative was positive, new quantity cannot decrease
-    elif params[VD] == POS:
-        if params[VQ] == ZERO:
-            # Zero is a point, so we must transition out
-            vq_vals = [POS]
-        elif params[VQ] == POS:
-            vq_vals = [POS, MAX]
-        else:
-            vq_vals = [MAX]
-    # if previous derivative was negative, new quantity cannot increase
-    else:
-        if params[VQ] == ZERO:
-            vq_vals = [ZERO]
-        elif params[VQ] == POS:
-            vq_vals = [ZERO, POS]
-        else:
-            # MAX is a point, so we must transition out
-            vq_vals = [POS]
-
-    return vq_vals
+    # as for inflow: a point (ZERO, MAX or any other landmark) is left at
+    # once under a nonzero derivative, an interval may be kept or left for
+    # the next value in the direction of the derivative, and the derivative
+    # cannot push volume out of its space
+    return spaces.volume.next_values(params[VQ], params[VD])
 
 def determine_vd(params, new_params):
     """
@@ -186,89 +212,79 @@ def check_vd_continuity(params):
 
     return vd_vals
 
-def check_epsilon_ordering(params, new_params):
+def check_epsilon_ordering(params, new_params, spaces=TUB_SPACES):
     """
-     ([int], [int]) -> bool
+     ([int], [int], TubSpaces) -> bool
 
      Check that instantaneous point transitions have occured before
      gradual interval transitions.
     """
-    inflow_point = False
-    volume_point = False
-
-    epsilon_ordered = True
-
-    if params[IQ] == ZERO and params[ID] == POS:
-        if new_params[IQ] != POS or new_params[ID] != POS:
-            epsilon_ordered = False
-        inflow_point = True
-    if params[VQ] == ZERO and params[VD] == POS:
-        if new_params[VQ] != POS or new_params[VD] != POS:
-            epsilon_ordered = False
-        volume_point = True
-    elif params[VQ] == MAX and params[VD] == NEG:
-        if new_params[VQ] != POS or params[VD] != NEG:
-            epsilon_ordered = False
-        volume_point = True
+    # a quantity on a point with a nonzero derivative leaves it at once for
+    # the neighbouring interval. Rising, it keeps its derivative; falling,
+    # the derivative may already change, as when volume leaves MAX and
+    # inflow and outflow balance at once
+    inflow_point = spaces.inflow.leaves(params[IQ], params[ID])
+    volume_point = spaces.volume.leaves(params[VQ], params[VD])
 
     if inflow_point:
-        if not volume_point and (new_params[VQ] != params[VQ]):
-            epsilon_ordered = False
+        if new_params[IQ] != params[IQ] + params[ID] or \
+                (params[ID] == POS and new_params[ID] != POS):
+            return False
     if volume_point:
-        if not inflow_point and (new_params[IQ] != params[IQ]):
-            epsilon_ordered = False
+        if new_params[VQ] != params[VQ] + params[VD] or \
+                (params[VD] == POS and new_params[VD] != POS):
+            return False
 
-    return epsilon_ordered
+    # during such an instant, a quantity in an interval cannot change
+    if inflow_point and not volume_point and new_params[VQ] != params[VQ]:
+        return False
+    if volume_point and not inflow_point and new_params[IQ] != params[IQ]:
+        return False
 
-def check_plausibility(new_params):
+    return True
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'plausibility.rules')
+
+# There are some states that should not be possible, but our algorithm
+# isn't sophisticated enough to tell, so we have to remove them ad-hoc.
+# The blacklist of such states is kept in a rules file.
+PLAUSIBILITY = load_rules(RULES_PATH)
+
+def check_plausibility(new_params, spaces=TUB_SPACES):
     """
-     ([int]) -> bool
+     ([int], TubSpaces) -> bool
 
      Check that a proposed state description is plausible.
      Any description proposed by find_neighbors is assumed
-     to be plausible if it is not in this blacklist.
-    """
-    plausible = True
-
-    # during the phase where inflow is increasing, volume shouldn't stabilize
-    # in an interval
-    if new_params == [POS, POS, POS, ZERO, POS, ZERO, POS, ZERO, POS, ZERO]:
-        plausible = False
-    # at the momemnt that inflow 'tops out', volume shouldn't already be
-    # draining
-    if new_params == [POS, ZERO, MAX, NEG, MAX, NEG, MAX, NEG, MAX, NEG]:
-        plausible = False
-    # at the moment that inflow 'tops out', volume shouldn't start draining
-    # from an interval
-    if new_params == [POS, ZERO, POS, NEG, POS, NEG, POS, NEG, POS, NEG]:
-        plausible = False
-    # should never reach a state where inflow is (ZERO, NEG)
-    if new_params == [ZERO, NEG, ZERO, ZERO, ZERO, ZERO, ZERO, ZERO, ZERO, ZERO]:
-        plausible = False
-    if new_params == [ZERO, NEG, MAX, NEG, MAX, NEG, MAX, NEG, MAX, NEG]:
-        plausible = False
-    if new_params == [ZERO, NEG, POS, NEG, POS, NEG, POS, NEG, POS, NEG]:
-        plausible = False
-    # inflow shouldn't be completely stopped before the tub starts draining
-    if new_params == [ZERO, ZERO, MAX, NEG, MAX, NEG, MAX, NEG, MAX, NEG]:
-        plausible = False
-
-    return plausible
-
-def find_neighbors(graph, to_search, blacklist, sd, id_val):
+     to be plausible if it matches none of the rules in
+     plausibility.rules.
     """
-     Find all state descriptions which can be transitioned to from sd
-     and add the appropriate edges to the graph.
+    return PLAUSIBILITY.allows(spaces.coarse(new_params))
+
+# reasons for which a candidate successor can be pruned
+EPSILON = 'epsilon'
+IMPLAUSIBLE = 'plausibility'
+SELF_LOOP = 'self loop'
+
+def classify_candidates(params, id_val, spaces=TUB_SPACES):
+    """
+     ([int], int, TubSpaces) -> [(int, str)]
+
+     Generate every candidate successor of the state with the given
+     parameters under the exogenous derivative of inflow id_val, paired
+     with the reason it was pruned for, or None if it is a true successor.
+     Candidates are given as state codes.
     """
-    # parameters of the current state
-    params = sd.get_all_params()
+    candidates = []
+    code = encode(params)
     # parameters of the state being transitioned to
     new_params = [0] * 10
     new_params[ID] = id_val
 
-    iq_vals = determine_iq(params)
+    iq_vals = determine_iq(params, spaces)
 
-    vq_vals = determine_vq(params)
+    vq_vals = determine_vq(params, spaces)
 
     for iq_val in iq_vals:
         new_params[IQ] = iq_val
@@ -293,148 +309,504 @@ def find_neighbors(graph, to_search, blacklist, sd, id_val):
                     new_params[i] = vd_val
 
                 # check epsilon ordering
-                epsilon_ordered = check_epsilon_ordering(params, new_params)
+                epsilon_ordered = check_epsilon_ordering(params, new_params, spaces)
+                new_code = encode(new_params)
 
                 if not epsilon_ordered:
+                    candidates.append((new_code, EPSILON))
                     continue
 
                 # There are some states that should not be possible, but
                 # our algorithm isn't sophisticated enough to tell, so we have to
                 # remove them ad-hoc.
-                plausible = check_plausibility(new_params)
+                plausible = check_plausibility(new_params, spaces)
 
                 if not plausible:
+                    candidates.append((new_code, IMPLAUSIBLE))
                     continue
 
                 # After all that pruning, the state described by new_params
-                # can truly be called a neighbor of the current state.
-                # It only remains to show that the neighbor is neither equivalent
-                # to the current state nor already related to it.
-                neighbor = State_Description(new_params)
-
-                if neighbor == sd:
-                    continue
+                # can truly be called a neighbor of the current state,
+                # as long as it is not equivalent to the current state.
+                if new_code == code:
+                    candidates.append((new_code, SELF_LOOP))
                 else:
-                    if neighbor not in graph[sd] and neighbor not in  blacklist:
-                        # prevent oscillation between pairs of closely related states
-                        if neighbor in graph.keys():
-                            if sd in graph[neighbor]:
-                                continue
-                        # clunky syntax required to cope with mutable objects
-                        graph[sd] += [State_Description(new_params.copy())]
-                        to_search.append(State_Description(new_params.copy()))
+                    candidates.append((new_code, None))
 
-def main():
+    return candidates
+
+def compute_successors(params, id_val, spaces=TUB_SPACES):
     """
-     Build a state transition graph for an initially empty tub with an
-     exogenously determined parabolic increasing inflow.
+     ([int], int, TubSpaces) -> [int]
+
+     Compute the codes of all state descriptions which can be transitioned
+     to from the state with the given parameters under the exogenous
+     derivative of inflow id_val. This only depends on the rules, not on
+     the graph built so far.
     """
-    # state transition graph
-    graph = {}
-    # describe an empty tub with no inflow in the instant the tap is turned on
-    tap_on = State_Description([ZERO, POS] + 8 * [ZERO])
-
-    # stack of nodes to search depth-first
-    to_search = [tap_on]
-    searched = []
-
-    # Blacklist is meant to capture the notion of "phases" in graph construction.
-    # We don't want states from the current part of the construction to point
-    # backwards. This helps capture the parabolic shape we're after and prevent
-    # oscillation between closely related states. In each phase, every known state
-    # is either searchable or blacklisted.
-    # Blacklist starts out empty in the first phase.
-    blacklist = []
-
-    # build a graph under the exogenous influence: inflow is increasing
-    id_val = POS
-    while len(to_search) > 0:
-        sd = to_search.pop()
-        if sd not in searched:
-            searched.append(sd)
-            if sd not in graph.keys():
-                graph[sd] = []
-            find_neighbors(graph, to_search, blacklist, sd, id_val)
-    # describe a tub where all parameters are positive after the tap
-    # has been turned on
-    filling = State_Description(10 * [POS])
-
-    # reset the search stack
-    # let filling and its descendents be the frontier, and blacklist
-    # ancestors of filing
-    to_search = []
-    searched = []
-    blacklist = []
-    for key in graph.keys():
-        if key == filling or key in graph[filling]:
-            to_search.append(key)
-        else:
-            blacklist.append(key)
+    return [code for code, pruned in classify_candidates(params, id_val, spaces)
+            if pruned is None]
+
+# the rules that determine the transition table, along with the
+# quantity spaces and plausibility.rules
+RULES = [TubSpaces, QuantitySpace, determine_iq, determine_vq, determine_vd,
+         second_derivative_negative, second_derivative_positive,
+         check_vd_continuity, check_epsilon_ordering, check_plausibility,
+         classify_candidates, compute_successors]
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'transitions.cache')
+
+# exogenous derivatives of inflow the table is compiled for
+ID_SPACE = [NEG, ZERO, POS]
+
+_transitions = None
+# in-memory tables of other quantity spaces, by transitions_key
+_space_transitions = {}
+# propagation.TubPropagator of each quantity space, by transitions_key
+_propagators = {}
+# (plausibility rules source, fingerprint of RULES and those rules)
+_rules_key = None
+
+def tub_states(spaces=TUB_SPACES):
+    """
+     (TubSpaces) -> [State_Description]
 
-    # build a graph under the exogenous influence: inflow becomes steady
-    id_val = ZERO
-    while len(to_search) > 0:
-        sd = to_search.pop()
-        if sd not in searched:
-            searched.append(sd)
-            if sd not in graph.keys():
-                graph[sd] = []
-            find_neighbors(graph, to_search, blacklist, sd, id_val)
-
-    # reset the search stack
-    # let all descendents of filling whose inflows are (POS, ZERO)
-    # be in the new frontier; blacklist all others
-    to_search = []
-    searched = []
-    blacklist = []
-    for key in graph.keys():
-        if key in graph[filling] and key.get_inflow_d() == ZERO:
-            to_search.append(key)
-        else:
-            blacklist.append(key)
+     Enumerate every state description the tub model can be in: volume
+     quantity and derivative determine those of outflow, height and pressure.
+    """
+    states = []
+    for iq in spaces.iq_space:
+        for id_val in ID_SPACE:
+            for vq in spaces.vq_space:
+                for vd in VD_SPACE:
+                    states.append(State_Description([iq, id_val] + 4 * [vq, vd]))
+    return states
+
+def check_state(params, spaces=TUB_SPACES):
+    """
+     ([int], TubSpaces) -> None
 
-    # build a graph under the exogenous influence: inflow is decreasing
-    id_val = NEG
-    while len(to_search) > 0:
-        sd = to_search.pop()
-        if sd not in searched:
-            searched.append(sd)
-            if sd not in graph.keys():
-                graph[sd] = []
-            find_neighbors(graph, to_search, blacklist, sd, id_val)
-
-    # reset the search stack to all states with negative inflows;
-    # blacklist all others
-    to_search = []
-    searched = []
-    blacklist = []
-    for key in graph.keys():
-        if key.get_inflow_d() == NEG:
-            to_search.append(key)
+     Check that params describe one of tub_states(spaces): every magnitude
+     and derivative lies in its space, and outflow, height and pressure
+     correspond to volume. Raises ValueError otherwise.
+    """
+    if len(params) != N_PARAMS:
+        raise ValueError('a tub state has ' + str(N_PARAMS) + ' parameters')
+    names = sorted(QUANTITIES, key=QUANTITIES.get)
+    allowed = {IQ: spaces.iq_space, VQ: spaces.vq_space}
+    for i, value in enumerate(params):
+        space = allowed.get(i, spaces.vq_space if i % 2 == 0 else VD_SPACE)
+        if isinstance(value, bool) or value not in space:
+            raise ValueError(names[i] + ' must be one of ' +
+                             ', '.join(str(v) for v in space) + ', not ' + repr(value))
+    for q, d in ((OQ, OD), (HQ, HD), (PQ, PD)):
+        if (params[q], params[d]) != (params[VQ], params[VD]):
+            raise ValueError(names[q] + ' and ' + names[d] +
+                             ' must correspond to VQ and VD')
+
+def transitions_key(spaces=TUB_SPACES):
+    """ Fingerprint the rules and the quantity spaces of a transition table. """
+    global _rules_key
+    # fingerprinting the rule functions is slow, so it is redone only when
+    # the plausibility rules have been replaced
+    if _rules_key is None or _rules_key[0] != PLAUSIBILITY.source:
+        _rules_key = (PLAUSIBILITY.source,
+                      rules_key(RULES, VD_SPACE, ID_SPACE, BITS, PLAUSIBILITY.source))
+    return rules_key([], _rules_key[1], spaces)
+
+def successor_generator(spaces=TUB_SPACES, propagate=False):
+    """
+     (TubSpaces, bool) -> function
+
+     The function that computes the successor codes of (params, id_val)
+     for a transition table: compute_successors, or if propagate is set,
+     propagation.TubPropagator, which finds the same successors by
+     constraint propagation.
+    """
+    if not propagate:
+        return lambda params, id_val: compute_successors(params, id_val, spaces)
+    key = transitions_key(spaces)
+    if key not in _propagators:
+        from propagation import TubPropagator
+        _propagators[key] = TubPropagator(spaces)
+    return _propagators[key].successors
+
+def compile_transitions(path=TABLE_PATH, force=False, propagate=False):
+    """
+     Load the transition table of the tub model from path, compiling it
+     first if it is missing, stale, or force is set. propagate selects the
+     generator that compiles it, as in successor_generator.
+    """
+    global _transitions
+    key = transitions_key()
+    if force and os.path.exists(path):
+        os.remove(path)
+    _transitions = load_or_compile(path, key, successor_generator(propagate=propagate),
+                                   tub_states(), ID_SPACE)
+    return _transitions
+
+def get_transitions(spaces=TUB_SPACES, propagate=False):
+    """
+     Return the transition table, loading it on first use. The table of
+     other quantity spaces than TUB_SPACES is not stored on disk; it starts
+     empty, fills in as states are expanded and is kept for the process.
+     propagate selects the generator that computes missing entries from
+     now on, as in successor_generator; both give the same entries.
+    """
+    if spaces is not TUB_SPACES:
+        key = transitions_key(spaces)
+        if key not in _space_transitions:
+            _space_transitions[key] = TransitionTable(key, None)
+        table = _space_transitions[key]
+    else:
+        if _transitions is None:
+            compile_transitions(propagate=propagate)
+        table = _transitions
+    table.generate = successor_generator(spaces, propagate)
+    return table
+
+def find_neighbors(graph, to_search, blacklist, sd, id_val, edges=None,
+                   transitions=None, stats=None):
+    """
+     Find all state descriptions which can be transitioned to from sd
+     and add the appropriate edges to the graph.
+
+     edges is an optional set of (parent, child) pairs mirroring graph;
+     when given, edge and oscillation checks are hash lookups instead of
+     scans of the adjacency lists, and new edges are recorded in it.
+     transitions is the transition table to use, by default the one
+     compiled from the current rules. stats is an optional PhaseStats
+     that counts why successors were rejected.
+    """
+    if transitions is None:
+        transitions = get_transitions()
+    if stats is not None:
+        stats.expand(sd, id_val)
+    # It only remains to show that each neighbor is not already related
+    # to the current state.
+    for neighbor in transitions.successors(sd, id_val):
+        if edges is None:
+            known = neighbor in graph[sd]
+            # prevent oscillation between pairs of closely related states
+            oscillates = neighbor in graph and sd in graph[neighbor]
         else:
-            blacklist.append(key)
+            known = (sd, neighbor) in edges
+            oscillates = (neighbor, sd) in edges
+        if not known and neighbor not in blacklist:
+            if oscillates:
+                if stats is not None:
+                    stats.count('oscillation')
+                continue
+            # state descriptions are immutable, so the neighbor
+            # can be shared between the graph and the stack
+            graph[sd].append(neighbor)
+            to_search.append(neighbor)
+            if edges is not None:
+                edges.add((sd, neighbor))
+            if stats is not None:
+                stats.count('edges')
+        elif stats is not None:
+            stats.count('known' if known else 'blacklisted')
+
+class Phase:
+    """
+     One phase of graph construction under a fixed exogenous influence.
+
+     id_val is the derivative of inflow imposed during the phase.
+     frontier(graph) returns the states to search, in stack order.
+     blacklist(graph, frontier) returns the known states that may not be
+     transitioned to; by default every known state outside the frontier.
+    """
+    def __init__(self, name, id_val, frontier, blacklist=None):
+        self.name = name
+        self.id_val = id_val
+        self.frontier = frontier
+        if blacklist is None:
+            blacklist = outside_frontier
+        self.blacklist = blacklist
+
+def outside_frontier(graph, frontier):
+    """
+     ({State_Description: [State_Description]}, {State_Description})
+     -> {State_Description}
+
+     Blacklist every known state that is not part of the frontier.
+    """
+    return set(key for key in graph if key not in frontier)
+
+# describe an empty tub with no inflow in the instant the tap is turned on
+TAP_ON = State_Description([ZERO, POS] + 8 * [ZERO])
+# describe a tub where all parameters are positive after the tap
+# has been turned on
+FILLING = State_Description(10 * [POS])
+
+def tap_on_frontier(graph):
+    return [TAP_ON]
+
+def filling_frontier(graph):
+    """ states with a rising inflow above zero and some volume in the tub;
+    the states before them end up blacklisted """
+    return [key for key in graph if key.get_inflow_q() != ZERO and
+            key.get_inflow_d() == POS and key.get_volume_q() != ZERO]
+
+def topped_out_frontier(graph):
+    """ states whose inflow is above zero and steady """
+    return [key for key in graph if key.get_inflow_q() != ZERO and
+            key.get_inflow_d() == ZERO]
+
+def draining_frontier(graph):
+    """ all states with negative inflows """
+    return [key for key in graph if key.get_inflow_d() == NEG]
+
+# Phases are meant to capture the parabolic shape of the inflow. We don't
+# want states from the current part of the construction to point backwards,
+# so in each phase every known state is either searchable or blacklisted.
+# This also prevents oscillation between closely related states.
+TUB_PHASES = [
+    # inflow is increasing
+    Phase('increasing', POS, tap_on_frontier),
+    # inflow becomes steady
+    Phase('steady', ZERO, filling_frontier),
+    # inflow is decreasing
+    Phase('decreasing', NEG, topped_out_frontier),
+    # inflow has stabilized to zero
+    Phase('zero', ZERO, draining_frontier),
+]
+
+def run_phase(graph, edges, phase, transitions=None, stats=None,
+              spaces=TUB_SPACES):
+    """
+     Search depth-first from the frontier of phase, adding every state and
+     edge found under its exogenous influence to graph and edges.
+     Returns the states expanded, in the order they were expanded.
+     If stats, an ExplorationStats, is given, the phase is recorded in it;
+     transitions must then be the table of spaces.
+    """
+    if stats is not None:
+        stats = stats.start_phase(phase.name, phase.id_val, spaces)
+
+    to_search = list(phase.frontier(graph))
+    blacklist = phase.blacklist(graph, set(to_search))
+    searched = set()
+    expanded = []
 
-    # build a graph under the exogenous influence: inflow has stabilized to zero
-    id_val = ZERO
     while len(to_search) > 0:
         sd = to_search.pop()
         if sd not in searched:
-            searched.append(sd)
-            if sd not in graph.keys():
+            searched.add(sd)
+            expanded.append(sd)
+            if sd not in graph:
                 graph[sd] = []
-            find_neighbors(graph, to_search, blacklist, sd, id_val)
+            find_neighbors(graph, to_search, blacklist, sd, phase.id_val, edges,
+                           transitions, stats)
+        elif stats is not None:
+            stats.count('duplicates')
+
+    if stats is not None:
+        stats.stop()
+    return expanded
+
+def record_phase(expanded_by, expanded, phase):
+    if expanded_by is not None:
+        for sd in expanded:
+            expanded_by.setdefault(sd, phase.name)
+
+def explore(phases, graph=None, workers=None, stats=None, expanded_by=None,
+            spaces=TUB_SPACES, propagate=False):
+    """
+     Build a state transition graph by running each phase in turn, over the
+     quantity spaces spaces.
+
+     If workers is given, the successors reachable from each phase's
+     frontier are first computed on a pool of that many processes; the
+     graph itself is still assembled in order, so it comes out the same.
+     This only pays off for other quantity spaces than TUB_SPACES, whose
+     tables start empty: the table of TUB_SPACES is compiled in full, so
+     workers are ignored there, with a warning.
+     If stats, an ExplorationStats, is given, every phase is recorded in it.
+     If expanded_by is a dict, it maps every state to the name of the
+     first phase that expanded it. If propagate is set, successors missing
+     from the transition table are found by constraint propagation (see
+     successor_generator).
+    """
+    if graph is None:
+        graph = {}
+    edges = set((parent, child) for parent in graph for child in graph[parent])
+    transitions = get_transitions(spaces, propagate)
+    if workers is not None and spaces is TUB_SPACES:
+        warnings.warn('workers have no effect on the compiled transition table '
+                      'of the tub', RuntimeWarning, stacklevel=2)
+        workers = None
+
+    if workers is None:
+        for phase in phases:
+            expanded = run_phase(graph, edges, phase, transitions, stats, spaces)
+            record_phase(expanded_by, expanded, phase)
+        return graph
+
+    from concurrent.futures import ProcessPoolExecutor
+    from parallel import prefetch_transitions
+    with ProcessPoolExecutor(workers) as pool:
+        for phase in phases:
+            prefetch_transitions(pool, transitions, phase.frontier(graph),
+                                 phase.id_val, workers, spaces)
+            expanded = run_phase(graph, edges, phase, transitions, stats, spaces)
+            record_phase(expanded_by, expanded, phase)
+    return graph
+
+def render(graph, output='state_graph.png', expanded_by=None, spaces=TUB_SPACES):
+    """
+     Plot the state graph to output, a .dot, .svg or .png file, or '-' for
+     DOT on stdout. Images need Graphviz; DOT output needs nothing. The
+     magnitudes are labelled with the values of the quantity spaces spaces.
+    """
+    from plot_graph import PlotGraph
 
-    print('The state graph generated by our model contains ' + str(len(graph.keys())) + ' distinct states.')
+    dot_graph = PlotGraph(graph, expanded_by, spaces)
+    dot_graph.generate_graph(TAP_ON)
+    dot_graph.save(output)
+    if output != '-':
+        print('See the state graph in ' + output + '.')
 
-    print('See the state graph in state_graph.png.')
-    dot_graph = PlotGraph(graph)
-    dot_graph.generate_graph(tap_on)
-    dot_graph.save()
+def view(graph, expanded_by=None, spaces=TUB_SPACES):
+    """
+     Show the state graph in the interactive viewer, with the magnitudes
+     labelled as in the quantity spaces spaces. Needs matplotlib and
+     networkx, and a display.
+    """
+    from GUI import StateVisualisation
 
-    dot_graph = StateVisualisation(graph)
-    dot_graph.set_name(tap_on)
-    dot_graph.generate_graph(tap_on)
+    dot_graph = StateVisualisation(graph, expanded_by, spaces)
+    dot_graph.set_name(TAP_ON)
+    dot_graph.generate_graph(TAP_ON)
     dot_graph.show_graph()
 
+# what to do with the graph once it is built, per mode
+MODES = {
+    'build': [],
+    'stats': [],
+    'render': ['render'],
+    'view': ['view'],
+    'all': ['render', 'view'],
+}
+
+def main(mode='all', stats=False, stats_json=None, output='state_graph.png',
+         save=None, load=None, propagate=False):
+    """
+     Build a state transition graph for an initially empty tub with an
+     exogenously determined parabolic increasing inflow.
+
+     mode is one of MODES: build only builds the graph, stats also prints
+     its exploration statistics, render plots it, view opens the viewer
+     and all (the default) does both. The plotting and viewing libraries
+     are only imported by the modes that use them. output is the file
+     render plots to.
+
+     If stats is set, a summary of the exploration is printed at the end;
+     if stats_json is a path, the statistics are written there as JSON.
+     If save is a path, the graph is written there as a graph file (see
+     graph_store.py). If load is a path, the graph is read from that graph
+     file instead of being built, and there are no statistics. propagate
+     is passed on to explore.
+    """
+    if mode == 'stats':
+        stats = True
+    exploration_stats = None
+    if (stats or stats_json) and load is None:
+        from instrumentation import ExplorationStats
+        exploration_stats = ExplorationStats()
+
+    # with DOT on stdout, keep the messages out of the way
+    messages = sys.stderr if output == '-' else sys.stdout
+
+    if load is not None:
+        from graph_store import open_graph
+        stored = open_graph(load)
+        graph = stored.to_dict()
+        expanded_by = stored.phase_map()
+        stored.close()
+        print('The state graph read from ' + load + ' contains ' + str(len(graph.keys())) + ' distinct states.',
+              file=messages)
+    else:
+        expanded_by = {}
+        graph = explore(TUB_PHASES, stats=exploration_stats,
+                        expanded_by=expanded_by, propagate=propagate)
+        print('The state graph generated by our model contains ' + str(len(graph.keys())) + ' distinct states.',
+              file=messages)
+
+    if save is not None:
+        from graph_store import save_graph
+        save_graph(save, graph, TAP_ON, expanded_by,
+                   {'model': 'tub', 'phases': [phase.name for phase in TUB_PHASES],
+                    'rules': get_transitions().key.hex()})
+        print('See the state graph file in ' + save + '.', file=messages)
+
+    if exploration_stats is not None:
+        if stats:
+            print(exploration_stats.summary(), file=messages)
+        if stats_json:
+            exploration_stats.to_json(stats_json)
+            print('See the exploration statistics in ' + stats_json + '.',
+                  file=messages)
+
+    if 'render' in MODES[mode]:
+        render(graph, output, expanded_by)
+    if 'view' in MODES[mode]:
+        view(graph, expanded_by)
+
+    return graph
+
+def parse_args(argv=None):
+    import argparse
+
+    def add_options(parser, default):
+        parser.add_argument('--stats', action='store_true', default=default(False),
+                            help='print exploration counters and timings')
+        parser.add_argument('--stats-json', metavar='PATH', default=default(None),
+                            help='write exploration counters and timings as JSON')
+        parser.add_argument('--propagate', action='store_true', default=default(False),
+                            help='compute missing transitions by constraint propagation')
+
+    parser = argparse.ArgumentParser(
+        description='Build the state graph of the tub. Without a mode, the '
+                    'graph is rendered to state_graph.png and shown.')
+    add_options(parser, lambda value: value)
+    # options may also follow the mode; don't let the subparsers reset them
+    common = argparse.ArgumentParser(add_help=False)
+    add_options(common, lambda value: argparse.SUPPRESS)
+
+    modes = parser.add_subparsers(dest='mode', metavar='mode')
+    build_mode = modes.add_parser('build', parents=[common],
+                                  help='only build the graph (no plotting libraries needed)')
+    build_mode.add_argument('-o', '--output', dest='save', metavar='PATH',
+                            help='write the graph to a graph file')
+    render_mode = modes.add_parser('render', parents=[common],
+                                   help='plot the graph to state_graph.png')
+    render_mode.add_argument('-o', '--output', default='state_graph.png',
+                             help='a .dot, .svg or .png file, or - for DOT '
+                                  'on stdout (default: state_graph.png)')
+    view_mode = modes.add_parser('view', parents=[common],
+                                 help='show the graph in the interactive viewer')
+    for mode in (render_mode, view_mode):
+        mode.add_argument('-i', '--input', dest='load', metavar='PATH',
+                          help='read the graph from a graph file written by '
+                               'build -o instead of building it')
+    modes.add_parser('stats', parents=[common],
+                     help='build the graph and print exploration statistics')
+
+    args = parser.parse_args(argv)
+    if args.mode is None:
+        args.mode = 'all'
+    if args.mode != 'render':
+        args.output = 'state_graph.png'
+    if args.mode != 'build':
+        args.save = None
+    if args.mode not in ('render', 'view'):
+        args.load = None
+    return args
+
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    main(args.mode, args.stats, args.stats_json, args.output, args.save, args.load,
+         args.propagate)
@@ -0,0 +1,522 @@
+'''
+Symbolic exploration of qualitative models with binary decision diagrams.
+
+A state is a tuple of slots, each holding one value of a small space; a
+set of states is a BDD over their bits (see bdd.py). Slot k is stored in
+as few bits as its space needs, as the offset of its value from the
+smallest one. The transition relation T(x, x') pairs the bits of a state x
+with those of a successor x'; the variables are interleaved, x bit then x'
+bit, which keeps the relation small.
+
+T is the conjunction of local relations, each over the few slots one rule
+looks at, and built by evaluating that rule on every combination of their
+values. So T allows exactly the successors the explicit rules compute, and
+the successors of a whole set of states come out of one image computation,
+exists x . S(x) and T(x, x'). Reachable sets are fixpoints of the image.
+States are only enumerated when asked for, to plot them or to extract paths.
+
+There are two front ends:
+
+    SymbolicTub     the tub of state_graph.py over any TubSpaces, with
+                    the rules of state_graph.py and plausibility.rules
+    SymbolicModel   any qr_model.Model, from its quantity spaces,
+                    correspondences, influences and proportionalities
+
+Reachable sets are the complete sets of states reachable under one
+exogenous input, without the blacklists with which the explicit phases of
+state_graph.py prune their search; every state of the explicit tub graph
+is in them. The BDD package is pure Python, so building T takes far longer
+than building the small graphs of the tub explicitly; the symbolic search
+pays off only for models whose graphs are too large to list, such as long
+chains of tubs.
+
+To compare both front ends with the explicit graphs, execute
+
+    python symbolic.py [--tubs N]
+'''
+
+import argparse
+import time
+
+from bdd import BDD, FALSE, TRUE
+from qr_model import DERIVATIVES, tub_chain
+from state_description import *
+from state_graph import (ID_SPACE, PLAUSIBILITY, TUB_SPACES, VD_SPACE,
+                         check_epsilon_ordering, determine_iq, determine_vd,
+                         determine_vq)
+
+class SymbolicSystem:
+    """
+     Sets of states and transition relations over a fixed list of slots.
+     domains gives the values each slot can hold; the relations are built
+     by the subclasses.
+    """
+    def __init__(self, domains):
+        self.domains = [sorted(domain) for domain in domains]
+        self.lows = [domain[0] for domain in self.domains]
+        self.widths = [max(1, (domain[-1] - domain[0]).bit_length())
+                       for domain in self.domains]
+        self.starts = []
+        start = 0
+        for width in self.widths:
+            self.starts.append(start)
+            start += width
+        self.bdd = BDD(2 * start)
+        self.current_vars = [self.variable(slot, bit)
+                             for slot in range(len(self.domains))
+                             for bit in range(self.widths[slot])]
+        self.next_vars = [var + 1 for var in self.current_vars]
+        self.current = frozenset(self.current_vars)
+        self.next_to_current = dict(zip(self.next_vars, self.current_vars))
+        self.current_to_next = dict(zip(self.current_vars, self.next_vars))
+
+    def variable(self, slot, bit, primed=False):
+        ''' The BDD variable of a bit of a slot of x, or of x' if primed. '''
+        return 2 * (self.starts[slot] + bit) + (1 if primed else 0)
+
+    def relation(self, slots, predicate):
+        """
+         ([(int, bool)], function) -> BDD
+
+         The relation over the (slot, primed) pairs in slots that holds for
+         the value tuples predicate accepts, built by Shannon expansion
+         over their bits in variable order. Values outside a slot's domain
+         are rejected without asking predicate.
+        """
+        bits = sorted((self.variable(slot, bit, primed), k, bit)
+                      for k, (slot, primed) in enumerate(slots)
+                      for bit in range(self.widths[slot]))
+        domains = [set(self.domains[slot]) for slot, _ in slots]
+        lows = [self.lows[slot] for slot, _ in slots]
+        codes = [0] * len(slots)
+
+        def build(i):
+            if i == len(bits):
+                values = [code + low for code, low in zip(codes, lows)]
+                if not all(value in domain for value, domain in zip(values, domains)):
+                    return FALSE
+                return TRUE if predicate(*values) else FALSE
+            var, k, bit = bits[i]
+            low = build(i + 1)
+            codes[k] |= 1 << bit
+            high = build(i + 1)
+            codes[k] &= ~(1 << bit)
+            return self.bdd.node(var, low, high)
+
+        return build(0)
+
+    def valid(self, primed=False):
+        ''' The states of x, or of x' if primed, whose slots lie in their domains. '''
+        return self.bdd.conjoin([self.relation([(slot, primed)], lambda value: True)
+                                 for slot in range(len(self.domains))])
+
+    def moves(self):
+        ''' The relation of x' differing from x. '''
+        same = TRUE
+        for var in reversed(self.current_vars):
+            same = self.bdd.and_(self.bdd.equiv(self.bdd.var(var),
+                                                self.bdd.var(self.current_to_next[var])),
+                                 same)
+        return self.bdd.not_(same)
+
+    def set_of(self, states):
+        ''' The BDD of a collection of value tuples. '''
+        result = FALSE
+        for values in states:
+            assignment = {}
+            for slot, value in enumerate(values):
+                code = value - self.lows[slot]
+                for bit in range(self.widths[slot]):
+                    assignment[self.variable(slot, bit)] = code >> bit & 1
+            result = self.bdd.or_(result, self.bdd.cube(assignment))
+        return result
+
+    def decode(self, bits):
+        ''' The value tuple of the bits of one state, in variable order. '''
+        values = []
+        k = 0
+        for slot, width in enumerate(self.widths):
+            code = sum(bit << b for b, bit in enumerate(bits[k:k + width]))
+            values.append(code + self.lows[slot])
+            k += width
+        return tuple(values)
+
+    def members(self, states):
+        ''' The value tuples of a set, in variable order. '''
+        return [self.decode(bits)
+                for bits in self.bdd.satisfy_all(states, self.current_vars)]
+
+    def count(self, states):
+        ''' The number of states in a set, without enumerating them. '''
+        return self.bdd.count(states, self.current_vars)
+
+    def post(self, states, relation):
+        ''' The successors of a set of states under a relation. '''
+        successors = self.bdd.and_exists(states, relation, self.current)
+        return self.bdd.rename(successors, self.next_to_current)
+
+    def reach(self, states, relation):
+        ''' Every state reachable from states under a relation, states included. '''
+        reached = states
+        frontier = states
+        while frontier != FALSE:
+            frontier = self.bdd.diff(self.post(frontier, relation), reached)
+            reached = self.bdd.or_(reached, frontier)
+        return reached
+
+    def transitions(self, states, relation):
+        """
+         (BDD, BDD) -> {(int, ...): [(int, ...)]}
+
+         The transitions under relation between states of a set.
+        """
+        pairs = self.bdd.conjoin([states,
+                                  self.bdd.rename(states, self.current_to_next),
+                                  relation])
+        graph = dict((values, []) for values in self.members(states))
+        for bits in self.bdd.satisfy_all(pairs, self.current_vars + self.next_vars):
+            # the variables interleave x and x' bits
+            graph[self.decode(bits[0::2])].append(self.decode(bits[1::2]))
+        return graph
+
+class SymbolicTub(SymbolicSystem):
+    """
+     The tub of state_graph.py over the quantity spaces spaces, with one
+     slot per parameter of a State_Description:
+
+        valid       x lies in the quantity spaces and obeys the correspondences
+        iq, vq, vd  determine_iq, determine_vq and determine_vd
+        links       the correspondences and proportionalities of x'
+        epsilon     check_epsilon_ordering
+        id_val      the exogenous derivative of inflow of x'
+        plausible   none of the rules matches x', as spaces.coarse sees it
+        moves       x' differs from x
+    """
+    def __init__(self, rules=PLAUSIBILITY, spaces=TUB_SPACES):
+        SymbolicSystem.__init__(self, [spaces.iq_space, ID_SPACE] +
+                                4 * [spaces.vq_space, VD_SPACE])
+        self.rules = rules
+        self.spaces = spaces
+        self.core = self.conjoin_core()
+        self.relations = {}
+
+    def coarse(self, param, value):
+        ''' A value of param as the plausibility rules see it. '''
+        if param == IQ:
+            return self.spaces.iq_coarse[value]
+        if param in (VQ, OQ, HQ, PQ):
+            return self.spaces.vq_coarse[value]
+        return value
+
+    def conjoin_core(self):
+        ''' The part of the transition relation that does not depend on id_val. '''
+        spaces = self.spaces
+
+        def equal(a, b):
+            return a == b
+
+        # x is a tub state: its values lie in their spaces, and the volume
+        # determines outflow, height and pressure
+        relations = [self.valid(), self.valid(True)]
+        for q, d in ((OQ, OD), (HQ, HD), (PQ, PD)):
+            relations.append(self.relation([(VQ, False), (q, False)], equal))
+            relations.append(self.relation([(VD, False), (d, False)], equal))
+
+        def iq(iq, id_val, new_iq):
+            params = [0] * N_PARAMS
+            params[IQ], params[ID] = iq, id_val
+            return new_iq in determine_iq(params, spaces)
+        relations.append(self.relation([(IQ, False), (ID, False), (IQ, True)], iq))
+
+        def vq(vq, vd, new_vq):
+            params = [0] * N_PARAMS
+            params[VQ], params[VD] = vq, vd
+            return new_vq in determine_vq(params, spaces)
+        relations.append(self.relation([(VQ, False), (VD, False), (VQ, True)], vq))
+
+        # the correspondences and proportionalities carry volume over to the
+        # quantities and derivatives of outflow, height and pressure
+        for q, d in ((OQ, OD), (HQ, HD), (PQ, PD)):
+            relations.append(self.relation([(VQ, True), (q, True)], equal))
+            relations.append(self.relation([(VD, True), (d, True)], equal))
+
+        def vd(id_val, od, vd, new_iq, new_oq, new_vd):
+            params = [0] * N_PARAMS
+            params[ID], params[OD], params[VD] = id_val, od, vd
+            new_params = [0] * N_PARAMS
+            new_params[IQ], new_params[OQ] = new_iq, new_oq
+            return new_vd in determine_vd(params, new_params)
+        relations.append(self.relation([(ID, False), (OD, False), (VD, False),
+                                        (IQ, True), (OQ, True), (VD, True)], vd))
+
+        def epsilon(iq, id_val, vq, vd, new_iq, new_id, new_vq, new_vd):
+            params = [0] * N_PARAMS
+            params[IQ], params[ID], params[VQ], params[VD] = iq, id_val, vq, vd
+            new_params = [0] * N_PARAMS
+            new_params[IQ], new_params[ID] = new_iq, new_id
+            new_params[VQ], new_params[VD] = new_vq, new_vd
+            return check_epsilon_ordering(params, new_params, spaces)
+        relations.append(self.relation([(IQ, False), (ID, False), (VQ, False),
+                                        (VD, False), (IQ, True), (ID, True),
+                                        (VQ, True), (VD, True)], epsilon))
+
+        # no rule of plausibility.rules may match x'
+        for rule in self.rules.rules:
+            terms = []
+            for param, allowed in rule.unary.items():
+                terms.append(self.relation(
+                    [(param, True)],
+                    lambda v, param=param, allowed=allowed:
+                        self.coarse(param, v) in allowed))
+            for (a, b), checks in rule.binary.items():
+                terms.append(self.relation(
+                    [(a, True), (b, True)],
+                    lambda x, y, a=a, b=b, checks=checks:
+                        all(check(self.coarse(a, x), self.coarse(b, y))
+                            for check in checks)))
+            relations.append(self.bdd.not_(self.bdd.conjoin(terms)))
+
+        relations.append(self.moves())
+        return self.bdd.conjoin(relations)
+
+    def transition_relation(self, id_val):
+        ''' T(x, x') under the exogenous derivative of inflow id_val. '''
+        if id_val not in self.relations:
+            fixed = self.relation([(ID, True)], lambda new_id: new_id == id_val)
+            self.relations[id_val] = self.bdd.and_(self.core, fixed)
+        return self.relations[id_val]
+
+    def state_set(self, states):
+        ''' The BDD of a collection of State_Descriptions. '''
+        return self.set_of(sd.get_all_params() for sd in states)
+
+    def image(self, states, id_val):
+        ''' The successors of a set of states, as a set of states. '''
+        return self.post(states, self.transition_relation(id_val))
+
+    def reachable(self, states, id_val):
+        ''' Every state reachable from states under id_val, states included. '''
+        return self.reach(states, self.transition_relation(id_val))
+
+    def explore_profile(self, start, id_vals):
+        """
+         ([State_Description], [int]) -> [BDD]
+
+         Run an inflow profile: every phase starts from everything reached
+         so far and adds what is reachable under its id_val. Returns the
+         set reached after each phase.
+        """
+        reached = self.state_set(start)
+        result = []
+        for id_val in id_vals:
+            reached = self.reachable(reached, id_val)
+            result.append(reached)
+        return result
+
+    def states(self, states):
+        ''' The State_Descriptions of a set. '''
+        return [State_Description(list(values)) for values in self.members(states)]
+
+    def edges(self, states, id_val):
+        """
+         ({State_Description: [State_Description]}) of the transitions
+         under id_val between states of a set, for plotting or paths.
+        """
+        graph = self.transitions(states, self.transition_relation(id_val))
+        return dict((State_Description(list(sd)),
+                     [State_Description(list(new)) for new in successors])
+                    for sd, successors in graph.items())
+
+class SymbolicModel(SymbolicSystem):
+    """
+     A qr_model.Model, with the slots of its states (q0, d0, q1, d1, ...):
+
+        valid       magnitudes index their spaces, derivatives are
+                    NEG, ZERO or POS
+        continuity  every new magnitude is continuous with the old one, and
+                    a correspondence class shares its new magnitude
+        epsilon     while a quantity leaves a point, those on intervals
+                    keep their magnitudes
+        derivatives derivative_options of every quantity, given the new
+                    magnitudes and derivatives it depends on
+        blocks      no derivative pushes a point out of its space
+        moves       x' differs from x
+
+     The derivative relations depend on the exogenous inputs, so they are
+     built once per exogenous mapping.
+    """
+    def __init__(self, model):
+        domains = []
+        for space in model.spaces:
+            domains.append(range(len(space)))
+            domains.append(DERIVATIVES)
+        SymbolicSystem.__init__(self, domains)
+        self.model = model
+        self.core = self.conjoin_core()
+        self.relations = {}
+
+    def conjoin_core(self):
+        ''' The part of the transition relation that does not depend on the inputs. '''
+        model = self.model
+        classes = model.compile()[0]
+        relations = [self.valid(), self.valid(True)]
+
+        for members in classes:
+            for i in members:
+                space = model.spaces[i]
+                relations.append(self.relation(
+                    [(2 * i, False), (2 * i + 1, False), (2 * i, True)],
+                    lambda q, d, new_q, space=space: new_q in space.next_values(q, d)))
+                if i != members[0]:
+                    relations.append(self.relation(
+                        [(2 * members[0], True), (2 * i, True)],
+                        lambda a, b: a == b))
+
+        # if any quantity leaves a point, no quantity can leave an interval
+        # at the same time
+        leaving = FALSE
+        for i, space in enumerate(model.spaces):
+            leaving = self.bdd.or_(leaving, self.relation(
+                [(2 * i, False), (2 * i + 1, False)],
+                lambda q, d, space=space: space.leaves(q, d)))
+        for i, space in enumerate(model.spaces):
+            kept = self.relation(
+                [(2 * i, False), (2 * i, True)],
+                lambda q, new_q, space=space: space.is_point(q) or new_q == q)
+            relations.append(self.bdd.or_(self.bdd.not_(leaving), kept))
+
+        for i, space in enumerate(model.spaces):
+            relations.append(self.relation(
+                [(2 * i, True), (2 * i + 1, True)],
+                lambda q, d, space=space: not space.blocks(q, d)))
+
+        relations.append(self.moves())
+        return self.bdd.conjoin(relations)
+
+    def derivative_relation(self, i, exogenous):
+        ''' The derivatives quantity i may take, as derivative_options allows. '''
+        model = self.model
+        classes, influenced, proportional, order = model.compile()
+        n = len(model.quantities)
+        if model.quantities[i] in exogenous:
+            sources = []
+        elif i in influenced:
+            sources = [(2 * s, True) for s in sorted(set(s for s, _ in influenced[i]))]
+        elif i in proportional:
+            sources = [(2 * s + 1, True) for s in sorted(set(s for s, _ in proportional[i]))]
+        else:
+            sources = []
+
+        def allowed(old, *values):
+            state = [ZERO] * (2 * n)
+            state[2 * i + 1] = old
+            new = [ZERO] * (2 * n)
+            for (slot, _), value in zip(sources, values):
+                new[slot] = value
+            return values[-1] in model.derivative_options(i, state, new, influenced,
+                                                          proportional, exogenous)
+        return self.relation([(2 * i + 1, False)] + sources + [(2 * i + 1, True)],
+                             allowed)
+
+    def transition_relation(self, exogenous=None):
+        ''' T(x, x') under the exogenous derivatives, by quantity name. '''
+        if exogenous is None:
+            exogenous = {}
+        key = tuple(sorted(exogenous.items()))
+        if key not in self.relations:
+            self.relations[key] = self.bdd.conjoin(
+                [self.core] + [self.derivative_relation(i, exogenous)
+                               for i in range(len(self.model.quantities))])
+        return self.relations[key]
+
+    def state_set(self, states):
+        ''' The BDD of a collection of model states. '''
+        return self.set_of(states)
+
+    def image(self, states, exogenous=None):
+        ''' The successors of a set of states, as a set of states. '''
+        return self.post(states, self.transition_relation(exogenous))
+
+    def reachable(self, states, exogenous=None):
+        ''' Every state reachable from states under exogenous, states included. '''
+        return self.reach(states, self.transition_relation(exogenous))
+
+    def states(self, states):
+        ''' The model states of a set. '''
+        return self.members(states)
+
+    def edges(self, states, exogenous=None):
+        """
+         ({(int, ...): [(int, ...)]}) of the transitions under exogenous
+         between states of a set, for plotting or paths.
+        """
+        return self.transitions(states, self.transition_relation(exogenous))
+
+def compare_tub():
+    import state_graph
+
+    begin = time.perf_counter()
+    tub = SymbolicTub()
+    built = time.perf_counter()
+    id_vals = [phase.id_val for phase in state_graph.TUB_PHASES]
+    reached = tub.explore_profile([state_graph.TAP_ON], id_vals)
+    explored = time.perf_counter() - built
+    print('Built the transition relation of the tub in ' +
+          '{:.1f}'.format(1e3 * (built - begin)) + ' ms (' +
+          str(tub.bdd.size(tub.core)) + ' nodes).')
+    for phase, states in zip(state_graph.TUB_PHASES, reached):
+        print('after ' + phase.name + ': ' + str(tub.count(states)) + ' states reachable')
+    print('Explored the profile in ' + '{:.1f}'.format(1e3 * explored) + ' ms.')
+
+    begin = time.perf_counter()
+    graph = state_graph.explore(state_graph.TUB_PHASES)
+    elapsed = time.perf_counter() - begin
+    symbolic = set(tub.states(reached[-1]))
+    missing = [sd for sd in graph if sd not in symbolic]
+    print('The explicit graph has ' + str(len(graph)) + ' states, ' +
+          str(len(missing)) + ' of which the symbolic search did not reach; it took ' +
+          '{:.1f}'.format(1e3 * elapsed) + ' ms.')
+
+def compare_chains(max_tubs, max_explicit):
+    print('tubs  states       build ms   reach ms   explicit ms  same')
+    for n in range(1, max_tubs + 1):
+        model = tub_chain(n)
+        start = model.state({'inflow': (ZERO, POS)})
+        exogenous = {'inflow': POS}
+
+        begin = time.perf_counter()
+        symbolic = SymbolicModel(model)
+        relation = symbolic.transition_relation(exogenous)
+        built = time.perf_counter()
+        reached = symbolic.reachable(symbolic.state_set([start]), exogenous)
+        explored = time.perf_counter()
+        row = str(n).ljust(6) + str(symbolic.count(reached)).ljust(13) + \
+            '{:.1f}'.format(1e3 * (built - begin)).ljust(11) + \
+            '{:.1f}'.format(1e3 * (explored - built)).ljust(11)
+
+        if n <= max_explicit:
+            graph = model.explore(start, exogenous)
+            elapsed = time.perf_counter() - explored
+            same = set(symbolic.states(reached)) == set(graph) and \
+                dict((state, sorted(successors)) for state, successors in
+                     symbolic.edges(reached, exogenous).items()) == \
+                dict((state, sorted(successors)) for state, successors in graph.items())
+            row += '{:.1f}'.format(1e3 * elapsed).ljust(13) + ('yes' if same else 'NO')
+        else:
+            row += '-'.ljust(13) + '-'
+        print(row)
+
+def main():
+    parser = argparse.ArgumentParser(description='Explore models symbolically and '
+                                     'compare with the explicit graphs.')
+    parser.add_argument('--tubs', type=int, default=6,
+                        help='the longest chain of tubs to explore (default 6)')
+    parser.add_argument('--explicit', type=int, default=3,
+                        help='the longest chain to also explore explicitly (default 3)')
+    args = parser.parse_args()
+    compare_tub()
+    print('')
+    compare_chains(args.tubs, args.explicit)
+
+if __name__ == '__main__':
+    main()
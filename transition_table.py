@@ -0,0 +1,139 @@
+'''
+Precomputed transition table for the tub model.
+
+The state space of the tub is small and fixed, so the successors of every
+(state, id_val) pair can be computed once and stored on disk. The table is
+keyed by a fingerprint of the rule set, so editing any rule invalidates it.
+'''
+
+import hashlib
+import inspect
+import os
+import struct
+
+from state_description import State_Description
+
+MAGIC = b'QRTT'
+VERSION = 1
+# magic, version, 20 byte sha1 key, number of entries
+HEADER = struct.Struct('<4sH20sI')
+# state code, id_val, number of successors
+ENTRY = struct.Struct('<Ibb')
+CODE = struct.Struct('<I')
+
+def rules_key(rules, *extra):
+    """
+     ([function], ...) -> bytes
+
+     Fingerprint a rule set by the source code of its functions and the
+     repr of any extra configuration (quantity spaces, rule files, ...).
+    """
+    digest = hashlib.sha1()
+    for rule in rules:
+        digest.update(inspect.getsource(rule).encode('utf-8'))
+    for item in extra:
+        digest.update(repr(item).encode('utf-8'))
+    return digest.digest()
+
+class TransitionTable:
+    """
+     Successor lists of (state code, id_val) pairs.
+
+     Lookups that miss the table fall back to generate(params, id_val),
+     which must return the successor codes, and are memoized in memory.
+    """
+    def __init__(self, key, generate, entries=None):
+        self.key = key
+        self.generate = generate
+        self.entries = {}
+        # successors are handed out as shared, immutable state descriptions
+        self.states = {}
+        if entries is not None:
+            for pair, codes in entries.items():
+                self.add(pair, codes)
+
+    def add(self, pair, codes):
+        self.entries[pair] = tuple(codes)
+        self.states[pair] = tuple(self.state(code) for code in codes)
+
+    def state(self, code):
+        return State_Description.from_code(code)
+
+    def compile(self, states, id_vals):
+        ''' Compute the successors of every state under every id_val. '''
+        for sd in states:
+            for id_val in id_vals:
+                pair = (sd.get_code(), id_val)
+                self.add(pair, self.generate(sd.get_all_params(), id_val))
+
+    def successors(self, sd, id_val):
+        ''' Return the successors of sd under the exogenous id_val. '''
+        pair = (sd.get_code(), id_val)
+        try:
+            return self.states[pair]
+        except KeyError:
+            self.add(pair, self.generate(sd.get_all_params(), id_val))
+            return self.states[pair]
+
+    def save(self, path):
+        ''' Write the table to path in a compact binary format. '''
+        chunks = [HEADER.pack(MAGIC, VERSION, self.key, len(self.entries))]
+        for (code, id_val), codes in sorted(self.entries.items()):
+            chunks.append(ENTRY.pack(code, id_val, len(codes)))
+            chunks.extend(CODE.pack(c) for c in codes)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(chunks))
+        os.replace(tmp_path, path)
+
+def load_table(path, key, generate):
+    """
+     (str, bytes, function) -> TransitionTable or None
+
+     Read a table from path. Returns None if there is no table, if it is
+     corrupt, or if it was compiled from a different rule set.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, stored_key, count = HEADER.unpack_from(data, 0)
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or version != VERSION or stored_key != key:
+        return None
+
+    entries = {}
+    offset = HEADER.size
+    try:
+        for _ in range(count):
+            code, id_val, n = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            codes = struct.unpack_from('<' + n * 'I', data, offset)
+            offset += n * CODE.size
+            entries[(code, id_val)] = codes
+    except struct.error:
+        return None
+
+    return TransitionTable(key, generate, entries)
+
+def load_or_compile(path, key, generate, states, id_vals):
+    """
+     Load the table at path, or compile it and write it to path if it is
+     missing or stale.
+    """
+    table = load_table(path, key, generate)
+    if table is None:
+        table = TransitionTable(key, generate)
+        table.compile(states, id_vals)
+        try:
+            table.save(path)
+        except OSError:
+            # a read-only checkout can still use the in-memory table
+            pass
+    return table
+
+if __name__ == '__main__':
+    import state_graph
+    state_graph.compile_transitions(force=True)
+    print('Compiled the transition table to ' + state_graph.TABLE_PATH + '.')